@@ -0,0 +1,264 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+from utils.helpers import muted_conversation
+from utils.text import normalize, stem, tokenize
+
+# Formas equivalentes de los conceptos que más se repiten en las consultas
+SYNONYMS = {
+    "valor": "precio", "costo": "precio", "cuesta": "precio", "vale": "precio",
+    "m2": "metro cuadrado", "mt2": "metro cuadrado", "mts2": "metro cuadrado",
+    "depto": "departamento", "deptos": "departamentos",
+    "alquiler": "arriendo", "arrendar": "arriendo"
+}
+# Palabras que no cambian la pregunta
+FILLERS = frozenset("hoy actual actualmente ahora cuanto dime saber quisiera favor".split())
+
+def query_terms(query: str) -> List[str]:
+    """
+    Términos de una consulta para compararla con otras: sin tildes, palabras vacías ni de
+    relleno, con los sinónimos unificados y reducidos a su raíz aproximada.
+    """
+    words = " ".join(SYNONYMS.get(word, word) for word in tokenize(query) if word not in FILLERS)
+    return [stem(word) for word in tokenize(words)]
+
+class CachedAnswer:
+    """
+    Respuesta guardada que coincide con una consulta.
+    """
+    def __init__(self, key: str, query: str, answer: str, similarity: float, created_at: float):
+        self.key = key
+        self.query = query
+        self.answer = answer
+        self.similarity = similarity
+        self.created_at = created_at
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.created_at
+
+class AnswerCache:
+    """
+    Caché persistente (SQLite) de respuestas completas, consultada por similitud: cada
+    consulta se representa con TF-IDF sobre sus términos y coincide con una guardada si
+    la similitud coseno alcanza el umbral y ambas mencionan las mismas cifras. Los
+    vectores se mantienen en memoria; las respuestas, en CACHE_DIR/answers.sqlite3.
+    """
+    def __init__(self, cache_dir: str = ".cache", similarity: float = 0.85, ttl: float = 86400,
+                 refresh_after: float = 0, max_entries: int = 1000):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "answers.sqlite3")
+        self.similarity = similarity
+        self.ttl = ttl
+        # Antigüedad a partir de la cual un acierto recalcula la respuesta en segundo plano (0 = nunca)
+        self.refresh_after = refresh_after
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        self._vectors: Dict[str, Counter] = {}
+        self._frequencies: Counter = Counter()
+        self._refreshing = set()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("DELETE FROM answers WHERE expires_at < ?", (time.time(),))
+        self._conn.commit()
+        for key, query in self._conn.execute("SELECT key, query FROM answers").fetchall():
+            self._add_vector(key, query)
+
+    @staticmethod
+    def make_key(query: str) -> str:
+        return normalize(query)
+
+    @staticmethod
+    def numbers(terms: Counter) -> frozenset:
+        return frozenset(term for term in terms if any(c.isdigit() for c in term))
+
+    def _add_vector(self, key: str, query: str) -> None:
+        self._remove_vector(key)
+        vector = Counter(query_terms(query))
+        self._vectors[key] = vector
+        self._frequencies.update(vector.keys())
+
+    def _remove_vector(self, key: str) -> None:
+        vector = self._vectors.pop(key, None)
+        if vector is not None:
+            self._frequencies.subtract(vector.keys())
+
+    def _weights(self, vector: Counter) -> Dict[str, float]:
+        total = len(self._vectors) + 1
+        return {term: count * (math.log(total / (self._frequencies[term] + 1)) + 1)
+                for term, count in vector.items()}
+
+    def _similarity(self, first: Dict[str, float], second: Dict[str, float]) -> float:
+        dot = sum(weight * second[term] for term, weight in first.items() if term in second)
+        norms = math.sqrt(sum(w * w for w in first.values())) * math.sqrt(sum(w * w for w in second.values()))
+        return dot / norms if norms else 0.0
+
+    def _matches(self, query: str, threshold: float) -> List[tuple]:
+        """
+        Claves de las consultas guardadas que coinciden con la consulta, de mayor a menor
+        similitud, como pares (similitud, clave).
+        """
+        vector = Counter(query_terms(query))
+        if not vector:
+            return []
+        numbers = self.numbers(vector)
+        weights = self._weights(vector)
+        matches = []
+        for key, other in self._vectors.items():
+            if self.numbers(other) != numbers:
+                continue
+            similarity = self._similarity(weights, self._weights(other))
+            if similarity >= threshold:
+                matches.append((similarity, key))
+        return sorted(matches, reverse=True)
+
+    def lookup(self, query: str) -> Optional[CachedAnswer]:
+        """
+        Retorna la respuesta guardada más parecida a la consulta si alcanza el umbral de
+        similitud y no ha expirado.
+        """
+        now = time.time()
+        with self._lock:
+            for similarity, key in self._matches(query, self.similarity):
+                row = self._conn.execute(
+                    "SELECT query, answer, created_at, expires_at FROM answers WHERE key = ?", (key,)
+                ).fetchone()
+                # Sin fila la entrada se invalidó desde otro proceso
+                if row is None or row[3] < now:
+                    self._remove_vector(key)
+                    if row is not None:
+                        self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                        self._conn.commit()
+                    continue
+                self.hits += 1
+                return CachedAnswer(key, row[0], row[1], similarity, row[2])
+            self.misses += 1
+            return None
+
+    def store(self, query: str, answer: str) -> None:
+        """
+        Guarda la respuesta de una consulta (reemplaza la de la misma consulta) y elimina
+        las más antiguas si se supera el número máximo de entradas.
+        """
+        key = self.make_key(query)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, query, answer, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, query, answer, now, now + self.ttl)
+            )
+            self._add_vector(key, query)
+            excess = len(self._vectors) - self.max_entries
+            if excess > 0:
+                oldest = self._conn.execute(
+                    "SELECT key FROM answers ORDER BY created_at ASC LIMIT ?", (excess,)
+                ).fetchall()
+                for (old_key,) in oldest:
+                    self._conn.execute("DELETE FROM answers WHERE key = ?", (old_key,))
+                    self._remove_vector(old_key)
+            self._conn.commit()
+
+    def needs_refresh(self, entry: CachedAnswer) -> bool:
+        return self.refresh_after > 0 and entry.age >= self.refresh_after
+
+    def refresh(self, entry: CachedAnswer, compute: Callable[[str], Optional[str]]) -> bool:
+        """
+        Recalcula en segundo plano la respuesta de la consulta guardada con compute, sin
+        registrar pensamientos en la conversación. compute retorna None si la respuesta
+        no debe guardarse. Retorna False si la entrada ya se está recalculando.
+        """
+        with self._lock:
+            if entry.key in self._refreshing:
+                return False
+            self._refreshing.add(entry.key)
+            self.refreshes += 1
+
+        def run():
+            try:
+                with muted_conversation():
+                    answer = compute(entry.query)
+                if answer is not None:
+                    self.store(entry.query, answer)
+            except Exception as e:
+                print(f"Error al recalcular la respuesta de '{entry.query}': {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(entry.key)
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def invalidate(self, query: str = None, similarity: float = None) -> int:
+        """
+        Elimina las respuestas guardadas cuya consulta coincide con query (con el umbral
+        indicado o el de la caché), o todas si no se indica query. Retorna las eliminadas.
+        """
+        with self._lock:
+            if query is None:
+                keys = list(self._vectors)
+            else:
+                threshold = self.similarity if similarity is None else similarity
+                keys = [key for _, key in self._matches(query, threshold)]
+            for key in keys:
+                self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                self._remove_vector(key)
+            self._conn.commit()
+            return len(keys)
+
+    def entries(self) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT query, created_at, expires_at FROM answers ORDER BY created_at DESC"
+            ).fetchall()
+        return [{"query": query, "created_at": created, "expires_at": expires} for query, created, expires in rows]
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Retorna aciertos, fallos, respuestas recalculadas y entradas de la caché.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "refreshes": self.refreshes,
+                "entries": len(self._vectors)
+            }
+
+if __name__ == "__main__":
+    import sys
+
+    # Uso: PYTHONPATH=src python -m agents.answer_cache <CACHE_DIR> [listar | invalidar <consulta> | invalidar --todo]
+    if len(sys.argv) < 3 or sys.argv[2] not in ("listar", "invalidar"):
+        print("Uso: PYTHONPATH=src python -m agents.answer_cache <CACHE_DIR> "
+              "[listar | invalidar <consulta> | invalidar --todo]")
+        sys.exit(1)
+    cache = AnswerCache(sys.argv[1])
+    if sys.argv[2] == "listar":
+        for entry in cache.entries():
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['created_at']))} "
+                  f"(expira {time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['expires_at']))}) {entry['query']}")
+    else:
+        query = " ".join(sys.argv[3:])
+        if not query:
+            print("Indique la consulta a invalidar o --todo")
+            sys.exit(1)
+        removed = cache.invalidate(None if query == "--todo" else query)
+        print(f"{removed} respuestas eliminadas")
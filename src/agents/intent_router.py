@@ -0,0 +1,236 @@
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from utils.text import stem, tokenize
+
+# Expertos que decide el ruteo
+LABELS = ("legal", "market")
+
+# Palabras que indican la participación de cada experto
+LEXICON = {
+    "legal": """ley leyes legal normativa norma reglamento contrato escritura notaria notario herencia
+        heredar heredado heredero posesion sucesion tramite requisito regularizar ordenanza impuesto contribuciones tributario copropiedad permiso municipal
+        subdivision desalojo arrendatario garantia clausula derecho conservador inscripcion dominio
+        hipoteca embargo juicio abogado dfl2 sii""",
+    "market": """precio valor mercado arriendo rentabilidad plusvalia tasacion m2 uf inversion invertir
+        tendencia oferta venta vender comprar compra retorno credito dividendo tasa costo cuesta vale
+        avaluo barrio"""
+}
+_LEXICON_STEMS = {label: {stem(word) for word in tokenize(words, stopwords=True)}
+                  for label, words in LEXICON.items()}
+
+# Modelo por defecto: solo el léxico. Con un término del léxico la probabilidad de llamar
+# al experto es 0.82 y con dos, 0.99; sin ninguno es 0.12
+DEFAULT_MODEL = {label: {"bias": -2.0, "weights": {f"lex:{label}": 3.5}} for label in LABELS}
+# Confianza máxima sobre un experto sin evidencia propia cuando la consulta sí tiene
+# evidencia de otro: no mencionar sus términos es una evidencia débil para no llamarlo
+WEAK_EVIDENCE_CONFIDENCE = 0.7
+
+def features(query: str) -> Counter:
+    """
+    Características de una consulta: raíces de sus palabras, pares de raíces consecutivas
+    y la cantidad de términos del léxico de cada experto.
+    """
+    stems = [stem(word) for word in tokenize(query)]
+    counts = Counter(f"w:{term}" for term in stems)
+    counts.update(f"b:{first}_{second}" for first, second in zip(stems, stems[1:]))
+    for label, lexicon in _LEXICON_STEMS.items():
+        hits = sum(1 for term in stems if term in lexicon)
+        if hits:
+            counts[f"lex:{label}"] = hits
+    return counts
+
+def _sigmoid(x: float) -> float:
+    return 1 / (1 + math.exp(-max(min(x, 30.0), -30.0)))
+
+class IntentDecision:
+    """
+    Decisión del ruteo local: probabilidad de que cada experto deba participar y la
+    confianza de la decisión (0 a 1, la menor entre los expertos). Un experto para el
+    que ninguna característica de la consulta tiene peso en el modelo no tiene
+    evidencia propia: su probabilidad es solo el sesgo, y su confianza se limita a
+    WEAK_EVIDENCE_CONFIDENCE si otro experto tiene evidencia, o es 0 si ninguno la tiene.
+    """
+    def __init__(self, scores: Dict[str, float], evidence: Dict[str, bool] = None):
+        self.scores = scores
+        self.evidence = evidence or {label: True for label in scores}
+        weak = WEAK_EVIDENCE_CONFIDENCE if any(self.evidence.values()) else 0.0
+        self.confidence = min(abs(p - 0.5) * 2 if self.evidence[label] else min(abs(p - 0.5) * 2, weak)
+                              for label, p in scores.items())
+
+    @property
+    def needs(self) -> Dict[str, bool]:
+        needs = {label: p >= 0.5 for label, p in self.scores.items()}
+        needs["general"] = True
+        return needs
+
+    def summary(self) -> str:
+        names = {"legal": "el experto legal", "market": "el analista de mercado"}
+        chosen = [names[label] for label in LABELS if self.scores[label] >= 0.5]
+        return (f"Para esta consulta trabajaremos con {' y '.join(chosen)} "
+                f"(confianza {self.confidence:.0%}).")
+
+class IntentRouter:
+    """
+    Decide qué expertos participan sin llamar al LLM: un modelo lineal (regresión
+    logística por experto) sobre palabras, pares de palabras y términos del léxico,
+    cargado desde un archivo JSON o, si no existe, el modelo de solo léxico. Las
+    decisiones se agregan a un registro JSON Lines para reentrenar el modelo.
+    """
+    def __init__(self, model_path: str = None, min_confidence: float = 0.6, log_path: str = None):
+        self.model_path = model_path
+        self.min_confidence = min_confidence
+        self.log_path = log_path
+        if log_path and os.path.dirname(log_path):
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        self.local = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+        self.model = DEFAULT_MODEL
+        if model_path and os.path.exists(model_path):
+            self.model = self.load(model_path)
+            print(f"Modelo de ruteo cargado desde {model_path}")
+
+    @staticmethod
+    def load(path: str) -> Dict[str, Dict]:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["labels"]
+
+    @staticmethod
+    def save(model: Dict[str, Dict], path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"labels": model, "trained": time.strftime("%Y-%m-%d %H:%M:%S")}, f, ensure_ascii=False)
+
+    def classify(self, query: str) -> IntentDecision:
+        counts = features(query)
+        scores = {}
+        evidence = {}
+        for label in LABELS:
+            params = self.model[label]
+            weights = params["weights"]
+            logit = params["bias"] + sum(weights.get(feature, 0.0) * value for feature, value in counts.items())
+            scores[label] = _sigmoid(logit)
+            evidence[label] = any(weights.get(feature) for feature in counts)
+        return IntentDecision(scores, evidence)
+
+    def route(self, query: str) -> Optional[IntentDecision]:
+        """
+        Retorna la decisión local si alcanza la confianza mínima y llama al menos a un
+        experto; None si la consulta debe rutearse con el LLM (también si ningún experto
+        tiene evidencia en la consulta).
+        """
+        decision = self.classify(query)
+        confident = decision.confidence >= self.min_confidence and any(
+            decision.needs[label] for label in LABELS)
+        with self._lock:
+            if confident:
+                self.local += 1
+            else:
+                self.fallbacks += 1
+        return decision if confident else None
+
+    def record(self, query: str, needs: Dict[str, bool], source: str, decision: IntentDecision = None) -> None:
+        """
+        Registra una decisión de ruteo ("local" o "llm") con las probabilidades del modelo.
+        """
+        if not self.log_path:
+            return
+        decision = decision or self.classify(query)
+        record = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "query": query,
+            "source": source,
+            "needs": {label: bool(needs.get(label)) for label in LABELS},
+            "scores": {label: round(p, 4) for label, p in decision.scores.items()},
+            "confidence": round(decision.confidence, 4)
+        }
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.local + self.fallbacks
+            return {"local": self.local, "fallbacks": self.fallbacks,
+                    "local_ratio": self.local / total if total else 0.0}
+
+def read_decisions(path: str, sources: tuple = ("llm", "manual")) -> List[Dict]:
+    """
+    Lee las decisiones registradas de los orígenes indicados: las del LLM y las
+    correcciones agregadas a mano (source "manual"). Si una consulta aparece varias
+    veces, cuenta la última decisión.
+    """
+    decisions = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Línea incompleta de un proceso interrumpido
+                continue
+            if record.get("source") in sources:
+                decisions[record["query"].strip().lower()] = record
+    return list(decisions.values())
+
+def train(decisions: List[Dict], initial: Dict[str, Dict] = None, epochs: int = 30,
+          learning_rate: float = 0.1, l2: float = 0.001, seed: int = 0) -> Dict[str, Dict]:
+    """
+    Entrena el modelo con descenso de gradiente estocástico sobre las decisiones
+    registradas, partiendo de initial (por defecto, el modelo de solo léxico).
+    """
+    initial = initial or DEFAULT_MODEL
+    model = {label: {"bias": initial[label]["bias"], "weights": dict(initial[label]["weights"])}
+             for label in LABELS}
+    examples = [(features(d["query"]), d["needs"]) for d in decisions]
+    rng = random.Random(seed)
+    for _ in range(epochs):
+        rng.shuffle(examples)
+        for counts, needs in examples:
+            for label in LABELS:
+                params = model[label]
+                weights = params["weights"]
+                logit = params["bias"] + sum(weights.get(f, 0.0) * v for f, v in counts.items())
+                error = (1.0 if needs.get(label) else 0.0) - _sigmoid(logit)
+                params["bias"] += learning_rate * error
+                for feature, value in counts.items():
+                    weight = weights.get(feature, 0.0)
+                    weights[feature] = weight + learning_rate * (error * value - l2 * weight)
+    for params in model.values():
+        params["weights"] = {f: round(w, 4) for f, w in params["weights"].items() if abs(w) >= 0.001}
+        params["bias"] = round(params["bias"], 4)
+    return model
+
+if __name__ == "__main__":
+    import sys
+
+    # Uso: PYTHONPATH=src python -m agents.intent_router entrenar <registro.jsonl> <modelo.json>
+    #      PYTHONPATH=src python -m agents.intent_router probar <modelo.json> <consulta>
+    usage = ("Uso: PYTHONPATH=src python -m agents.intent_router entrenar <registro.jsonl> <modelo.json>\n"
+             "     PYTHONPATH=src python -m agents.intent_router probar <modelo.json> <consulta>")
+    if len(sys.argv) < 4 or sys.argv[1] not in ("entrenar", "probar"):
+        print(usage)
+        sys.exit(1)
+    if sys.argv[1] == "entrenar":
+        decisions = read_decisions(sys.argv[2])
+        model = train(decisions)
+        IntentRouter.save(model, sys.argv[3])
+        router = IntentRouter(sys.argv[3])
+        agreement = sum(1 for d in decisions
+                        if all(router.classify(d["query"]).needs[label] == d["needs"][label] for label in LABELS))
+        print(f"Modelo entrenado con {len(decisions)} decisiones: "
+              f"{agreement}/{len(decisions)} coinciden, guardado en {sys.argv[3]}")
+    else:
+        router = IntentRouter(sys.argv[2])
+        decision = router.classify(" ".join(sys.argv[3:]))
+        print(", ".join(f"{label}: {p:.2f}" for label, p in decision.scores.items()),
+              f"(confianza {decision.confidence:.2f})")
@@ -1,13 +1,32 @@
-from typing import Dict, List
+from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from agents.pipeline import Step
+from agents.thoughts import ThoughtWriter
+from integrations.llm_cache import STATIC_PROMPT_TTL
 from integrations.openrouter import OpenRouterLLM
 from integrations.serper import SerperSearch
-from utils.helpers import log_agent_thought
+from utils.context_packer import ContextPacker
+from utils.deadline import submit_in_context
+from utils.helpers import log_agent_thought, run_concurrently
+
+# Contexto de la respuesta final cuando no se obtuvieron resultados de búsqueda
+NO_RESULTS_CONTEXT = ("No se pudo obtener información actualizada de internet. Responde con tu conocimiento "
+                      "general e indica qué datos conviene verificar por estar posiblemente desactualizados.")
 
 class LegalAgent:
-    def __init__(self, llm: OpenRouterLLM, search: SerperSearch):
+    def __init__(self, llm: OpenRouterLLM, search: SerperSearch, search_concurrency: int = 1,
+                 batch_search: bool = False, thoughts: ThoughtWriter = None, packer: ContextPacker = None):
         self.llm = llm
         self.search = search
+        # Generación de pensamientos narrativos (en línea o en segundo plano)
+        self.thoughts = thoughts or ThoughtWriter(llm)
+        # Número máximo de búsquedas que se investigan en paralelo
+        self.search_concurrency = search_concurrency
+        # Enviar todas las búsquedas de una ronda en un solo lote a Serper
+        self.batch_search = batch_search
+        # Deduplicación y selección de los fragmentos que entran al prompt de la respuesta
+        self.packer = packer or ContextPacker()
         self.logger = logging.getLogger(__name__)
 
     def analyze_legal_aspects(self, query: str) -> str:
@@ -25,14 +44,23 @@ class LegalAgent:
         
         Responde como si estuvieras analizando el caso con tus colegas.
         """
-        return self.llm.generate_text(prompt)
+        return self.llm.generate_text(prompt, step="legal.analysis")
 
-    def determine_legal_searches(self, query: str) -> List[str]:
-        # Primero analizar los aspectos legales
-        legal_analysis = self.analyze_legal_aspects(query)
-        log_agent_thought(self.logger, "Experto Legal", legal_analysis)
+    def think_about_analysis(self, legal_analysis: str) -> None:
         """
-        Determina las búsquedas legales necesarias para responder la consulta.
+        Registra el pensamiento sobre qué información buscar a partir del análisis legal.
+        """
+        self.thoughts.think(self.logger, "Experto Legal", f"""
+        Basado en mi análisis legal:
+        {legal_analysis}
+        
+        ¿Qué información específica necesito buscar para dar una respuesta completa?
+        Piensa en las búsquedas más relevantes para este caso.
+        """)
+
+    def suggest_legal_searches(self, query: str) -> List[str]:
+        """
+        Pide al LLM las búsquedas legales a realizar para la consulta.
         """
         prompt = f"""
         Para responder a la siguiente consulta legal inmobiliaria, necesito que me ayudes a determinar qué búsquedas específicas debo realizar.
@@ -46,59 +74,104 @@ class LegalAgent:
         - normativa actual compraventa inmuebles chile
         """
         
-        # Generar pensamiento sobre las búsquedas necesarias
-        search_thought = self.llm.generate_text(f"""
-        Basado en mi análisis legal:
-        {legal_analysis}
-        
-        ¿Qué información específica necesito buscar para dar una respuesta completa?
-        Piensa en las búsquedas más relevantes para este caso.
-        """)
-        log_agent_thought(self.logger, "Experto Legal", search_thought)
-        
         # Extraer las búsquedas sugeridas
-        suggestions = self.llm.generate_text(prompt)
+        suggestions = self.llm.generate_text(prompt, step="legal.planning")
         queries = [line.strip('- ').strip() for line in suggestions.split('\n') if line.strip().startswith('-')]
         result_queries = queries if queries else [query]
         return result_queries
 
-    def search_and_analyze_legal(self, query: str) -> str:
-        # Pensar sobre el enfoque de análisis
-        approach_thought = self.llm.generate_text(f"""
-        Para esta consulta:
-        "{query}"
-        
-        ¿Cómo debería enfocar mi análisis legal? ¿Qué aspectos son críticos?
-        Expresa tus pensamientos sobre la mejor manera de abordar este análisis.
+    def reflect_on_query(self, query: str) -> None:
+        """
+        Registra el análisis legal de la consulta y el pensamiento sobre qué buscar.
+        """
+        legal_analysis = self.analyze_legal_aspects(query)
+        log_agent_thought(self.logger, "Experto Legal", legal_analysis)
+        self.think_about_analysis(legal_analysis)
+
+    def determine_legal_searches(self, query: str) -> List[str]:
+        """
+        Determina las búsquedas legales necesarias para responder la consulta.
+        """
+        # Analizar los aspectos legales y pensar sobre las búsquedas necesarias
+        self.thoughts.defer_optional(self.reflect_on_query, query)
+        return self.suggest_legal_searches(query)
+
+    def think_about_search(self, search_query: str) -> None:
+        """
+        Registra el pensamiento previo a investigar una búsqueda.
+        """
+        self.thoughts.think(self.logger, "Experto Legal", f"""
+        Voy a buscar información sobre: "{search_query}"
+        ¿Qué espero encontrar con esta búsqueda? ¿Qué aspectos son cruciales?
         """)
-        log_agent_thought(self.logger, "Experto Legal", approach_thought)
+
+    def legal_search_specs(self, search_query: str) -> List[Tuple[str, str, int]]:
         """
-        Realiza búsquedas legales inteligentes y analiza la información encontrada.
+        Retorna las consultas a Serper (consulta, tipo, número de resultados) para una búsqueda.
         """
-        # Determinar las búsquedas necesarias
-        search_queries = self.determine_legal_searches(query)
+        specs = [(search_query, "search", 3)]
+        if "ley" in search_query.lower() or "normativa" in search_query.lower():
+            specs.append((search_query + " legal inmobiliario", "news", 2))
+        return specs
+
+    def fetch_legal_snippets(self, search_query: str) -> List[str]:
+        """
+        Ejecuta las consultas a Serper de una búsqueda y retorna los fragmentos encontrados.
+        """
+        snippets = []
+        for spec_query, result_type, num_results in self.legal_search_specs(search_query):
+            if result_type == "search":
+                results = self.search.search(spec_query, num_results=num_results)
+            else:
+                results = self.search.get_news(spec_query, num_results=num_results)
+            snippets.extend([r["snippet"] for r in results])
+        return snippets
+
+    def research_legal_query(self, search_query: str) -> List[str]:
+        """
+        Investiga una búsqueda legal y retorna los fragmentos encontrados.
+        """
+        self.think_about_search(search_query)
+        return self.fetch_legal_snippets(search_query)
+
+    def research_round(self, search_queries: List[str], think: bool = True) -> List[str]:
+        """
+        Envía todas las búsquedas de la ronda en un solo lote a Serper mientras se
+        generan los pensamientos de búsqueda. Retorna los fragmentos en el mismo orden
+        que la investigación búsqueda por búsqueda.
+        """
+        specs = [spec for search_query in search_queries for spec in self.legal_search_specs(search_query)]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            batch = submit_in_context(executor, self.search.batch, specs)
+            if think:
+                run_concurrently(self.think_about_search, search_queries, self.search_concurrency)
+            results = batch.result()
+        return [r["snippet"] for spec_results in results for r in spec_results]
+
+    def gather_legal_results(self, search_queries: List[str], think: bool = True) -> List[str]:
+        """
+        Realiza todas las búsquedas y retorna los fragmentos en el orden de las búsquedas.
+        Con think=False se omiten los pensamientos de búsqueda.
+        """
+        if self.batch_search:
+            return self.research_round(search_queries, think=think)
         
-        # Realizar búsquedas
+        research = self.research_legal_query if think else self.fetch_legal_snippets
         all_results = []
-        for search_query in search_queries:
-            search_thought = self.llm.generate_text(f"""
-            Voy a buscar información sobre: "{search_query}"
-            ¿Qué espero encontrar con esta búsqueda? ¿Qué aspectos son cruciales?
-            """)
-            log_agent_thought(self.logger, "Experto Legal", search_thought)
-            
-            # Búsquedas y análisis de resultados
-            web_results = self.search.search(search_query, num_results=3)
-            all_results.extend([r["snippet"] for r in web_results])
-            
-            if "ley" in search_query.lower() or "normativa" in search_query.lower():
-                news_results = self.search.get_news(search_query + " legal inmobiliario", num_results=2)
-                all_results.extend([r["snippet"] for r in news_results])
-        
-        # Combinar y analizar la información recopilada
-        context = "\n".join(all_results)
+        for snippets in run_concurrently(research, search_queries, self.search_concurrency):
+            all_results.extend(snippets)
+        return all_results
+
+    def legal_answer_prompt(self, query: str, all_results: List[str]) -> str:
+        """
+        Construye el prompt de la respuesta final a partir de los fragmentos recopilados.
+        """
+        # Fragmentos sin duplicados, de más a menos relevante, hasta el presupuesto de tokens
+        # del paso; sin resultados (Serper no disponible) se responde solo con el conocimiento del modelo
+        budget = self.llm.route("legal.answer").get("context_tokens")
+        context = self.packer.pack(query, all_results, budget, label="legal").text or NO_RESULTS_CONTEXT
         
-        prompt = f"""
+        return f"""
         Como experto legal inmobiliario, analiza la siguiente información y genera una respuesta definitiva y completa.
         La respuesta debe ser clara, precisa y proporcionar toda la información necesaria sin necesidad de consultas adicionales.
         
@@ -115,27 +188,102 @@ class LegalAgent:
         - Incluye información sobre normativas recientes o cambios pendientes
         - NO sugieras consultar con otros profesionales
         """
+
+    def answer_from_plan(self, query: str, search_queries: List[str]) -> str:
+        """
+        Responde usando búsquedas ya planificadas, sin generar pensamientos intermedios.
+        """
+        all_results = self.gather_legal_results(search_queries, think=False)
+        return self.llm.generate_text(self.legal_answer_prompt(query, all_results), step="legal.answer")
+
+    def think_about_approach(self, query: str) -> None:
+        """
+        Registra el pensamiento sobre cómo enfocar el análisis legal.
+        """
+        self.thoughts.think(self.logger, "Experto Legal", f"""
+        Para esta consulta:
+        "{query}"
         
-        # Analizar la información recopilada
-        analysis_thought = self.llm.generate_text(f"""
+        ¿Cómo debería enfocar mi análisis legal? ¿Qué aspectos son críticos?
+        Expresa tus pensamientos sobre la mejor manera de abordar este análisis.
+        """)
+
+    def think_about_results(self, all_results: List[str]) -> None:
+        """
+        Registra el pensamiento sobre la información recopilada.
+        """
+        self.thoughts.think(self.logger, "Experto Legal", f"""
         He encontrado información relevante. Déjame analizarla:
         {' '.join(all_results[:200])}...
         
         ¿Qué conclusiones legales puedo extraer? ¿Qué implicaciones tiene esto?
         """)
-        log_agent_thought(self.logger, "Experto Legal", analysis_thought)
-        
-        # Pensar sobre la respuesta final
-        final_thought = self.llm.generate_text(f"""
+
+    def think_about_conclusion(self) -> None:
+        """
+        Registra el pensamiento sobre la conclusión legal final.
+        """
+        self.thoughts.think(self.logger, "Experto Legal", f"""
         Basado en toda la información recopilada y analizada, ¿cuál es mi conclusión legal final?
         ¿Qué recomendaciones específicas puedo dar?
-        """)
-        log_agent_thought(self.logger, "Experto Legal", final_thought)
+        """, cache_ttl=STATIC_PROMPT_TTL)
+
+    def search_and_analyze_legal(self, query: str) -> str:
+        """
+        Realiza búsquedas legales inteligentes y analiza la información encontrada.
+        """
+        # Pensar sobre el enfoque de análisis
+        self.think_about_approach(query)
+        
+        # Determinar las búsquedas necesarias
+        search_queries = self.determine_legal_searches(query)
+        
+        # Realizar búsquedas (el orden de los resultados sigue al de las búsquedas)
+        all_results = self.gather_legal_results(search_queries)
+        
+        # Combinar y analizar la información recopilada
+        prompt = self.legal_answer_prompt(query, all_results)
+        
+        # Analizar la información recopilada
+        self.think_about_results(all_results)
+        
+        # Pensar sobre la respuesta final
+        self.think_about_conclusion()
         
         # Generar respuesta final
-        response = self.llm.generate_text(prompt)
+        response = self.llm.generate_text(prompt, step="legal.answer")
         return response
 
+    def pipeline_steps(self) -> List[Step]:
+        """
+        Declara los pasos del agente para el planificador de pasos. Dependen de los
+        valores "query" y "needs" y solo se ejecutan si needs["legal"] es verdadero.
+        """
+        def analysis(query: str) -> str:
+            legal_analysis = self.analyze_legal_aspects(query)
+            log_agent_thought(self.logger, "Experto Legal", legal_analysis)
+            return legal_analysis
+
+        def search_thoughts(search_queries: List[str]) -> None:
+            run_concurrently(self.think_about_search, search_queries, self.search_concurrency)
+
+        def answer(query: str, all_results: List[str]) -> str:
+            return self.llm.generate_text(self.legal_answer_prompt(query, all_results), step="legal.answer")
+
+        needed = lambda results: results["needs"]["legal"]
+        return [
+            Step("legal.approach_thought", self.think_about_approach, ["query"], "llm", after=["needs"], when=needed),
+            Step("legal.analysis", analysis, ["query"], "llm", after=["needs"], when=needed),
+            Step("legal.analysis_thought", self.think_about_analysis, ["legal.analysis"], "llm"),
+            Step("legal.searches", self.suggest_legal_searches, ["query"], "llm", after=["needs"], when=needed),
+            Step("legal.search_thoughts", search_thoughts, ["legal.searches"], "llm"),
+            Step("legal.results", lambda search_queries: self.gather_legal_results(search_queries, think=False),
+                 ["legal.searches"], "search"),
+            Step("legal.results_thought", self.think_about_results, ["legal.results"], "llm"),
+            Step("legal.conclusion_thought", self.think_about_conclusion, [], "llm", after=["needs"], when=needed),
+            Step("legal.answer", answer, ["query", "legal.results"], "llm")
+        ]
+
     def handle_query(self, query: str) -> str:
         """
         Punto de entrada principal para manejar consultas legales.
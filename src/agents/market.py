@@ -1,13 +1,32 @@
-from typing import Dict, List
+from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from agents.pipeline import Step
+from agents.thoughts import ThoughtWriter
+from integrations.llm_cache import STATIC_PROMPT_TTL
 from integrations.openrouter import OpenRouterLLM
 from integrations.serper import SerperSearch
-from utils.helpers import log_agent_thought
+from utils.context_packer import ContextPacker
+from utils.deadline import submit_in_context
+from utils.helpers import log_agent_thought, run_concurrently
+
+# Contexto de la respuesta final cuando no se obtuvieron resultados de búsqueda
+NO_RESULTS_CONTEXT = ("No se pudo obtener información actualizada de internet. Responde con tu conocimiento "
+                      "general e indica qué datos conviene verificar por estar posiblemente desactualizados.")
 
 class MarketAgent:
-    def __init__(self, llm: OpenRouterLLM, search: SerperSearch):
+    def __init__(self, llm: OpenRouterLLM, search: SerperSearch, search_concurrency: int = 1,
+                 batch_search: bool = False, thoughts: ThoughtWriter = None, packer: ContextPacker = None):
         self.llm = llm
         self.search = search
+        # Generación de pensamientos narrativos (en línea o en segundo plano)
+        self.thoughts = thoughts or ThoughtWriter(llm)
+        # Número máximo de búsquedas que se investigan en paralelo
+        self.search_concurrency = search_concurrency
+        # Enviar todas las búsquedas de una ronda en un solo lote a Serper
+        self.batch_search = batch_search
+        # Deduplicación y selección de los fragmentos que entran al prompt de la respuesta
+        self.packer = packer or ContextPacker()
         self.logger = logging.getLogger(__name__)
 
     def analyze_market_aspects(self, query: str) -> str:
@@ -25,14 +44,23 @@ class MarketAgent:
         
         Responde como si estuvieras discutiendo el caso con tu equipo de análisis.
         """
-        return self.llm.generate_text(prompt)
+        return self.llm.generate_text(prompt, step="market.analysis")
 
-    def determine_search_queries(self, query: str) -> List[str]:
-        # Primero analizar los aspectos de mercado
-        market_analysis = self.analyze_market_aspects(query)
-        log_agent_thought(self.logger, "Analista de Mercado", market_analysis)
+    def think_about_analysis(self, market_analysis: str) -> None:
         """
-        Determina las búsquedas necesarias para responder la consulta.
+        Registra el pensamiento sobre qué datos buscar a partir del análisis de mercado.
+        """
+        self.thoughts.think(self.logger, "Analista de Mercado", f"""
+        Basado en mi análisis de mercado:
+        {market_analysis}
+        
+        ¿Qué datos específicos necesitamos buscar? ¿Qué tendencias son más relevantes?
+        Piensa en las búsquedas que nos darán la información más valiosa.
+        """)
+
+    def suggest_search_queries(self, query: str) -> List[str]:
+        """
+        Pide al LLM las búsquedas de mercado a realizar para la consulta.
         """
         prompt = f"""
         Para responder a la siguiente consulta inmobiliaria, necesito que me ayudes a determinar qué búsquedas específicas debo realizar.
@@ -46,62 +74,106 @@ class MarketAgent:
         - valor metro cuadrado santiago por sector
         """
         
-        # Generar pensamiento sobre las búsquedas necesarias
-        search_thought = self.llm.generate_text(f"""
-        Basado en mi análisis de mercado:
-        {market_analysis}
-        
-        ¿Qué datos específicos necesitamos buscar? ¿Qué tendencias son más relevantes?
-        Piensa en las búsquedas que nos darán la información más valiosa.
-        """)
-        log_agent_thought(self.logger, "Analista de Mercado", search_thought)
-        
         # Extraer las búsquedas sugeridas
-        suggestions = self.llm.generate_text(prompt)
+        suggestions = self.llm.generate_text(prompt, step="market.planning")
         queries = [line.strip('- ').strip() for line in suggestions.split('\n') if line.strip().startswith('-')]
         result_queries = queries if queries else [query]
         return result_queries
 
-    def search_and_analyze(self, query: str) -> str:
-        # Pensar sobre el enfoque de análisis
-        approach_thought = self.llm.generate_text(f"""
-        Para esta consulta sobre el mercado:
-        "{query}"
-        
-        ¿Qué enfoque de análisis sería más efectivo? ¿Qué factores son cruciales?
-        Expresa tus pensamientos sobre cómo abordar este análisis de mercado.
+    def reflect_on_query(self, query: str) -> None:
+        """
+        Registra el análisis de mercado de la consulta y el pensamiento sobre qué buscar.
+        """
+        market_analysis = self.analyze_market_aspects(query)
+        log_agent_thought(self.logger, "Analista de Mercado", market_analysis)
+        self.think_about_analysis(market_analysis)
+
+    def determine_search_queries(self, query: str) -> List[str]:
+        """
+        Determina las búsquedas necesarias para responder la consulta.
+        """
+        # Analizar los aspectos de mercado y pensar sobre las búsquedas necesarias
+        self.thoughts.defer_optional(self.reflect_on_query, query)
+        return self.suggest_search_queries(query)
+
+    def think_about_search(self, search_query: str) -> None:
+        """
+        Registra el pensamiento previo a investigar una búsqueda.
+        """
+        self.thoughts.think(self.logger, "Analista de Mercado", f"""
+        Voy a investigar: "{search_query}"
+        ¿Qué tipo de datos espero encontrar? ¿Qué tendencias podrían ser relevantes?
         """)
-        log_agent_thought(self.logger, "Analista de Mercado", approach_thought)
+
+    def market_search_specs(self, search_query: str) -> List[Tuple[str, str, int]]:
         """
-        Realiza búsquedas inteligentes y analiza la información encontrada.
+        Retorna las consultas a Serper (consulta, tipo, número de resultados) para una búsqueda.
         """
-        # Determinar las búsquedas necesarias
-        search_queries = self.determine_search_queries(query)
+        specs = [(search_query, "search", 3), (search_query, "news", 2)]
+        if "precio" in search_query.lower() or "valor" in search_query.lower():
+            specs.append((search_query, "real_estate", 5))
+        return specs
+
+    def fetch_market_snippets(self, search_query: str) -> List[str]:
+        """
+        Ejecuta las consultas a Serper de una búsqueda y retorna los fragmentos encontrados.
+        """
+        snippets = []
+        for spec_query, result_type, num_results in self.market_search_specs(search_query):
+            if result_type == "search":
+                results = self.search.search(spec_query, num_results=num_results)
+            elif result_type == "news":
+                results = self.search.get_news(spec_query, num_results=num_results)
+            else:
+                results = self.search.get_real_estate_info(spec_query)
+            snippets.extend([r["snippet"] for r in results])
+        return snippets
+
+    def research_market_query(self, search_query: str) -> List[str]:
+        """
+        Investiga una búsqueda de mercado y retorna los fragmentos encontrados.
+        """
+        self.think_about_search(search_query)
+        return self.fetch_market_snippets(search_query)
+
+    def research_round(self, search_queries: List[str], think: bool = True) -> List[str]:
+        """
+        Envía todas las búsquedas de la ronda en un solo lote a Serper mientras se
+        generan los pensamientos de búsqueda. Retorna los fragmentos en el mismo orden
+        que la investigación búsqueda por búsqueda.
+        """
+        specs = [spec for search_query in search_queries for spec in self.market_search_specs(search_query)]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            batch = submit_in_context(executor, self.search.batch, specs)
+            if think:
+                run_concurrently(self.think_about_search, search_queries, self.search_concurrency)
+            results = batch.result()
+        return [r["snippet"] for spec_results in results for r in spec_results]
+
+    def gather_market_results(self, search_queries: List[str], think: bool = True) -> List[str]:
+        """
+        Realiza todas las búsquedas y retorna los fragmentos en el orden de las búsquedas.
+        Con think=False se omiten los pensamientos de búsqueda.
+        """
+        if self.batch_search:
+            return self.research_round(search_queries, think=think)
         
-        # Realizar búsquedas
+        research = self.research_market_query if think else self.fetch_market_snippets
         all_results = []
-        for search_query in search_queries:
-            search_thought = self.llm.generate_text(f"""
-            Voy a investigar: "{search_query}"
-            ¿Qué tipo de datos espero encontrar? ¿Qué tendencias podrían ser relevantes?
-            """)
-            log_agent_thought(self.logger, "Analista de Mercado", search_thought)
-            
-            # Búsquedas y análisis de resultados
-            web_results = self.search.search(search_query, num_results=3)
-            all_results.extend([r["snippet"] for r in web_results])
-            
-            news_results = self.search.get_news(search_query, num_results=2)
-            all_results.extend([r["snippet"] for r in news_results])
-            
-            if "precio" in search_query.lower() or "valor" in search_query.lower():
-                real_estate_results = self.search.get_real_estate_info(search_query)
-                all_results.extend([r["snippet"] for r in real_estate_results])
-        
-        # Combinar y analizar la información recopilada
-        context = "\n".join(all_results)
+        for snippets in run_concurrently(research, search_queries, self.search_concurrency):
+            all_results.extend(snippets)
+        return all_results
+
+    def market_answer_prompt(self, query: str, all_results: List[str]) -> str:
+        """
+        Construye el prompt de la respuesta final a partir de los fragmentos recopilados.
+        """
+        # Fragmentos sin duplicados, de más a menos relevante, hasta el presupuesto de tokens
+        # del paso; sin resultados (Serper no disponible) se responde solo con el conocimiento del modelo
+        budget = self.llm.route("market.answer").get("context_tokens")
+        context = self.packer.pack(query, all_results, budget, label="market").text or NO_RESULTS_CONTEXT
         
-        prompt = f"""
+        return f"""
         Como experto en el mercado inmobiliario, analiza la siguiente información y genera una respuesta definitiva y completa.
         La respuesta debe ser profesional y proporcionar toda la información necesaria sin necesidad de consultas adicionales.
         
@@ -118,27 +190,102 @@ class MarketAgent:
         - Proporciona valoraciones y estimaciones concretas cuando sea relevante
         - NO sugieras consultar con otros profesionales o analistas
         """
+
+    def answer_from_plan(self, query: str, search_queries: List[str]) -> str:
+        """
+        Responde usando búsquedas ya planificadas, sin generar pensamientos intermedios.
+        """
+        all_results = self.gather_market_results(search_queries, think=False)
+        return self.llm.generate_text(self.market_answer_prompt(query, all_results), step="market.answer")
+
+    def think_about_approach(self, query: str) -> None:
+        """
+        Registra el pensamiento sobre cómo enfocar el análisis de mercado.
+        """
+        self.thoughts.think(self.logger, "Analista de Mercado", f"""
+        Para esta consulta sobre el mercado:
+        "{query}"
         
-        # Analizar la información recopilada
-        analysis_thought = self.llm.generate_text(f"""
+        ¿Qué enfoque de análisis sería más efectivo? ¿Qué factores son cruciales?
+        Expresa tus pensamientos sobre cómo abordar este análisis de mercado.
+        """)
+
+    def think_about_results(self, all_results: List[str]) -> None:
+        """
+        Registra el pensamiento sobre los datos recopilados.
+        """
+        self.thoughts.think(self.logger, "Analista de Mercado", f"""
         He recopilado datos interesantes. Déjame analizarlos:
         {' '.join(all_results[:200])}...
         
         ¿Qué tendencias puedo identificar? ¿Qué nos dicen estos datos sobre el mercado?
         """)
-        log_agent_thought(self.logger, "Analista de Mercado", analysis_thought)
-        
-        # Pensar sobre las conclusiones finales
-        final_thought = self.llm.generate_text(f"""
+
+    def think_about_conclusion(self) -> None:
+        """
+        Registra el pensamiento sobre las conclusiones finales de mercado.
+        """
+        self.thoughts.think(self.logger, "Analista de Mercado", f"""
         Después de analizar todos los datos del mercado, ¿cuáles son mis conclusiones principales?
         ¿Qué recomendaciones específicas puedo ofrecer basadas en las tendencias actuales?
-        """)
-        log_agent_thought(self.logger, "Analista de Mercado", final_thought)
+        """, cache_ttl=STATIC_PROMPT_TTL)
+
+    def search_and_analyze(self, query: str) -> str:
+        """
+        Realiza búsquedas inteligentes y analiza la información encontrada.
+        """
+        # Pensar sobre el enfoque de análisis
+        self.think_about_approach(query)
+        
+        # Determinar las búsquedas necesarias
+        search_queries = self.determine_search_queries(query)
+        
+        # Realizar búsquedas (el orden de los resultados sigue al de las búsquedas)
+        all_results = self.gather_market_results(search_queries)
+        
+        # Combinar y analizar la información recopilada
+        prompt = self.market_answer_prompt(query, all_results)
+        
+        # Analizar la información recopilada
+        self.think_about_results(all_results)
+        
+        # Pensar sobre las conclusiones finales
+        self.think_about_conclusion()
         
         # Generar respuesta final
-        response = self.llm.generate_text(prompt)
+        response = self.llm.generate_text(prompt, step="market.answer")
         return response
 
+    def pipeline_steps(self) -> List[Step]:
+        """
+        Declara los pasos del agente para el planificador de pasos. Dependen de los
+        valores "query" y "needs" y solo se ejecutan si needs["market"] es verdadero.
+        """
+        def analysis(query: str) -> str:
+            market_analysis = self.analyze_market_aspects(query)
+            log_agent_thought(self.logger, "Analista de Mercado", market_analysis)
+            return market_analysis
+
+        def search_thoughts(search_queries: List[str]) -> None:
+            run_concurrently(self.think_about_search, search_queries, self.search_concurrency)
+
+        def answer(query: str, all_results: List[str]) -> str:
+            return self.llm.generate_text(self.market_answer_prompt(query, all_results), step="market.answer")
+
+        needed = lambda results: results["needs"]["market"]
+        return [
+            Step("market.approach_thought", self.think_about_approach, ["query"], "llm", after=["needs"], when=needed),
+            Step("market.analysis", analysis, ["query"], "llm", after=["needs"], when=needed),
+            Step("market.analysis_thought", self.think_about_analysis, ["market.analysis"], "llm"),
+            Step("market.searches", self.suggest_search_queries, ["query"], "llm", after=["needs"], when=needed),
+            Step("market.search_thoughts", search_thoughts, ["market.searches"], "llm"),
+            Step("market.results", lambda search_queries: self.gather_market_results(search_queries, think=False),
+                 ["market.searches"], "search"),
+            Step("market.results_thought", self.think_about_results, ["market.results"], "llm"),
+            Step("market.conclusion_thought", self.think_about_conclusion, [], "llm", after=["needs"], when=needed),
+            Step("market.answer", answer, ["query", "market.results"], "llm")
+        ]
+
     def handle_query(self, query: str) -> str:
         """
         Punto de entrada principal para manejar consultas.
@@ -0,0 +1,144 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.deadline import submit_in_context
+
+class Step:
+    """
+    Paso del flujo de agentes: una función que recibe los resultados de sus entradas.
+    """
+    def __init__(self, name: str, func: Callable[..., Any], inputs: List[str] = None, provider: str = "local",
+                 after: List[str] = None, when: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                 accepts_skipped: bool = False):
+        # name: nombre único del paso; sus resultados quedan disponibles con ese nombre
+        # inputs: nombres de pasos (o valores iniciales) que se pasan a func en ese orden
+        # provider: proveedor cuyo límite de concurrencia aplica ("llm", "search" o "local")
+        # after: pasos que deben terminar antes, sin pasar su resultado a func
+        # when: condición evaluada con los resultados disponibles; si es falsa el paso se omite
+        # accepts_skipped: si es falso, el paso se omite cuando alguna de sus dependencias fue omitida
+        self.name = name
+        self.func = func
+        self.inputs = inputs or []
+        self.provider = provider
+        self.after = after or []
+        self.when = when
+        self.accepts_skipped = accepts_skipped
+
+    @property
+    def dependencies(self) -> List[str]:
+        return self.inputs + self.after
+
+class StepScheduler:
+    """
+    Ejecuta un grafo de pasos en cuanto sus entradas están disponibles, respetando
+    un límite de pasos simultáneos por proveedor, y registra el camino crítico.
+    """
+    def __init__(self, limits: Dict[str, int] = None):
+        self.limits = limits or {"llm": 4, "search": 4}
+        self.timings: Dict[str, tuple] = {}
+        self.skipped: set = set()
+        self._steps: Dict[str, Step] = {}
+
+    def run(self, steps: List[Step], initial: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Ejecuta los pasos y retorna todos los resultados (incluidos los valores iniciales).
+        Los pasos omitidos tienen resultado None.
+        """
+        self._validate(steps, initial)
+        self._steps = {step.name: step for step in steps}
+        self.timings = {}
+        self.skipped = set()
+        self._start = time.perf_counter()
+
+        results = dict(initial)
+        pending = list(steps)
+        running = {}
+        active = {provider: 0 for provider in self.limits}
+
+        with ThreadPoolExecutor(max_workers=max(len(steps), 1)) as executor:
+            while pending or running:
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for step in list(pending):
+                        if not all(name in results for name in step.dependencies):
+                            continue
+                        if self._should_skip(step, results):
+                            pending.remove(step)
+                            results[step.name] = None
+                            self.skipped.add(step.name)
+                            progressed = True
+                            continue
+                        limit = self.limits.get(step.provider)
+                        if limit is not None and active[step.provider] >= limit:
+                            continue
+                        pending.remove(step)
+                        if limit is not None:
+                            active[step.provider] += 1
+                        args = [results[name] for name in step.inputs]
+                        running[submit_in_context(executor, self._timed, step, args)] = step
+
+                if not running:
+                    if pending:
+                        raise ValueError(f"Pasos sin poder ejecutarse: {[step.name for step in pending]}")
+                    break
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    if step.provider in active:
+                        active[step.provider] -= 1
+                    results[step.name] = future.result()
+        return results
+
+    def _validate(self, steps: List[Step], initial: Dict[str, Any]) -> None:
+        names = set(initial)
+        for step in steps:
+            if step.name in names:
+                raise ValueError(f"Paso duplicado: {step.name}")
+            names.add(step.name)
+        for step in steps:
+            missing = [name for name in step.dependencies if name not in names]
+            if missing:
+                raise ValueError(f"El paso {step.name} depende de entradas desconocidas: {missing}")
+
+    def _should_skip(self, step: Step, results: Dict[str, Any]) -> bool:
+        if not step.accepts_skipped and any(name in self.skipped for name in step.dependencies):
+            return True
+        return step.when is not None and not step.when(results)
+
+    def _timed(self, step: Step, args: List[Any]) -> Any:
+        start = time.perf_counter()
+        try:
+            return step.func(*args)
+        finally:
+            self.timings[step.name] = (start - self._start, time.perf_counter() - self._start)
+
+    def critical_path(self) -> List[str]:
+        """
+        Retorna la cadena de pasos que determinó la duración total de la última ejecución.
+        """
+        if not self.timings:
+            return []
+        path = []
+        current = max(self.timings, key=lambda name: self.timings[name][1])
+        while current is not None:
+            path.append(current)
+            executed = [name for name in self._steps[current].dependencies if name in self.timings]
+            current = max(executed, key=lambda name: self.timings[name][1]) if executed else None
+        return list(reversed(path))
+
+    def report(self) -> str:
+        """
+        Retorna un resumen legible del camino crítico de la última ejecución.
+        """
+        path = self.critical_path()
+        if not path:
+            return "Sin pasos ejecutados"
+        total = max(end for _, end in self.timings.values())
+        lines = [f"Camino crítico ({total:.2f}s, {len(self.timings)} pasos ejecutados, {len(self.skipped)} omitidos):"]
+        for name in path:
+            start, end = self.timings[name]
+            lines.append(f"  {name}: {end - start:.2f}s (inicio {start:.2f}s)")
+        return "\n".join(lines)
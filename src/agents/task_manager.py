@@ -1,18 +1,58 @@
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import json
+import time
+from .answer_cache import AnswerCache
+from .intent_router import IntentDecision, IntentRouter
 from .legal import LegalAgent
 from .market import MarketAgent
+from .pipeline import Step, StepScheduler
+from .thoughts import ThoughtWriter
+from integrations.circuit_breaker import is_upstream_failure
+from integrations.llm_cache import STATIC_PROMPT_TTL
 from integrations.openrouter import OpenRouterLLM
-from integrations.serper import SerperSearch
+from integrations.serper import SerperSearch, degradation_scope
+from utils.context_packer import ContextPacker
+from utils.deadline import Deadline, current_deadline, deadline_scope, submit_in_context
+from utils.usage import UsageMeter, current_usage, usage_scope
 
 import logging
 from utils.helpers import log_agent_thought
 
+# Aviso agregado a las respuestas generadas sin búsquedas web actualizadas
+DEGRADED_NOTICE = ("\n\n---\n_Nota: el servicio de búsqueda no estuvo disponible. Esta respuesta se basa en "
+                   "resultados guardados o en el conocimiento general del modelo y puede no estar actualizada._")
+
 class TaskManager:
-    def __init__(self, llm: OpenRouterLLM, search: SerperSearch, legal_agent: LegalAgent, market_agent: MarketAgent):
+    def __init__(self, llm: OpenRouterLLM, search: SerperSearch, legal_agent: LegalAgent, market_agent: MarketAgent,
+                 parallel: bool = False, pipeline_mode: str = "full", step_limits: Dict[str, int] = None,
+                 thoughts: ThoughtWriter = None, packer: ContextPacker = None, answers: AnswerCache = None,
+                 router: IntentRouter = None):
         self.llm = llm
         self.search = search
         self.legal_agent = legal_agent
         self.market_agent = market_agent
+        self.parallel = parallel
+        # Generación de pensamientos narrativos (en línea o en segundo plano)
+        self.thoughts = thoughts or ThoughtWriter(llm)
+        # Deduplicación de los párrafos de las respuestas de los expertos en la síntesis
+        self.packer = packer or ContextPacker()
+        # Respuestas guardadas de consultas anteriores, reutilizadas para consultas parecidas
+        self.answers = answers
+        # Ruteo local de la consulta a los expertos; sin él (o con poca confianza) decide el LLM
+        self.router = router
+        # "full": flujo completo de pensamientos; "lean": una llamada de planificación estructurada;
+        # "dag": flujo completo ejecutado por el planificador de pasos
+        self.pipeline_mode = pipeline_mode
+        # Límite de pasos simultáneos por proveedor en el modo "dag"
+        self.step_limits = step_limits
+        # Agentes expertos que participan en el modo "dag", con la clave de needs que los activa
+        self.experts = [("legal", legal_agent), ("market", market_agent)]
+        # Reporte del camino crítico de la última consulta en el modo "dag"
+        self.last_report = ""
+        # Tiempos (en segundos) de la última consulta coordinada, por agente
+        self.last_timings: Dict[str, float] = {}
         self.logger = logging.getLogger(__name__)
 
     def think_about_query(self, query: str) -> str:
@@ -30,7 +70,7 @@ class TaskManager:
         
         Responde como si estuvieras pensando en voz alta, de manera natural y conversacional.
         """
-        return self.llm.generate_text(prompt)
+        return self.llm.generate_text(prompt, step="coordinator.routing")
 
     def decide_team_approach(self, analysis: str) -> str:
         """
@@ -47,9 +87,35 @@ class TaskManager:
         
         Responde de manera natural, como si estuvieras planificando con tu equipo.
         """
-        return self.llm.generate_text(prompt)
+        return self.llm.generate_text(prompt, step="coordinator.routing")
 
     def analyze_query_intent(self, query: str) -> Dict[str, bool]:
+        """
+        Determina qué agentes deben intervenir: con el ruteo local si tiene confianza
+        suficiente y, si no, con el análisis del LLM. La decisión queda registrada.
+        """
+        decision = self.route_locally(query)
+        if decision is not None:
+            return decision.needs
+        needs = self.llm_query_intent(query)
+        if self.router is not None:
+            self.router.record(query, needs, "llm")
+        return needs
+
+    def route_locally(self, query: str) -> Optional[IntentDecision]:
+        """
+        Retorna la decisión del ruteo local, registrada en la conversación, o None si no
+        hay ruteo local o su confianza no alcanza el mínimo.
+        """
+        if self.router is None:
+            return None
+        decision = self.router.route(query)
+        if decision is not None:
+            self.router.record(query, decision.needs, "local", decision)
+            log_agent_thought(self.logger, "Coordinador", decision.summary())
+        return decision
+
+    def llm_query_intent(self, query: str) -> Dict[str, bool]:
         # Generar pensamiento inicial sobre la consulta
         initial_thought = self.think_about_query(query)
         log_agent_thought(self.logger, "Coordinador", initial_thought)
@@ -75,68 +141,100 @@ class TaskManager:
         log_agent_thought(self.logger, "Coordinador", team_approach)
         
         # Determinar la participación de cada agente basado en el análisis
-        needs = {
+        return self.needs_from_approach(team_approach)
+
+    def needs_from_approach(self, team_approach: str) -> Dict[str, bool]:
+        """
+        Determina qué agentes deben intervenir a partir del enfoque del equipo.
+        """
+        return {
             "legal": "legal" in team_approach.lower() or "normativ" in team_approach.lower() or "ley" in team_approach.lower(),
             "market": "mercado" in team_approach.lower() or "precio" in team_approach.lower() or "valor" in team_approach.lower(),
             "general": True
         }
-        
-        return needs
 
-    def coordinate_response(self, query: str) -> str:
-        # Pensar sobre cómo coordinar la respuesta
-        coordination_thought = self.llm.generate_text(f"""
-        Como coordinador, ¿cómo deberíamos abordar esta consulta?
-        "{query}"
-        
-        Expresa tus pensamientos sobre la mejor manera de coordinar al equipo para responder.
-        """)
-        log_agent_thought(self.logger, "Coordinador", coordination_thought)
+    def request_prompt(self, expert: str, query: str) -> str:
         """
-        Coordina la obtención de respuestas de los diferentes agentes y las combina
-        de manera coherente y natural.
+        Construye el prompt del pensamiento del coordinador al solicitar información a un experto.
         """
-        # Analizar la intención de la consulta
-        needs = self.analyze_query_intent(query)
-        responses = []
-        
-        # Obtener respuestas de los agentes necesarios
-        if needs["legal"]:
-            legal_request_thought = self.llm.generate_text(f"""
+        if expert == "legal":
+            return f"""
             ¿Cómo debería solicitar la información legal para esta consulta?
             "{query}"
             
             Expresa tus pensamientos sobre qué necesitamos del equipo legal.
-            """)
-            log_agent_thought(self.logger, "Coordinador", legal_request_thought)
-            
-            legal_response = self.legal_agent.handle_query(query)
-            responses.append(legal_response)
-            
-        if needs["market"]:
-            market_request_thought = self.llm.generate_text(f"""
+            """
+        return f"""
             ¿Qué información de mercado necesitamos para esta consulta?
             "{query}"
             
             Expresa tus pensamientos sobre qué necesitamos del equipo de mercado.
-            """)
-            log_agent_thought(self.logger, "Coordinador", market_request_thought)
-            
-            market_response = self.market_agent.handle_query(query)
-            responses.append(market_response)
+            """
+
+    def run_expert(self, handler: Callable[[], str], request_prompt: Optional[str] = None) -> Tuple[str, float]:
+        """
+        Ejecuta un agente experto, precedido por el pensamiento del coordinador
+        sobre qué necesitamos de ese equipo. Retorna la respuesta y el tiempo empleado.
+        """
+        start = time.perf_counter()
+        if request_prompt:
+            self.thoughts.think(self.logger, "Coordinador", request_prompt)
+        response = handler()
+        return response, time.perf_counter() - start
+
+    def run_experts(self, experts: List[Tuple[str, Callable[[], str], Optional[str]]]) -> List[str]:
+        """
+        Ejecuta los agentes expertos (nombre, función, prompt de solicitud), en paralelo
+        si el modo concurrente está activo, y registra el tiempo de cada uno.
+        Las respuestas se retornan en el orden recibido.
+        """
+        start = time.perf_counter()
+        if self.parallel and len(experts) > 1:
+            with ThreadPoolExecutor(max_workers=len(experts)) as executor:
+                futures = [submit_in_context(executor, self.run_expert, handler, prompt)
+                           for _, handler, prompt in experts]
+                results = [future.result() for future in futures]
+        else:
+            results = [self.run_expert(handler, prompt) for _, handler, prompt in experts]
+        
+        self.last_timings = {name: elapsed for (name, _, _), (_, elapsed) in zip(experts, results)}
+        self.last_timings["experts_total"] = time.perf_counter() - start
+        return [response for response, _ in results]
+
+    def gather_expert_responses(self, query: str, needs: Dict[str, bool]) -> List[str]:
+        """
+        Obtiene las respuestas de los agentes necesarios. El orden de las respuestas
+        es siempre legal, mercado.
+        """
+        experts = []
+        if needs["legal"]:
+            experts.append(("legal", partial(self.legal_agent.handle_query, query), self.request_prompt("legal", query)))
+        if needs["market"]:
+            experts.append(("market", partial(self.market_agent.handle_query, query), self.request_prompt("market", query)))
         
         # Si no hay respuestas específicas, usar al menos un agente
-        if not responses:
-            responses.append(self.market_agent.handle_query(query))
+        if not experts:
+            experts.append(("market", partial(self.market_agent.handle_query, query), None))
         
-        # Combinar las respuestas en un formato natural
-        prompt = f"""
+        return self.run_experts(experts)
+
+    def synthesis_prompt(self, query: str, responses: List[str]) -> str:
+        """
+        Construye el prompt que combina las respuestas de los expertos. Los párrafos repetidos
+        entre respuestas se eliminan y, si el paso tiene presupuesto de tokens, se omiten los
+        menos relevantes.
+        """
+        paragraphs = [paragraph for response in responses for paragraph in response.split("\n\n")]
+        budget = self.llm.route("coordinator.synthesis").get("context_tokens", 0)
+        information = self.packer.pack(query, paragraphs, budget, keep_order=True, separator="\n\n",
+                                       label="síntesis").text
+        return f"""
         Como experto inmobiliario integral, genera una respuesta definitiva y completa que combine toda la información disponible.
         
         Consulta del cliente: {query}
 
         Información disponible:
-        {' '.join(responses)}
+        {information}
 
         Instrucciones:
         - Proporciona una respuesta definitiva y concluyente
@@ -147,21 +245,276 @@ class TaskManager:
         - NO sugieras consultas con otros profesionales
         - Mantén un tono profesional pero accesible
         """
+
+    def plan_query(self, query: str) -> Dict:
+        """
+        Genera en una sola llamada la decisión de enrutamiento, el plan de búsquedas
+        de cada experto y los pensamientos del equipo para la conversación.
+        """
+        prompt = f"""
+        Eres el coordinador de un equipo inmobiliario en Chile formado por un Experto Legal
+        y un Analista de Mercado. Planifica cómo responder esta consulta:
+        "{query}"
+        
+        Responde ÚNICAMENTE con un objeto JSON con esta estructura:
+        {{
+            "legal": true o false (si la consulta involucra aspectos legales o normativos),
+            "market": true o false (si requiere información de mercado, precios o valores),
+            "legal_searches": ["hasta 5 búsquedas web para el Experto Legal"],
+            "market_searches": ["hasta 5 búsquedas web para el Analista de Mercado"],
+            "thoughts": {{
+                "coordinador": ["pensamientos del coordinador sobre la consulta y cómo repartir el trabajo"],
+                "legal": ["pensamientos del Experto Legal sobre su enfoque"],
+                "mercado": ["pensamientos del Analista de Mercado sobre su enfoque"]
+            }}
+        }}
+        
+        Los pensamientos deben estar en español, en primera persona y en tono conversacional,
+        como si el equipo pensara en voz alta.
+        """
+        return self.parse_plan(self.llm.generate_text(prompt, step="coordinator.planning"), query)
+
+    def parse_plan(self, raw_plan: str, query: str) -> Dict:
+        """
+        Interpreta el plan JSON del LLM. Si no es válido, decide por palabras clave
+        y usa la consulta original como única búsqueda.
+        """
+        try:
+            plan = json.loads(raw_plan[raw_plan.index("{"):raw_plan.rindex("}") + 1])
+        except ValueError:
+            self.logger.debug("Plan no válido, usando enrutamiento por palabras clave")
+            plan = {}
         
-        # Pensar sobre cómo integrar las respuestas
-        integration_thought = self.llm.generate_text(f"""
+        lowered = query.lower()
+        thoughts = plan.get("thoughts") if isinstance(plan.get("thoughts"), dict) else {}
+        parsed = {
+            "legal": bool(plan.get("legal", "legal" in lowered or "normativ" in lowered or "ley" in lowered)),
+            "market": bool(plan.get("market", "mercado" in lowered or "precio" in lowered or "valor" in lowered)),
+            "thoughts": {
+                key: [t for t in thoughts.get(key, []) if isinstance(t, str)] if isinstance(thoughts.get(key), list) else []
+                for key in ("coordinador", "legal", "mercado")
+            }
+        }
+        for key in ("legal_searches", "market_searches"):
+            searches = plan.get(key) if isinstance(plan.get(key), list) else []
+            searches = [q.strip() for q in searches if isinstance(q, str) and q.strip()]
+            parsed[key] = searches[:5] or [query]
+        return parsed
+
+    def lean_response(self, query: str, on_progress: Callable[[str], None] = None) -> str:
+        """
+        Versión reducida del flujo: una llamada de planificación, las búsquedas de
+        cada experto, sus respuestas y la síntesis final. La conversación se registra
+        con los pensamientos generados en la planificación.
+        """
+        plan = self.plan_query(query)
+        for agent, key in (("Coordinador", "coordinador"), ("Experto Legal", "legal"), ("Analista de Mercado", "mercado")):
+            for thought in plan["thoughts"][key]:
+                log_agent_thought(self.logger, agent, thought)
+        
+        experts = []
+        if plan["legal"]:
+            experts.append(("legal", partial(self.legal_agent.answer_from_plan, query, plan["legal_searches"]), None))
+        if plan["market"] or not experts:
+            experts.append(("market", partial(self.market_agent.answer_from_plan, query, plan["market_searches"]), None))
+        responses = self.run_experts(experts)
+        
+        final_response = self.synthesize(query, responses, on_progress)
+        log_agent_thought(self.logger, "Coordinador", f"He preparado una respuesta completa basada en el análisis del equipo.")
+        return final_response
+
+    def synthesize(self, query: str, responses: List[str], on_progress: Callable[[str], None] = None) -> str:
+        """
+        Genera la respuesta final a partir de las respuestas de los expertos. Con on_progress,
+        la respuesta se genera en streaming y on_progress recibe el texto acumulado.
+        Si el streaming falla por el proveedor, la respuesta se genera sin streaming (con
+        el modelo de respaldo, si hay) y reemplaza al texto parcial.
+        """
+        prompt = self.synthesis_prompt(query, responses)
+        if on_progress is None:
+            return self.llm.generate_text(prompt, step="coordinator.synthesis")
+        
+        text = ""
+        try:
+            for chunk in self.llm.stream_text(prompt, step="coordinator.synthesis"):
+                text += chunk
+                on_progress(text)
+        except Exception as e:
+            if not is_upstream_failure(e):
+                raise
+            print(f"Error en la síntesis en streaming, se genera sin streaming: {str(e)}")
+            text = self.llm.generate_text(prompt, model=self.llm.hedge_model, step="coordinator.synthesis")
+            on_progress(text)
+        return text
+
+    def think_about_coordination(self, query: str) -> None:
+        """
+        Registra el pensamiento del coordinador sobre cómo abordar la consulta.
+        """
+        self.thoughts.think(self.logger, "Coordinador", f"""
+        Como coordinador, ¿cómo deberíamos abordar esta consulta?
+        "{query}"
+        
+        Expresa tus pensamientos sobre la mejor manera de coordinar al equipo para responder.
+        """)
+
+    def think_about_integration(self) -> None:
+        """
+        Registra el pensamiento del coordinador sobre cómo integrar las respuestas.
+        """
+        self.thoughts.think(self.logger, "Coordinador", f"""
         Hemos recibido las respuestas del equipo. ¿Cómo deberíamos integrar esta información?
         
         Expresa tus pensamientos sobre cómo combinar las diferentes perspectivas en una respuesta coherente.
-        """)
-        log_agent_thought(self.logger, "Coordinador", integration_thought)
-        final_response = self.llm.generate_text(prompt)
+        """, cache_ttl=STATIC_PROMPT_TTL)
+
+    def coordinate_response(self, query: str, on_progress: Callable[[str], None] = None) -> str:
+        """
+        Coordina la obtención de respuestas de los diferentes agentes y las combina
+        de manera coherente y natural.
+        """
+        # Pensar sobre cómo coordinar la respuesta
+        self.think_about_coordination(query)
+        
+        # Analizar la intención de la consulta
+        needs = self.analyze_query_intent(query)
+        responses = self.gather_expert_responses(query, needs)
+        
+        # Pensar sobre cómo integrar las respuestas
+        self.think_about_integration()
+        
+        # Combinar las respuestas en un formato natural
+        final_response = self.synthesize(query, responses, on_progress)
         
         log_agent_thought(self.logger, "Coordinador", f"He preparado una respuesta completa basada en el análisis del equipo.")
         return final_response
 
-    def handle_query(self, query: str) -> str:
+    def dag_steps(self, on_progress: Callable[[str], None] = None) -> List[Step]:
+        """
+        Declara el flujo completo como un grafo de pasos. Cada experto aporta sus propios
+        pasos (agent.pipeline_steps()) y su respuesta "<experto>.answer" alimenta la síntesis.
+        """
+        def routing(query: str) -> Optional[Dict[str, bool]]:
+            decision = self.route_locally(query)
+            return decision.needs if decision is not None else None
+
+        def initial_thought(query: str) -> str:
+            thought = self.think_about_query(query)
+            log_agent_thought(self.logger, "Coordinador", thought)
+            return thought
+
+        def team_approach(initial: str) -> str:
+            approach = self.decide_team_approach(initial)
+            log_agent_thought(self.logger, "Coordinador", approach)
+            return approach
+
+        def needs(query: str, local: Optional[Dict[str, bool]], approach: Optional[str]) -> Dict[str, bool]:
+            if local is not None:
+                return local
+            needs = self.needs_from_approach(approach)
+            if self.router is not None:
+                self.router.record(query, needs, "llm")
+            # Si no hay respuestas específicas, usar al menos un agente
+            if not any(needs[name] for name, _ in self.experts):
+                needs["market"] = True
+            return needs
+
+        def request_thought(name: str) -> Callable[[str], None]:
+            def think(query: str) -> None:
+                self.thoughts.think(self.logger, "Coordinador", self.request_prompt(name, query))
+            return think
+
+        def synthesis(query: str, *answers: Optional[str]) -> str:
+            responses = [answer for answer in answers if answer is not None]
+            final_response = self.synthesize(query, responses, on_progress)
+            log_agent_thought(self.logger, "Coordinador", f"He preparado una respuesta completa basada en el análisis del equipo.")
+            return final_response
+
+        steps = [
+            Step("coordination_thought", self.think_about_coordination, ["query"], "llm"),
+            Step("routing", routing, ["query"]),
+            # El análisis del LLM solo se ejecuta si el ruteo local no decidió
+            Step("initial_thought", initial_thought, ["query"], "llm", after=["routing"],
+                 when=lambda results: results["routing"] is None),
+            Step("team_approach", team_approach, ["initial_thought"], "llm"),
+            Step("needs", needs, ["query", "routing", "team_approach"], accepts_skipped=True),
+            Step("integration_thought", self.think_about_integration, [], "llm", after=["needs"])
+        ]
+        for name, agent in self.experts:
+            steps.append(Step(f"{name}.request_thought", request_thought(name), ["query"], "llm",
+                              after=["needs"], when=lambda results, name=name: results["needs"][name]))
+            steps.extend(agent.pipeline_steps())
+        steps.append(Step("synthesis", synthesis, ["query"] + [f"{name}.answer" for name, _ in self.experts], "llm",
+                          accepts_skipped=True))
+        return steps
+
+    def dag_response(self, query: str, on_progress: Callable[[str], None] = None) -> str:
+        """
+        Ejecuta el flujo declarado en dag_steps, corriendo en paralelo los pasos
+        independientes, y guarda el reporte del camino crítico.
+        """
+        scheduler = StepScheduler(self.step_limits)
+        results = scheduler.run(self.dag_steps(on_progress), {"query": query})
+        
+        self.last_timings = {}
+        for name, _ in self.experts:
+            spans = [span for step, span in scheduler.timings.items() if step.startswith(f"{name}.")]
+            if spans:
+                self.last_timings[name] = max(end for _, end in spans) - min(start for start, _ in spans)
+        self.last_report = scheduler.report()
+        return results["synthesis"]
+
+    def handle_query(self, query: str, deadline: Deadline = None, on_progress: Callable[[str], None] = None,
+                     usage: UsageMeter = None) -> str:
+        """
+        Punto de entrada principal para manejar consultas. El plazo, si se indica, limita
+        todas las llamadas a proveedores de la consulta, incluidas las de otros hilos.
+        El medidor usage, si se indica, registra el consumo de LLM de la consulta por paso
+        y aplica su presupuesto a los pasos opcionales.
+        Con on_progress, la síntesis final se genera en streaming y on_progress recibe
+        el texto acumulado.
+        Si alguna búsqueda se respondió sin Serper (circuito abierto o fallas), la
+        respuesta se marca como degradada.
+        Con la caché de respuestas, una consulta parecida a una ya respondida recibe la
+        respuesta guardada sin ejecutar el flujo; las respuestas degradadas no se guardan.
+        """
+        if self.answers is not None:
+            cached = self.answers.lookup(query)
+            if cached is not None:
+                print(f"Respuesta reutilizada de la consulta '{cached.query}' "
+                      f"(similitud {cached.similarity:.2f}, {cached.age / 60:.0f} min)")
+                if self.answers.needs_refresh(cached):
+                    self.answers.refresh(cached, self.fresh_response)
+                return cached.answer
+        
+        with deadline_scope(deadline or current_deadline()), usage_scope(usage or current_usage()):
+            response, degraded = self.run_pipeline(query, on_progress)
+        
+        if degraded:
+            return response + DEGRADED_NOTICE
+        if self.answers is not None:
+            self.answers.store(query, response)
+        return response
+
+    def run_pipeline(self, query: str, on_progress: Callable[[str], None] = None) -> Tuple[str, bool]:
+        """
+        Genera la respuesta con el flujo configurado. Retorna la respuesta e indica si
+        alguna búsqueda se respondió sin Serper.
+        """
+        with degradation_scope() as degraded:
+            if self.pipeline_mode == "lean":
+                response = self.lean_response(query, on_progress)
+            elif self.pipeline_mode == "dag":
+                response = self.dag_response(query, on_progress)
+            else:
+                response = self.coordinate_response(query, on_progress)
+        return response, bool(degraded)
+
+    def fresh_response(self, query: str) -> Optional[str]:
         """
-        Punto de entrada principal para manejar consultas.
+        Recalcula la respuesta de una consulta guardada, con el consumo registrado aparte.
+        Retorna None si la respuesta quedó degradada.
         """
-        return self.coordinate_response(query)
+        with usage_scope(UsageMeter(label=f"refresco: {query[:40]}")):
+            response, degraded = self.run_pipeline(query)
+        return None if degraded else response
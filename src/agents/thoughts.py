@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, List
+
+from integrations.openrouter import OpenRouterLLM
+from utils.deadline import budget_allows, submit_in_context
+from utils.helpers import conversation_muted, log_agent_thought
+from utils.usage import usage_allows
+
+# Prefijo del paso de ruteo de modelos según el agente que piensa
+AGENT_STEPS = {"Coordinador": "coordinator", "Experto Legal": "legal", "Analista de Mercado": "market"}
+
+class ThoughtWriter:
+    """
+    Genera y registra los pensamientos narrativos de los agentes en la conversación.
+    Con workers > 0 los pensamientos se generan en segundo plano, fuera del camino
+    de la respuesta, y drain() espera a que la conversación esté completa.
+    Los pensamientos son opcionales: se omiten si al plazo de la mención le quedan
+    menos de reserve segundos o si la mención alcanzó su presupuesto de tokens o costo.
+    """
+    def __init__(self, llm: OpenRouterLLM, workers: int = 0, reserve: float = 0):
+        self.llm = llm
+        self.workers = workers
+        self.reserve = reserve
+        self.skipped = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self._pending: List[Future] = []
+        self._lock = threading.Lock()
+
+    @property
+    def background(self) -> bool:
+        return self._executor is not None
+
+    def think(self, logger: logging.Logger, agent: str, prompt: str, **llm_kwargs) -> None:
+        """
+        Genera un pensamiento con el LLM y lo registra a nombre del agente. El modelo
+        sale del paso "<agente>.thought" de la tabla de ruteo, salvo que se indique otro.
+        Con la conversación silenciada no se genera.
+        """
+        if conversation_muted() or not self._has_budget():
+            return
+        llm_kwargs.setdefault("step", f"{AGENT_STEPS.get(agent, 'coordinator')}.thought")
+        self.defer(self._write, logger, agent, prompt, llm_kwargs)
+
+    def defer(self, func: Callable[..., Any], *args) -> None:
+        """
+        Ejecuta func en segundo plano si está activo, o de inmediato en caso contrario.
+        """
+        if self._executor is None:
+            func(*args)
+            return
+        future = submit_in_context(self._executor, self._run, func, *args)
+        with self._lock:
+            self._pending.append(future)
+
+    def defer_optional(self, func: Callable[..., Any], *args) -> None:
+        """
+        Como defer, para pasos que solo registran pensamientos: se omiten con la
+        conversación silenciada o sin presupuesto, también si este se agota en la cola.
+        """
+        if conversation_muted() or not self._has_budget():
+            return
+        self.defer(self._optional, func, *args)
+
+    def _optional(self, func: Callable[..., Any], *args) -> None:
+        if self._has_budget():
+            func(*args)
+
+    def _has_budget(self) -> bool:
+        if budget_allows(self.reserve) and usage_allows():
+            return True
+        with self._lock:
+            self.skipped += 1
+        return False
+
+    def _write(self, logger: logging.Logger, agent: str, prompt: str, llm_kwargs: dict) -> None:
+        # En segundo plano el pensamiento puede llevar tiempo en cola
+        if not self._has_budget():
+            return
+        thought = self.llm.generate_text(prompt, **llm_kwargs)
+        log_agent_thought(logger, agent, thought)
+
+    def _run(self, func: Callable[..., Any], *args) -> None:
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"Error al generar pensamiento en segundo plano: {str(e)}")
+
+    def drain(self, timeout: float = None) -> bool:
+        """
+        Espera a que terminen los pensamientos pendientes (incluidos los que se encolen
+        mientras tanto). Retorna False si se agotó el tiempo de espera.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._pending = [future for future in self._pending if not future.done()]
+                pending = list(self._pending)
+            if not pending:
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            wait(pending, timeout=remaining)
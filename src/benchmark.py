@@ -0,0 +1,271 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from benchmark_standins import StandInProfile, StandInServers
+
+# Consulta de ejemplo; cada ejecución le agrega un sufijo para no repetir prompts
+DEFAULT_QUERY = ("¿Qué requisitos legales tiene arrendar un departamento en Providencia "
+                 "y cuál es el precio de mercado del arriendo?")
+# Métricas comparadas con --compare: (métrica, True si un valor mayor es peor)
+COMPARED_METRICS = [("p95", True), ("throughput", False), ("llm_calls", True), ("search_queries", True)]
+
+def parse_latency(value: str) -> tuple:
+    """
+    Interpreta "mediana,p95" (segundos); con un solo valor la latencia es fija.
+    """
+    parts = [float(part) for part in value.split(",")]
+    return parts[0], parts[1] if len(parts) > 1 else parts[0]
+
+def start_servers(args) -> StandInServers:
+    llm_median, llm_p95 = parse_latency(args.llm)
+    search_median, search_p95 = parse_latency(args.search)
+    clickup_median, clickup_p95 = parse_latency(args.clickup)
+    return StandInServers(
+        openrouter=StandInProfile(llm_median, llm_p95, args.llm_errors, size=args.llm_words),
+        serper=StandInProfile(search_median, search_p95, args.search_errors, size=args.search_results),
+        clickup=StandInProfile(clickup_median, clickup_p95, args.clickup_errors),
+        seed=args.seed
+    ).start()
+
+def configure_environment(servers: StandInServers, workdir: str) -> None:
+    """
+    Apunta la configuración a los servidores locales. Debe llamarse antes de importar
+    config.settings, que lee las variables de entorno al cargarse.
+    """
+    for key in ("COMPOSIO_API_KEY", "SERPER_API_KEY", "OPENROUTER_API_KEY", "CLICKUP_API_KEY"):
+        os.environ.setdefault(key, "benchmark")
+    os.environ.setdefault("CLICKUP_WORKSPACE_ID", "benchmark")
+    os.environ.update(OPENROUTER_BASE_URL=servers.openrouter_url, SERPER_BASE_URL=servers.serper_url,
+                      CLICKUP_BASE_URL=servers.clickup_url, CACHE_DIR=os.path.join(workdir, "cache"),
+                      WEBHOOK_ENABLED="False", LLM_USAGE_LOG="False")
+    os.makedirs(os.environ["CACHE_DIR"], exist_ok=True)
+    # main.py escribe conversation.md (pensamientos fuera de una mención) en el directorio actual
+    os.chdir(workdir)
+
+def quiet_logging() -> None:
+    """
+    Deja en consola solo las advertencias; los pensamientos siguen en las conversaciones.
+    """
+    from utils.helpers import ConversationHandler
+
+    for handler in logging.getLogger().handlers:
+        if not isinstance(handler, ConversationHandler):
+            handler.setLevel(logging.WARNING)
+
+def summarize(latencies: List[float], errors: int, wall: float, counts: Dict[str, int], total: int) -> Dict:
+    from integrations.openrouter import percentile
+
+    done = max(total, 1)
+    return {
+        "requests": total,
+        "errors": errors,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        "throughput": len(latencies) / wall if wall > 0 else 0.0,
+        "llm_calls": counts["openrouter"] / done,
+        "search_requests": counts["serper"] / done,
+        "search_queries": counts["serper_queries"] / done,
+        "clickup_calls": counts["clickup"] / done,
+        "upstream_errors": counts["errors"]
+    }
+
+def run_queries(servers: StandInServers, args, concurrency: int, initialize_agents) -> Dict:
+    """
+    Ejecuta args.queries consultas con TaskManager.handle_query, concurrency a la vez.
+    Cada nivel usa agentes (creados con initialize_agents de main) y cachés nuevos.
+    """
+    from config.settings import Settings
+    from utils.deadline import Deadline
+
+    settings = Settings()
+    settings.CACHE_DIR = tempfile.mkdtemp(prefix=f"nivel-{concurrency}-", dir=os.environ["CACHE_DIR"])
+    task_manager = initialize_agents(settings)
+    servers.reset_counts()
+
+    def run(index: int) -> float:
+        start = time.monotonic()
+        task_manager.handle_query(f"{args.query} (consulta {index + 1})",
+                                  deadline=Deadline(settings.MENTION_DEADLINE))
+        return time.monotonic() - start
+
+    latencies, errors = [], 0
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run, index) for index in range(args.queries)]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception as e:
+                errors += 1
+                print(f"Error en la consulta: {str(e)}", file=sys.stderr)
+    return summarize(latencies, errors, time.monotonic() - start, servers.counts(), args.queries)
+
+def run_loop(servers: StandInServers, args, workers: int) -> Dict:
+    """
+    Ejecuta main() vigilando una lista simulada con una tarea por mención y workers hilos
+    de respuesta. Mide desde que se publica cada mención hasta que se publica su respuesta.
+    """
+    list_id = "benchmark"
+    task_ids = [f"tarea-{index + 1}" for index in range(args.queries)]
+    for task_id in task_ids:
+        servers.add_task(list_id, task_id)
+        servers.add_comment(task_id, "Tarea creada para el benchmark")
+    os.environ.update(WATCH_LIST="True", CLICKUP_LIST_ID=list_id, MENTION_WORKERS=str(workers),
+                      MENTION_QUEUE_DEPTH=str(args.queries), MENTION_QUEUE_POLICY="defer",
+                      POLL_INTERVAL="0.2", CLICKUP_RATE_LIMIT="60000", TASK_REFRESH_INTERVAL="3600")
+
+    import main
+    quiet_logging()
+    threading.Thread(target=main.main, daemon=True).start()
+
+    # El vigilante fija la marca de agua de cada tarea la primera vez que la consulta
+    limit = time.monotonic() + args.timeout
+    while not all(servers.comment_reads(task_id) for task_id in task_ids) and time.monotonic() < limit:
+        time.sleep(0.05)
+
+    servers.reset_counts()
+    posted = {}
+    start = time.monotonic()
+    for index, task_id in enumerate(task_ids):
+        servers.add_comment(task_id, f"@AI {args.query} (consulta {index + 1})")
+        posted[task_id] = time.monotonic()
+
+    latencies = {}
+    while len(latencies) < len(task_ids) and time.monotonic() < limit:
+        for task_id in task_ids:
+            replies = servers.replies(task_id)
+            if task_id not in latencies and replies:
+                latencies[task_id] = replies[0][0] - posted[task_id]
+        time.sleep(0.05)
+    wall = max(latencies.values()) if latencies else time.monotonic() - start
+    return summarize(list(latencies.values()), len(task_ids) - len(latencies), wall, servers.counts(), args.queries)
+
+def run_level_subprocess(args, concurrency: int) -> Dict:
+    """
+    Ejecuta un nivel del modo "loop" en un proceso aparte: main() no termina y la
+    configuración se lee una sola vez por proceso.
+    """
+    command = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ["--level", str(concurrency)]
+    result = subprocess.run(command, stdout=subprocess.PIPE, text=True, timeout=args.timeout + 60)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f"El nivel {concurrency} terminó con código {result.returncode}")
+    return json.loads(lines[-1])
+
+def print_results(mode: str, results: List[Dict]) -> None:
+    label = "consultas simultáneas" if mode == "query" else "hilos de respuesta"
+    print(f"\n{'conc':>5} {'p50':>7} {'p95':>7} {'p99':>7} {'req/s':>7} {'llm':>6} {'serper':>7} "
+          f"{'errores':>8}   ({label}; llm y serper por consulta)")
+    for result in results:
+        print(f"{result['concurrency']:>5} {result['p50']:>6.2f}s {result['p95']:>6.2f}s {result['p99']:>6.2f}s "
+              f"{result['throughput']:>7.2f} {result['llm_calls']:>6.1f} {result['search_queries']:>7.1f} "
+              f"{result['errors']:>8}")
+
+def compare(results: List[Dict], baseline_path: str, tolerance: float) -> List[str]:
+    """
+    Compara los resultados con un benchmark guardado. Retorna las regresiones que superan
+    la tolerancia relativa.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {result["concurrency"]: result for result in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["concurrency"])
+        if previous is None:
+            continue
+        for metric, higher_is_worse in COMPARED_METRICS:
+            before, after = previous[metric], result[metric]
+            if before <= 0:
+                continue
+            change = (after - before) / before
+            if (change > tolerance) if higher_is_worse else (change < -tolerance):
+                regressions.append(f"concurrencia {result['concurrency']}: {metric} {before:.2f} -> {after:.2f} "
+                                   f"({change:+.0%})")
+        if result["errors"] > previous["errors"]:
+            regressions.append(f"concurrencia {result['concurrency']}: {result['errors']} consultas con error "
+                               f"(antes {previous['errors']})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del flujo de agentes sin red, contra servidores "
+                                                 "locales que imitan OpenRouter, Serper y ClickUp.")
+    parser.add_argument("--mode", choices=["query", "loop"], default="query",
+                        help="query: TaskManager.handle_query; loop: main() con vigilancia de una lista")
+    parser.add_argument("--queries", type=int, default=20, help="consultas (o menciones) por nivel")
+    parser.add_argument("--concurrency", default="1,4,8", help="niveles de concurrencia, separados por comas")
+    parser.add_argument("--query", default=DEFAULT_QUERY)
+    parser.add_argument("--llm", default="0.1,0.4", help="latencia de OpenRouter: mediana,p95 (segundos)")
+    parser.add_argument("--search", default="0.05,0.2", help="latencia de Serper: mediana,p95 (segundos)")
+    parser.add_argument("--clickup", default="0.02,0.08", help="latencia de ClickUp: mediana,p95 (segundos)")
+    parser.add_argument("--llm-errors", type=float, default=0.0, help="fracción de completions con error 503")
+    parser.add_argument("--search-errors", type=float, default=0.0, help="fracción de búsquedas con error 503")
+    parser.add_argument("--clickup-errors", type=float, default=0.0, help="fracción de peticiones a ClickUp con error 503")
+    parser.add_argument("--llm-words", type=int, default=200, help="palabras por completion")
+    parser.add_argument("--search-results", type=int, default=10, help="resultados máximos por búsqueda")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=600, help="espera máxima por nivel en modo loop (segundos)")
+    parser.add_argument("--save", help="guarda los resultados en este archivo JSON")
+    parser.add_argument("--compare", help="compara con un archivo guardado con --save y falla si hay regresiones")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="variación relativa tolerada por --compare")
+    parser.add_argument("--verbose", action="store_true", help="muestra la salida del sistema de agentes")
+    parser.add_argument("--level", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+    # Las rutas se resuelven antes de cambiar al directorio de trabajo
+    args.save = os.path.abspath(args.save) if args.save else None
+    args.compare = os.path.abspath(args.compare) if args.compare else None
+
+    if args.level is not None:
+        # Nivel del modo "loop" en un proceso aparte: la salida de main() sigue en segundo
+        # plano, así que el resultado se escribe directamente en la salida original
+        servers = start_servers(args)
+        workdir = tempfile.mkdtemp(prefix="benchmark-")
+        configure_environment(servers, workdir)
+        sys.stdout = sys.stderr if args.verbose else open("benchmark.log", "w", encoding="utf-8")
+        result = dict(run_loop(servers, args, args.level), concurrency=args.level)
+        print(json.dumps(result), file=sys.__stdout__, flush=True)
+        return
+
+    if args.mode == "loop":
+        results = [dict(run_level_subprocess(args, level), concurrency=level) for level in levels]
+    else:
+        servers = start_servers(args)
+        workdir = tempfile.mkdtemp(prefix="benchmark-")
+        configure_environment(servers, workdir)
+        output = sys.stdout if args.verbose else open("benchmark.log", "w", encoding="utf-8")
+        with contextlib.redirect_stdout(output):
+            # Al importarse, main configura el logging (conversation.md en el directorio de trabajo)
+            from main import initialize_agents
+            quiet_logging()
+            results = [dict(run_queries(servers, args, level, initialize_agents), concurrency=level)
+                       for level in levels]
+        servers.stop()
+        print(f"Salida del sistema de agentes en {workdir}")
+
+    print_results(args.mode, results)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"mode": args.mode, "args": vars(args), "results": results}, f, indent=2)
+        print(f"\nResultados guardados en {args.save}")
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for regression in regressions:
+            print(f"Regresión: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("\nSin regresiones respecto de la referencia")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import urlparse
+
+# Prefijos de ruta de cada proveedor en el servidor local
+OPENROUTER_PREFIX = "/openrouter/api/v1"
+SERPER_PREFIX = "/serper"
+CLICKUP_PREFIX = "/clickup/api/v2"
+
+# Vocabulario de las respuestas generadas: incluye las palabras clave del ruteo del
+# coordinador para que intervengan ambos expertos
+WORDS = ("ley", "normativa", "mercado", "precio", "valor", "arriendo", "contrato", "propiedad",
+         "comuna", "plusvalía", "escritura", "tasación", "crédito", "hipotecario", "inmueble")
+
+class StandInProfile:
+    """
+    Comportamiento de un proveedor simulado: latencia con distribución lognormal
+    (mediana y percentil 95, en segundos), tasa de errores y tamaño de las respuestas
+    (palabras por completion en OpenRouter, resultados por consulta en Serper).
+    """
+    def __init__(self, median: float = 0.05, p95: float = None, error_rate: float = 0.0,
+                 error_status: int = 503, size: int = 200):
+        self.median = median
+        self.p95 = p95 if p95 is not None else median
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.size = size
+
+    def latency(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        # Para una lognormal, p95 = mediana * exp(1.645 * sigma)
+        sigma = math.log(max(self.p95, self.median) / self.median) / 1.645
+        return rng.lognormvariate(math.log(self.median), sigma)
+
+    def fails(self, rng: random.Random) -> bool:
+        return rng.random() < self.error_rate
+
+class StandInServers:
+    """
+    Servidor HTTP local que imita las APIs de OpenRouter (completions, con y sin
+    streaming), Serper (consultas individuales y en lote) y ClickUp (listas, tareas,
+    comentarios y adjuntos) para medir el flujo completo sin red.
+    """
+    def __init__(self, openrouter: StandInProfile = None, serper: StandInProfile = None,
+                 clickup: StandInProfile = None, seed: int = None, host: str = "127.0.0.1", port: int = 0):
+        self.profiles = {
+            "openrouter": openrouter or StandInProfile(0.05, size=200),
+            "serper": serper or StandInProfile(0.02, size=10),
+            "clickup": clickup or StandInProfile(0.01)
+        }
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counts = {"openrouter": 0, "serper": 0, "serper_queries": 0, "clickup": 0, "errors": 0}
+        self._ids = itertools.count(1)
+        self._lists: Dict[str, List[str]] = {}
+        self._comments: Dict[str, List[Dict]] = {}
+        self._replies: Dict[str, List[tuple]] = {}
+        self._comment_reads: Dict[str, int] = {}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def openrouter_url(self) -> str:
+        return self.base_url + OPENROUTER_PREFIX
+
+    @property
+    def serper_url(self) -> str:
+        return self.base_url + SERPER_PREFIX + "/search"
+
+    @property
+    def clickup_url(self) -> str:
+        return self.base_url + CLICKUP_PREFIX
+
+    def start(self) -> "StandInServers":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Peticiones recibidas por proveedor, consultas de Serper (una petición en lote
+        cuenta cada consulta) y respuestas de error simuladas.
+        """
+        with self._lock:
+            return dict(self._counts)
+
+    def reset_counts(self) -> None:
+        with self._lock:
+            for key in self._counts:
+                self._counts[key] = 0
+
+    def add_task(self, list_id: str, task_id: str) -> None:
+        """
+        Agrega una tarea a una lista de ClickUp simulada.
+        """
+        with self._lock:
+            self._lists.setdefault(list_id, []).append(task_id)
+            self._comments.setdefault(task_id, [])
+
+    def add_comment(self, task_id: str, text: str) -> Dict:
+        """
+        Publica un comentario en una tarea como si lo hubiera escrito un usuario.
+        """
+        with self._lock:
+            return self._add_comment(task_id, text)
+
+    def _add_comment(self, task_id: str, text: str) -> Dict:
+        comment = {"id": str(next(self._ids)), "comment_text": text, "date": str(int(time.time() * 1000)),
+                   "user": {"username": "benchmark"}}
+        self._comments.setdefault(task_id, []).append(comment)
+        return comment
+
+    def comment_reads(self, task_id: str) -> int:
+        """
+        Veces que se consultaron los comentarios de la tarea.
+        """
+        with self._lock:
+            return self._comment_reads.get(task_id, 0)
+
+    def replies(self, task_id: str) -> List[tuple]:
+        """
+        Comentarios publicados en la tarea a través de la API, como (momento, texto),
+        con el momento según time.monotonic().
+        """
+        with self._lock:
+            return list(self._replies.get(task_id, []))
+
+    def _count(self, key: str, value: int = 1) -> None:
+        with self._lock:
+            self._counts[key] += value
+
+    def _completion_text(self, prompt: str) -> str:
+        size = self.profiles["openrouter"].size
+        with self._lock:
+            words = [self._rng.choice(WORDS) for _ in range(max(size, 1))]
+        if '"legal_searches"' in prompt:
+            # Plan del flujo "lean": el coordinador espera un objeto JSON
+            return json.dumps({
+                "legal": True, "market": True,
+                "legal_searches": [" ".join(words[i:i + 4]) for i in range(0, 12, 4)],
+                "market_searches": [" ".join(words[i:i + 4]) for i in range(12, 24, 4)],
+                "thoughts": {"coordinador": [" ".join(words[:20])], "legal": [" ".join(words[20:40])],
+                             "mercado": [" ".join(words[40:60])]}
+            }, ensure_ascii=False)
+        # Las primeras líneas sirven como búsquedas sugeridas ("- ...")
+        searches = "\n".join(f"- {' '.join(words[i:i + 4])}" for i in range(0, 12, 4))
+        return searches + "\n" + " ".join(words)
+
+    def _search_result(self, payload: Dict) -> Dict:
+        size = self.profiles["serper"].size
+        num = min(int(payload.get("num", size)), size)
+        query = payload.get("q", "")
+        items = [{"title": f"{query} ({i + 1})", "snippet": f"Resultado {i + 1} sobre {query}: " + " ".join(WORDS),
+                  "link": f"https://example.com/{i + 1}", "address": "Santiago", "rating": 4.5}
+                 for i in range(num)]
+        key = {"news": "news", "places": "places", "images": "images"}.get(payload.get("type"), "organic")
+        return {"searchParameters": payload, key: items}
+
+    def _handler_class(self):
+        servers = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Sin Nagle: los encabezados y el cuerpo van en escrituras separadas y, con
+            # conexiones persistentes, el ACK retardado sumaría ~40 ms a cada petición
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PUT(self):
+                self._dispatch("PUT")
+
+            def _dispatch(self, method: str) -> None:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+                path = urlparse(self.path).path
+                for service, prefix in (("openrouter", OPENROUTER_PREFIX), ("serper", SERPER_PREFIX),
+                                        ("clickup", CLICKUP_PREFIX)):
+                    if path.startswith(prefix):
+                        break
+                else:
+                    return self._json(404, {"err": "Ruta desconocida"})
+
+                profile = servers.profiles[service]
+                servers._count(service)
+                with servers._lock:
+                    delay = profile.latency(servers._rng)
+                    failed = profile.fails(servers._rng)
+                time.sleep(delay)
+                if failed:
+                    servers._count("errors")
+                    return self._json(profile.error_status, {"error": {"message": "Error simulado"}})
+
+                route = path[len(prefix):]
+                if service == "openrouter":
+                    return self._openrouter(json.loads(body or b"{}"))
+                if service == "serper":
+                    return self._serper(json.loads(body or b"{}"))
+                return self._clickup(method, route, body)
+
+            def _openrouter(self, data: Dict) -> None:
+                prompt = " ".join(m.get("content", "") for m in data.get("messages", []))
+                text = servers._completion_text(prompt)
+                usage = {"prompt_tokens": len(prompt.split()), "completion_tokens": len(text.split()),
+                         "cost": 0.000002 * (len(prompt.split()) + len(text.split()))}
+                if not data.get("stream"):
+                    return self._json(200, {"model": data.get("model"), "usage": usage,
+                                            "choices": [{"message": {"role": "assistant", "content": text}}]})
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                self._chunk(b": OPENROUTER PROCESSING\n\n")
+                for match in re.finditer(r"\S+\s*", text):
+                    event = {"choices": [{"delta": {"content": match.group(0)}}]}
+                    self._chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self._chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+                self._chunk(b"data: [DONE]\n\n")
+                self._chunk(b"")
+
+            def _serper(self, payload) -> None:
+                if isinstance(payload, list):
+                    servers._count("serper_queries", len(payload))
+                    return self._json(200, [servers._search_result(p) for p in payload])
+                servers._count("serper_queries")
+                return self._json(200, servers._search_result(payload))
+
+            def _clickup(self, method: str, route: str, body: bytes) -> None:
+                parts = route.strip("/").split("/")
+                if route == "/team":
+                    return self._json(200, {"teams": []})
+                if method == "GET" and len(parts) == 3 and parts[0] == "list" and parts[2] == "task":
+                    with servers._lock:
+                        tasks = [{"id": task_id} for task_id in servers._lists.get(parts[1], [])]
+                    return self._json(200, {"tasks": tasks})
+                if len(parts) == 3 and parts[0] == "task" and parts[2] == "comment":
+                    task_id = parts[1]
+                    if method == "GET":
+                        with servers._lock:
+                            servers._comment_reads[task_id] = servers._comment_reads.get(task_id, 0) + 1
+                            comments = list(reversed(servers._comments.get(task_id, [])))[:25]
+                        return self._json(200, {"comments": comments})
+                    text = json.loads(body or b"{}").get("comment_text", "")
+                    with servers._lock:
+                        comment = servers._add_comment(task_id, text)
+                        servers._replies.setdefault(task_id, []).append((time.monotonic(), text))
+                    return self._json(200, {"id": comment["id"], "date": comment["date"]})
+                if method == "PUT" and len(parts) == 2 and parts[0] == "comment":
+                    return self._json(200, {})
+                if method == "POST" and len(parts) == 3 and parts[0] == "task" and parts[2] == "attachment":
+                    return self._json(200, {"id": f"adjunto-{parts[1]}"})
+                return self._json(404, {"err": "Ruta desconocida"})
+
+            def _json(self, status: int, payload) -> None:
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _chunk(self, data: bytes) -> None:
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
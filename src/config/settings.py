@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -10,17 +11,170 @@ class Settings:
     CLICKUP_WORKSPACE_ID = os.getenv("CLICKUP_WORKSPACE_ID")
     CLICKUP_API_KEY = os.getenv("CLICKUP_API_KEY")
 
+    # URLs base de las APIs (se cambian para apuntar a los servidores locales del benchmark)
+    OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+    SERPER_BASE_URL = os.getenv("SERPER_BASE_URL", "https://google.serper.dev/search")
+    CLICKUP_BASE_URL = os.getenv("CLICKUP_BASE_URL", "https://api.clickup.com/api/v2")
+
     # Configuraciones adicionales
     DEBUG = os.getenv("DEBUG", "False").lower() == "true"
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
     # Configuraciones de los agentes
-    LEGAL_AGENT_MODEL = os.getenv("LEGAL_AGENT_MODEL", "gpt-3.5-turbo")
-    MARKET_AGENT_MODEL = os.getenv("MARKET_AGENT_MODEL", "gpt-3.5-turbo")
+    DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "gpt-3.5-turbo")
+    LEGAL_AGENT_MODEL = os.getenv("LEGAL_AGENT_MODEL", DEFAULT_MODEL)
+    MARKET_AGENT_MODEL = os.getenv("MARKET_AGENT_MODEL", DEFAULT_MODEL)
+    # Modelo para los pasos baratos (ruteo, planificación de búsquedas y pensamientos)
+    # y modelo para la síntesis final del coordinador
+    FAST_MODEL = os.getenv("FAST_MODEL", DEFAULT_MODEL)
+    STRONG_MODEL = os.getenv("STRONG_MODEL", DEFAULT_MODEL)
+    # Ajustes por paso en JSON, por ejemplo {"thought": {"max_tokens": 300, "temperature": 0.7}}
+    MODEL_ROUTES = os.getenv("MODEL_ROUTES", "{}")
+
+    # Modo del flujo de agentes: "full" (pensamientos completos), "lean" (planificación en una llamada)
+    # o "dag" (flujo completo con pasos independientes en paralelo)
+    PIPELINE_MODE = os.getenv("PIPELINE_MODE", "full").lower()
+    # Presupuesto (tokens estimados) de los fragmentos de búsqueda en la respuesta de cada experto
+    # y de las respuestas de los expertos en la síntesis (0 = sin límite); umbral de similitud
+    # a partir del cual dos fragmentos se consideran duplicados
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+    SYNTHESIS_TOKEN_BUDGET = int(os.getenv("SYNTHESIS_TOKEN_BUDGET", "0"))
+    CONTEXT_SIMILARITY = float(os.getenv("CONTEXT_SIMILARITY", "0.6"))
+
+    # Pasos simultáneos por proveedor en el modo "dag"
+    DAG_LLM_CONCURRENCY = int(os.getenv("DAG_LLM_CONCURRENCY", "4"))
+    DAG_SEARCH_CONCURRENCY = int(os.getenv("DAG_SEARCH_CONCURRENCY", "4"))
+
+    # Pensamientos narrativos en segundo plano (la respuesta se publica sin esperarlos)
+    BACKGROUND_THOUGHTS = os.getenv("BACKGROUND_THOUGHTS", "False").lower() == "true"
+    THOUGHT_WORKERS = int(os.getenv("THOUGHT_WORKERS", "4"))
+    THOUGHTS_WAIT_TIMEOUT = float(os.getenv("THOUGHTS_WAIT_TIMEOUT", "60"))
+
+    # Plazo para responder cada mención (segundos) y tiempo que se reserva para las etapas
+    # obligatorias: los pensamientos se omiten cuando al plazo le queda menos que la reserva
+    MENTION_DEADLINE = float(os.getenv("MENTION_DEADLINE", "300"))
+    DEADLINE_RESERVE = float(os.getenv("DEADLINE_RESERVE", "60"))
+
+    # Presupuesto de LLM por mención: al alcanzarlo se omiten los pasos opcionales (0 = sin límite)
+    MENTION_TOKEN_BUDGET = int(os.getenv("MENTION_TOKEN_BUDGET", "0"))
+    MENTION_COST_BUDGET = float(os.getenv("MENTION_COST_BUDGET", "0"))
+    # Registro de cada llamada al LLM en CACHE_DIR/llm_usage.jsonl
+    LLM_USAGE_LOG = os.getenv("LLM_USAGE_LOG", "True").lower() == "true"
+
+    # Respuesta publicada de inmediato y completada mientras se genera la síntesis (segundos entre actualizaciones)
+    STREAM_REPLIES = os.getenv("STREAM_REPLIES", "False").lower() == "true"
+    STREAM_UPDATE_INTERVAL = float(os.getenv("STREAM_UPDATE_INTERVAL", "2"))
+
+    # Peticiones de respaldo al LLM cuando una completion tarda más que el p95 de su modelo
+    HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "False").lower() == "true"
+    HEDGE_FALLBACK_MODEL = os.getenv("HEDGE_FALLBACK_MODEL", "")
+    HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "2"))
+    HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "20"))
+
+    # Ejecución concurrente de los agentes expertos
+    PARALLEL_AGENTS = os.getenv("PARALLEL_AGENTS", "False").lower() == "true"
+    # Búsquedas que cada agente investiga en paralelo (1 = secuencial)
+    SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "1"))
+    # Envío de las búsquedas de cada ronda en un solo lote a Serper
+    SEARCH_BATCH_ENABLED = os.getenv("SEARCH_BATCH_ENABLED", "False").lower() == "true"
+    SERPER_BATCH_LIMIT = int(os.getenv("SERPER_BATCH_LIMIT", "100"))
+
+    # Transporte HTTP compartido (pools keep-alive y timeouts en segundos)
+    HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+    HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+    HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+    # Reintentos ante 429, 5xx y errores de conexión (espera exponencial con jitter, en segundos)
+    HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "4"))
+    HTTP_RETRY_BASE_DELAY = float(os.getenv("HTTP_RETRY_BASE_DELAY", "1"))
+    HTTP_RETRY_MAX_DELAY = float(os.getenv("HTTP_RETRY_MAX_DELAY", "60"))
+    # Grabación de las peticiones a OpenRouter, Serper y ClickUp: "off", "record" o "replay"
+    CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+    CASSETTE_PATH = os.getenv("CASSETTE_PATH", "cassette.jsonl.gz")
+    # En "replay", esperar lo que tardó cada respuesta original
+    CASSETTE_REPLAY_TIMING = os.getenv("CASSETTE_REPLAY_TIMING", "False").lower() == "true"
+    # Interruptores de circuito por proveedor: fallas consecutivas para abrirlo, segundos abierto
+    # antes de probar de nuevo y duración (segundos) a partir de la cual una llamada cuenta como falla
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+    BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+    SERPER_SLOW_CALL = float(os.getenv("SERPER_SLOW_CALL", "5"))
+    OPENROUTER_SLOW_CALL = float(os.getenv("OPENROUTER_SLOW_CALL", "90"))
+    CLICKUP_SLOW_CALL = float(os.getenv("CLICKUP_SLOW_CALL", "10"))
+    # Timeout de lectura de las búsquedas (segundos)
+    SERPER_TIMEOUT = float(os.getenv("SERPER_TIMEOUT", "10"))
+    # Límites de peticiones por minuto de cada proveedor (CLICKUP_RATE_LIMIT más abajo)
+    SERPER_RATE_LIMIT = int(os.getenv("SERPER_RATE_LIMIT", "300"))
+    OPENROUTER_RATE_LIMIT = int(os.getenv("OPENROUTER_RATE_LIMIT", "200"))
+
+    # Caché persistente de respuestas del LLM
+    CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+    LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "False").lower() == "true"
+    LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "21600"))
+    LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+    # Caché en memoria de búsquedas de Serper (TTL en segundos por tipo de resultado)
+    SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "False").lower() == "true"
+    SEARCH_CACHE_TTL_SEARCH = float(os.getenv("SEARCH_CACHE_TTL_SEARCH", "3600"))
+    SEARCH_CACHE_TTL_NEWS = float(os.getenv("SEARCH_CACHE_TTL_NEWS", "900"))
+    SEARCH_CACHE_TTL_PLACES = float(os.getenv("SEARCH_CACHE_TTL_PLACES", "86400"))
+    SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2000"))
+
+    # Índice local (BM25) de los fragmentos de Serper, en CACHE_DIR/snippet_index.sqlite3: una
+    # búsqueda se responde sin Serper si hay suficientes fragmentos que contienen al menos
+    # SNIPPET_INDEX_MIN_COVERAGE de sus términos y no superan la antigüedad máxima (segundos)
+    SNIPPET_INDEX_ENABLED = os.getenv("SNIPPET_INDEX_ENABLED", "False").lower() == "true"
+    SNIPPET_INDEX_MIN_COVERAGE = float(os.getenv("SNIPPET_INDEX_MIN_COVERAGE", "0.75"))
+    SNIPPET_INDEX_MAX_AGE_SEARCH = float(os.getenv("SNIPPET_INDEX_MAX_AGE_SEARCH", "604800"))
+    SNIPPET_INDEX_MAX_AGE_NEWS = float(os.getenv("SNIPPET_INDEX_MAX_AGE_NEWS", "86400"))
+    SNIPPET_INDEX_RETENTION_DAYS = float(os.getenv("SNIPPET_INDEX_RETENTION_DAYS", "30"))
+    SNIPPET_INDEX_MAX_DOCUMENTS = int(os.getenv("SNIPPET_INDEX_MAX_DOCUMENTS", "50000"))
+
+    # Caché de respuestas completas por similitud de la consulta (CACHE_DIR/answers.sqlite3);
+    # ANSWER_CACHE_REFRESH_AFTER: antigüedad (segundos) a partir de la cual un acierto
+    # recalcula la respuesta en segundo plano (0 = nunca)
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "False").lower() == "true"
+    ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.85"))
+    ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+    ANSWER_CACHE_REFRESH_AFTER = float(os.getenv("ANSWER_CACHE_REFRESH_AFTER", "0"))
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+    # Ruteo local de las consultas a los expertos; con menos confianza que INTENT_MIN_CONFIDENCE
+    # decide el LLM. Modelo en INTENT_MODEL_PATH (por defecto CACHE_DIR/intent_model.json) y
+    # registro de decisiones en CACHE_DIR/intent_decisions.jsonl
+    INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "False").lower() == "true"
+    INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.6"))
+    INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "")
+    INTENT_LOG = os.getenv("INTENT_LOG", "False").lower() == "true"
 
     # Configuraciones de ClickUp
     CLICKUP_LIST_ID = os.getenv("CLICKUP_LIST_ID")
 
+    # Recepción de menciones: webhook de ClickUp y sondeo de comentarios (intervalos en segundos).
+    # Con webhook, la vigilancia de CLICKUP_LIST_ID cada RECONCILE_INTERVAL recupera los eventos perdidos
+    WEBHOOK_ENABLED = os.getenv("WEBHOOK_ENABLED", "False").lower() == "true"
+    WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/clickup/webhook")
+    CLICKUP_WEBHOOK_SECRET = os.getenv("CLICKUP_WEBHOOK_SECRET")
+    POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "10"))
+    RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "300"))
+
+    # Vigilancia de todas las tareas de CLICKUP_LIST_ID con marcas de agua por tarea
+    WATCH_LIST = os.getenv("WATCH_LIST", "False").lower() == "true"
+    # Límite de peticiones por minuto de la cuenta y fracción reservada para el sondeo
+    CLICKUP_RATE_LIMIT = int(os.getenv("CLICKUP_RATE_LIMIT", "100"))
+    WATCHER_RATE_SHARE = float(os.getenv("WATCHER_RATE_SHARE", "0.5"))
+    TASK_REFRESH_INTERVAL = float(os.getenv("TASK_REFRESH_INTERVAL", "300"))
+
+    # Registro persistente de menciones procesadas (en CACHE_DIR/mentions.json)
+    MENTION_MAX_ATTEMPTS = int(os.getenv("MENTION_MAX_ATTEMPTS", "3"))
+    MENTION_RETENTION_DAYS = float(os.getenv("MENTION_RETENTION_DAYS", "30"))
+    # Cola de menciones: hilos que responden en paralelo, menciones en espera y política
+    # cuando la cola está llena ("reject" la rechaza, "defer" la acepta y avisa en la tarea)
+    MENTION_WORKERS = int(os.getenv("MENTION_WORKERS", "1"))
+    MENTION_QUEUE_DEPTH = int(os.getenv("MENTION_QUEUE_DEPTH", "10"))
+    MENTION_QUEUE_POLICY = os.getenv("MENTION_QUEUE_POLICY", "reject").lower()
+
     @classmethod
     def validate(cls):
         """
@@ -37,6 +191,26 @@ class Settings:
         for setting in required_settings:
             if not getattr(cls, setting):
                 raise ValueError(f"La configuración {setting} es requerida y no está definida.")
+        
+        if cls.WEBHOOK_ENABLED and not cls.CLICKUP_WEBHOOK_SECRET:
+            raise ValueError("La configuración CLICKUP_WEBHOOK_SECRET es requerida cuando WEBHOOK_ENABLED está activo.")
+        
+        try:
+            json.loads(cls.MODEL_ROUTES)
+        except ValueError:
+            raise ValueError("MODEL_ROUTES debe ser un objeto JSON válido.")
+        
+        if cls.CASSETTE_MODE not in ("off", "record", "replay"):
+            raise ValueError("CASSETTE_MODE debe ser \"off\", \"record\" o \"replay\".")
+        
+        if cls.MENTION_QUEUE_POLICY not in ("reject", "defer"):
+            raise ValueError("MENTION_QUEUE_POLICY debe ser \"reject\" o \"defer\".")
+        
+        if cls.WATCH_LIST and not cls.CLICKUP_LIST_ID:
+            raise ValueError("La configuración CLICKUP_LIST_ID es requerida cuando WATCH_LIST está activo.")
+        
+        if cls.WEBHOOK_ENABLED and not cls.CLICKUP_LIST_ID:
+            raise ValueError("La configuración CLICKUP_LIST_ID es requerida cuando WEBHOOK_ENABLED está activo.")
 
 # Validar configuraciones al importar el módulo
 Settings.validate()
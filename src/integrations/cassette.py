@@ -0,0 +1,170 @@
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+RECORD = "record"
+REPLAY = "replay"
+# Encabezados de respuesta que se guardan (los que usan las integraciones y el transporte)
+KEPT_HEADERS = ("Content-Type", "Retry-After", "X-RateLimit-Reset")
+
+class CassetteMissError(requests.exceptions.RequestException):
+    """
+    La petición no está grabada en el cassette.
+    """
+
+def request_key(method: str, url: str, kwargs: Dict) -> str:
+    """
+    Hash de una petición: método, URL, parámetros y cuerpo. Los encabezados (con las
+    claves de API) no forman parte de la clave; de los archivos adjuntos solo cuenta el nombre.
+    """
+    files = kwargs.get("files") or {}
+    data = kwargs.get("data")
+    if isinstance(data, bytes):
+        data = hashlib.sha256(data).hexdigest()
+    canonical = json.dumps({
+        "method": method.upper(),
+        "url": url,
+        "params": kwargs.get("params"),
+        "json": kwargs.get("json"),
+        "data": data,
+        "files": sorted(f"{field}:{value[0] if isinstance(value, tuple) else ''}" for field, value in files.items())
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+class Cassette:
+    """
+    Grabación de peticiones HTTP y sus respuestas en JSON Lines comprimido con gzip,
+    indexada por el hash de cada petición. En modo "record" agrega cada respuesta al
+    archivo; en modo "replay" las sirve desde memoria, con las demoras originales si
+    timing es True. Las peticiones repetidas se sirven en el orden en que se grabaron.
+    """
+    def __init__(self, path: str, mode: str = REPLAY, timing: bool = False):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Modo de cassette desconocido: {mode}")
+        self.path = path
+        self.mode = mode
+        self.timing = timing
+        self.misses = 0
+        self._entries: Dict[str, List[Dict]] = {}
+        self._served: Dict[str, int] = {}
+        self._file = None
+        self._lock = threading.Lock()
+        if mode == REPLAY:
+            for entry in self.load(path):
+                self._entries.setdefault(entry["key"], []).append(entry)
+            print(f"Cassette {path}: {sum(len(e) for e in self._entries.values())} respuestas grabadas")
+        else:
+            atexit.register(self.close)
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    @staticmethod
+    def load(path: str) -> List[Dict]:
+        """
+        Lee las entradas de un cassette. Si la grabación se interrumpió, retorna las
+        entradas completas.
+        """
+        entries = []
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    entries.append(json.loads(line))
+            except (EOFError, ValueError):
+                pass
+        return entries
+
+    def record(self, method: str, url: str, kwargs: Dict, response: requests.Response, elapsed: float) -> None:
+        """
+        Agrega la respuesta de una petición al cassette. Las respuestas en streaming se
+        leen completas antes de entregarse.
+        """
+        body = response.content
+        entry = {
+            "key": request_key(method, url, kwargs),
+            "method": method.upper(),
+            "url": url,
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+            "elapsed": round(elapsed, 3),
+            "time": round(time.time(), 3)
+        }
+        try:
+            entry["body"] = body.decode("utf-8")
+        except UnicodeDecodeError:
+            entry["body_b64"] = base64.b64encode(body).decode("ascii")
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = gzip.open(self.path, "at", encoding="utf-8")
+            self._file.write(line + "\n")
+            # Cada respuesta queda legible aunque el proceso termine sin cerrar el archivo
+            self._file.flush()
+
+    def replay(self, method: str, url: str, kwargs: Dict) -> requests.Response:
+        """
+        Retorna la respuesta grabada para la petición. Lanza CassetteMissError si no está.
+        """
+        key = request_key(method, url, kwargs)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                raise CassetteMissError(f"Petición no grabada en el cassette: {method.upper()} {url}")
+            index = self._served.get(key, 0)
+            # Una vez agotadas las grabaciones se repite la última
+            entry = entries[min(index, len(entries) - 1)]
+            self._served[key] = index + 1
+
+        if self.timing:
+            time.sleep(entry["elapsed"])
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = entry.get("reason")
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = url
+        response._content = (entry["body"].encode("utf-8") if "body" in entry
+                             else base64.b64decode(entry["body_b64"]))
+        # El contenido ya está en memoria: iter_lines lo recorre igual que un streaming
+        response._content_consumed = True
+        return response
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+if __name__ == "__main__":
+    import sys
+
+    # Uso: python src/integrations/cassette.py <cassette.jsonl.gz>
+    if len(sys.argv) < 2:
+        print("Uso: python src/integrations/cassette.py <cassette.jsonl.gz>")
+        sys.exit(1)
+    hosts: Dict[str, Dict[str, float]] = {}
+    for entry in Cassette.load(sys.argv[1]):
+        stats = hosts.setdefault(urlsplit(entry["url"]).hostname, {"requests": 0, "errors": 0, "elapsed": 0.0})
+        stats["requests"] += 1
+        stats["errors"] += 1 if entry["status"] >= 400 else 0
+        stats["elapsed"] += entry["elapsed"]
+    for host, stats in hosts.items():
+        print(f"{host}: {stats['requests']} peticiones ({stats['errors']} con error), "
+              f"{stats['elapsed']:.1f}s en total, {stats['elapsed'] / stats['requests']:.2f}s promedio")
@@ -0,0 +1,146 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator
+
+import requests
+
+from integrations.rate_limit import waited_seconds
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """
+    La petición no se envió porque el circuito del proveedor está abierto.
+    """
+
+def is_upstream_failure(error: Exception) -> bool:
+    """
+    Indica si el error se debe al proveedor (caídas, timeouts, 429 y 5xx) y no a la petición.
+    """
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, (requests.exceptions.RequestException, ValueError))
+
+class CircuitBreaker:
+    """
+    Interruptor de circuito por proveedor. Se abre tras varias fallas consecutivas
+    (o llamadas más lentas que slow_call_threshold, sin contar las esperas del limitador
+    ni entre reintentos) y, mientras está abierto, rechaza las llamadas de inmediato.
+    Pasado reset_timeout deja pasar una llamada de prueba: si funciona se cierra y si
+    falla vuelve a abrirse.
+    """
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 30.0,
+                 slow_call_threshold: float = None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_threshold = slow_call_threshold
+        self.state = CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """
+        Indica si una llamada se enviaría ahora (circuito cerrado o listo para probar).
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return time.monotonic() - self._opened_at >= self.reset_timeout
+            return not self._probing
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Ejecuta func a través del circuito. Lanza CircuitOpenError si está abierto.
+        """
+        self._before_call()
+        start = time.monotonic()
+        waited = waited_seconds()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self._record_error(e)
+            raise
+        # Solo cuenta el tiempo de respuesta del proveedor
+        elapsed = time.monotonic() - start - (waited_seconds() - waited)
+        if self.slow_call_threshold is not None and elapsed > self.slow_call_threshold:
+            self._record_failure(f"llamada lenta ({elapsed:.1f}s)")
+        else:
+            self._record_success()
+        return result
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """
+        Como call, para operaciones que no caben en una función, como leer una respuesta
+        en streaming: el bloque cuenta como éxito solo si termina sin errores. No mide
+        llamadas lentas, porque el bloque incluye el tiempo de quien consume la respuesta.
+        """
+        self._before_call()
+        try:
+            yield
+        except Exception as e:
+            self._record_error(e)
+            raise
+        except BaseException:
+            # Por ejemplo, un generador cerrado antes de terminar: no dice nada del proveedor
+            self._release_probe()
+            raise
+        self._record_success()
+
+    def _record_error(self, error: Exception) -> None:
+        if is_upstream_failure(error):
+            self._record_failure(f"{type(error).__name__}: {str(error)[:100]}")
+        elif isinstance(error, requests.exceptions.HTTPError):
+            # El proveedor respondió: el error es de la petición
+            self._record_success()
+        else:
+            # Por ejemplo, plazo de la mención agotado: no dice nada del proveedor
+            self._release_probe()
+
+    def _before_call(self) -> None:
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == OPEN or (self.state == HALF_OPEN and self._probing):
+                self.rejected += 1
+                raise CircuitOpenError(f"Circuito de {self.name} abierto")
+            if self.state == HALF_OPEN:
+                self._probing = True
+
+    def _record_failure(self, reason: str) -> None:
+        with self._lock:
+            self.failures += 1
+            self._consecutive += 1
+            self._probing = False
+            if self.state == HALF_OPEN or self._consecutive >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"Circuito de {self.name} abierto por {self.reset_timeout:.0f}s ({reason})")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def _release_probe(self) -> None:
+        with self._lock:
+            self._probing = False
+
+    def _record_success(self) -> None:
+        with self._lock:
+            self._consecutive = 0
+            self._probing = False
+            if self.state != CLOSED:
+                print(f"Circuito de {self.name} cerrado: el proveedor responde nuevamente")
+            self.state = CLOSED
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
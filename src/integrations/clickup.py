@@ -1,17 +1,33 @@
 import requests
 from typing import Dict, List
 from config.settings import Settings
+from integrations.circuit_breaker import CircuitBreaker
+from integrations.transport import HTTPTransport, get_default_transport
 
 class ClickUpIntegration:
-    def __init__(self, workspace_id: str):
+    def __init__(self, workspace_id: str, transport: HTTPTransport = None, breaker: CircuitBreaker = None,
+                 base_url: str = "https://api.clickup.com/api/v2"):
         self.workspace_id = workspace_id
-        self.base_url = "https://api.clickup.com/api/v2"
+        self.transport = transport or get_default_transport()
+        self.breaker = breaker or CircuitBreaker("ClickUp", slow_call_threshold=10.0)
+        self.base_url = base_url
         self.headers = {
             "Authorization": Settings.CLICKUP_API_KEY,
             "Content-Type": "application/json"
         }
         print("ClickUp Integration inicializada con Workspace ID:", workspace_id)
         
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Envía una petición a ClickUp a través del circuito; los 429 y 5xx cuentan como fallas.
+        """
+        def send():
+            response = self.transport.request(method, url, **kwargs)
+            if response.status_code == 429 or response.status_code >= 500:
+                response.raise_for_status()
+            return response
+        return self.breaker.call(send)
+
     def test_connection(self):
         """
         Prueba la conexión con ClickUp y verifica los permisos.
@@ -23,7 +39,7 @@ class ClickUpIntegration:
             print(f"URL: {url}")
             print(f"Headers: {self.headers}")
             
-            response = requests.get(url, headers=self.headers)
+            response = self._send("GET", url, headers=self.headers)
             if response.status_code == 200:
                 print("\nConexión exitosa con ClickUp")
                 teams = response.json().get("teams", [])
@@ -45,7 +61,7 @@ class ClickUpIntegration:
         try:
             url = f"{self.base_url}/team/{team_id}/space"
             print(f"\nObteniendo espacios del equipo {team_id}...")
-            response = requests.get(url, headers=self.headers)
+            response = self._send("GET", url, headers=self.headers)
             
             if response.status_code == 200:
                 spaces = response.json().get("spaces", [])
@@ -67,7 +83,7 @@ class ClickUpIntegration:
         try:
             url = f"{self.base_url}/space/{space_id}/list"
             print(f"\nObteniendo listas del espacio {space_id}...")
-            response = requests.get(url, headers=self.headers)
+            response = self._send("GET", url, headers=self.headers)
             
             if response.status_code == 200:
                 lists = response.json().get("lists", [])
@@ -80,15 +96,17 @@ class ClickUpIntegration:
         except Exception as e:
             print(f"Error al obtener listas: {str(e)}")
 
-    def get_tasks(self, list_id: str) -> List[Dict]:
+    def get_tasks(self, list_id: str, page: int = None) -> List[Dict]:
         """
         Obtiene las tareas de una lista específica en ClickUp.
+        Con page se obtiene esa página de resultados (100 tareas por página).
         """
         try:
             url = f"{self.base_url}/list/{list_id}/task"
+            params = {"page": page} if page is not None else None
             print(f"\nObteniendo tareas de la lista {list_id}...")
             print(f"URL: {url}")
-            response = requests.get(url, headers=self.headers)
+            response = self._send("GET", url, headers=self.headers, params=params)
             
             if response.status_code != 200:
                 print(f"Error en la respuesta: Status Code {response.status_code}")
@@ -112,7 +130,7 @@ class ClickUpIntegration:
         """
         try:
             url = f"{self.base_url}/list/{list_id}/task"
-            response = requests.post(url, headers=self.headers, json=task_data)
+            response = self._send("POST", url, headers=self.headers, json=task_data)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -127,7 +145,7 @@ class ClickUpIntegration:
         """
         try:
             url = f"{self.base_url}/task/{task_id}"
-            response = requests.put(url, headers=self.headers, json=task_data)
+            response = self._send("PUT", url, headers=self.headers, json=task_data)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -136,14 +154,16 @@ class ClickUpIntegration:
                 print(f"Respuesta detallada: {e.response.text}")
             raise
 
-    def get_comments(self, task_id: str) -> List[Dict]:
+    def get_comments(self, task_id: str, start: int = None, start_id: str = None) -> List[Dict]:
         """
-        Obtiene los comentarios de una tarea específica en ClickUp.
+        Obtiene los comentarios de una tarea específica en ClickUp (los 25 más recientes).
+        Con start (fecha en milisegundos) y start_id se obtiene la página anterior a ese comentario.
         """
         try:
             url = f"{self.base_url}/task/{task_id}/comment"
+            params = {"start": start, "start_id": start_id} if start_id is not None else None
             print(f"\nObteniendo comentarios de la tarea {task_id}...")
-            response = requests.get(url, headers=self.headers)
+            response = self._send("GET", url, headers=self.headers, params=params)
             
             if response.status_code != 200:
                 print(f"Error en la respuesta: Status Code {response.status_code}")
@@ -173,10 +193,11 @@ class ClickUpIntegration:
             
             with open(file_path, 'rb') as file:
                 files = {
-                    'attachment': (file_path.split('/')[-1], file, 'text/markdown')
+                    # Contenido en memoria para poder reenviarlo si la petición se reintenta
+                    'attachment': (file_path.split('/')[-1], file.read(), 'text/markdown')
                 }
                 print(f"\nSubiendo archivo {file_path} a la tarea {task_id}...")
-                response = requests.post(url, headers=headers, files=files)
+                response = self._send("POST", url, headers=headers, files=files)
                 response.raise_for_status()
                 return response.json()
                 
@@ -194,7 +215,7 @@ class ClickUpIntegration:
             url = f"{self.base_url}/task/{task_id}/comment"
             comment_data = {"comment_text": comment_text}
             print(f"\nCreando comentario en la tarea {task_id}...")
-            response = requests.post(url, headers=self.headers, json=comment_data)
+            response = self._send("POST", url, headers=self.headers, json=comment_data)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -202,3 +223,36 @@ class ClickUpIntegration:
             if hasattr(e, 'response') and e.response is not None:
                 print(f"Respuesta detallada: {e.response.text}")
             raise
+
+    def update_comment(self, comment_id: str, comment_text: str) -> Dict:
+        """
+        Reemplaza el texto de un comentario existente.
+        """
+        try:
+            url = f"{self.base_url}/comment/{comment_id}"
+            response = self._send("PUT", url, headers=self.headers, json={"comment_text": comment_text})
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error al actualizar comentario: {str(e)}")
+            if hasattr(e, 'response') and e.response is not None:
+                print(f"Respuesta detallada: {e.response.text}")
+            raise
+
+    def create_webhook(self, team_id: str, endpoint: str, events: List[str] = None) -> Dict:
+        """
+        Registra un webhook en el workspace de ClickUp. La respuesta incluye el secreto
+        con el que ClickUp firmará los eventos (CLICKUP_WEBHOOK_SECRET).
+        """
+        try:
+            url = f"{self.base_url}/team/{team_id}/webhook"
+            webhook_data = {"endpoint": endpoint, "events": events or ["taskCommentPosted"]}
+            print(f"\nRegistrando webhook {endpoint} en el equipo {team_id}...")
+            response = self._send("POST", url, headers=self.headers, json=webhook_data)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error al registrar webhook: {str(e)}")
+            if hasattr(e, 'response') and e.response is not None:
+                print(f"Respuesta detallada: {e.response.text}")
+            raise
@@ -0,0 +1,78 @@
+import time
+from typing import Optional
+
+from integrations.clickup import ClickUpIntegration
+
+# Marca que indica en ClickUp que la respuesta todavía se está escribiendo
+WRITING_MARK = " ▌"
+
+class ProgressiveReply:
+    """
+    Respuesta de ClickUp que se publica de inmediato como marcador y se va
+    completando a medida que llega el texto, con una actualización cada interval
+    segundos como máximo para no agotar el límite de peticiones de ClickUp.
+    """
+    def __init__(self, clickup: ClickUpIntegration, task_id: str, interval: float = 2.0,
+                 placeholder: str = "⏳ Analizando la consulta con el equipo de expertos..."):
+        self.clickup = clickup
+        self.task_id = task_id
+        self.interval = interval
+        self.placeholder = placeholder
+        self.comment_id: Optional[str] = None
+        self.updates = 0
+        self._last_update = 0.0
+        self._last_text = ""
+
+    def start(self) -> Optional[str]:
+        """
+        Publica el marcador. Retorna el id del comentario, o None si no se pudo publicar
+        (en ese caso la respuesta completa se publicará al final).
+        """
+        try:
+            comment = self.clickup.create_comment(self.task_id, self.placeholder)
+        except Exception as e:
+            print(f"No se pudo publicar el marcador de la respuesta: {str(e)}")
+            return None
+        if comment.get("id"):
+            self.comment_id = str(comment["id"])
+            self._last_update = time.monotonic()
+        return self.comment_id
+
+    def update(self, text: str) -> None:
+        """
+        Actualiza el comentario con el texto acumulado si pasó el intervalo mínimo.
+        Los errores se ignoran: la respuesta completa se publica en finish().
+        """
+        if self.comment_id is None or text == self._last_text:
+            return
+        if time.monotonic() - self._last_update < self.interval:
+            return
+        try:
+            self.clickup.update_comment(self.comment_id, text + WRITING_MARK)
+            self.updates += 1
+            self._last_text = text
+        except Exception as e:
+            print(f"No se pudo actualizar la respuesta parcial: {str(e)}")
+        self._last_update = time.monotonic()
+
+    def finish(self, text: str) -> Optional[str]:
+        """
+        Publica el texto final, reemplazando el marcador. Retorna el id del comentario.
+        """
+        if self.comment_id is None:
+            comment = self.clickup.create_comment(self.task_id, text)
+            return str(comment["id"]) if comment.get("id") else None
+        self.clickup.update_comment(self.comment_id, text)
+        return self.comment_id
+
+    def fail(self) -> None:
+        """
+        Indica en el comentario que la respuesta no se pudo completar.
+        """
+        if self.comment_id is None:
+            return
+        try:
+            self.clickup.update_comment(self.comment_id, "⚠️ No se pudo completar la respuesta. "
+                                                         "Se volverá a intentar en unos minutos.")
+        except Exception as e:
+            print(f"No se pudo marcar la respuesta como fallida: {str(e)}")
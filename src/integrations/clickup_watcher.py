@@ -0,0 +1,187 @@
+import heapq
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from integrations.clickup import ClickUpIntegration
+
+# Tamaño de página de los comentarios en la API de ClickUp
+COMMENTS_PAGE_SIZE = 25
+# Tamaño de página de las tareas en la API de ClickUp
+TASKS_PAGE_SIZE = 100
+# Resultado de on_comment para un comentario que no pudo aceptarse y debe volver a entregarse
+REJECTED = "rejected"
+
+def comment_date(comment: Dict) -> int:
+    """
+    Retorna la fecha de un comentario en milisegundos.
+    """
+    return int(comment.get("date") or comment.get("date_created") or 0)
+
+class CommentCursorStore:
+    """
+    Marca de agua por tarea (id y fecha del último comentario visto), persistida en JSON.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cursors: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._cursors = json.load(f)
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._cursors.get(task_id)
+
+    def set(self, task_id: str, comment: Dict) -> None:
+        """
+        Avanza la marca de agua de la tarea y la guarda en disco de forma atómica.
+        """
+        with self._lock:
+            self._cursors[task_id] = {"id": comment.get("id"), "date": comment_date(comment)}
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._cursors, f)
+            os.replace(tmp_path, self.path)
+
+class ClickUpListWatcher:
+    """
+    Vigila los comentarios de todas las tareas de una lista de ClickUp. Cada tarea se
+    consulta desde su marca de agua, y las consultas se reparten en el tiempo para no
+    superar la fracción asignada del límite de peticiones de la cuenta. Si on_comment
+    retorna REJECTED, la marca de agua no avanza y el comentario se vuelve a entregar
+    en la próxima consulta de la tarea.
+    """
+    def __init__(self, clickup: ClickUpIntegration, list_id: str, on_comment: Callable[[str, Dict], bool],
+                 cursor_path: str, requests_per_minute: int = 100, rate_share: float = 0.5,
+                 min_interval: float = 10, task_refresh_interval: float = 300, max_pages: int = 10):
+        self.clickup = clickup
+        self.list_id = list_id
+        self.on_comment = on_comment
+        self.cursors = CommentCursorStore(cursor_path)
+        # Separación mínima entre peticiones para usar solo rate_share del límite
+        self.request_spacing = 60.0 / max(requests_per_minute * rate_share, 1e-6)
+        self.min_interval = min_interval
+        self.task_refresh_interval = task_refresh_interval
+        self.max_pages = max_pages
+        self.task_ids: List[str] = []
+        self._schedule: List[tuple] = []
+        self._last_request = 0.0
+        self._last_refresh = None
+
+    def _throttle(self) -> None:
+        wait = self._last_request + self.request_spacing - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_request = time.monotonic()
+
+    def refresh_tasks(self) -> None:
+        """
+        Actualiza las tareas de la lista y agenda las nuevas. Si no se obtiene ninguna
+        tarea (get_tasks retorna una lista vacía también ante un error), se conserva la
+        lista anterior hasta la próxima actualización.
+        """
+        task_ids = []
+        page = 0
+        while True:
+            self._throttle()
+            tasks = self.clickup.get_tasks(self.list_id, page=page)
+            task_ids.extend(task["id"] for task in tasks if task.get("id"))
+            if len(tasks) < TASKS_PAGE_SIZE:
+                break
+            page += 1
+
+        now = time.monotonic()
+        if not task_ids and self.task_ids:
+            print(f"No se obtuvieron tareas de la lista {self.list_id}; se mantienen las {len(self.task_ids)} anteriores")
+            self._last_refresh = now
+            return
+
+        scheduled = {task_id for _, task_id in self._schedule}
+        for task_id in task_ids:
+            if task_id not in scheduled:
+                heapq.heappush(self._schedule, (now, task_id))
+        # Las tareas que ya no están en la lista se descartan al salir de la agenda
+        self.task_ids = task_ids
+        self._last_refresh = now
+
+    def new_comments(self, task_id: str) -> List[Dict]:
+        """
+        Retorna los comentarios posteriores a la marca de agua de la tarea, del más antiguo
+        al más reciente. La primera vez que se ve una tarea solo se fija la marca en su
+        último comentario, sin procesar el historial; si la tarea aún no tiene comentarios,
+        la marca es la hora de esa consulta y se entregan todos los que lleguen después.
+        """
+        cursor = self.cursors.get(task_id)
+        new = []
+        start = start_id = None
+        for _ in range(self.max_pages):
+            self._throttle()
+            first_seen = int(time.time() * 1000)
+            page = self.clickup.get_comments(task_id, start=start, start_id=start_id)
+            if not page:
+                if cursor is None:
+                    self.cursors.set(task_id, {"id": None, "date": first_seen})
+                break
+            page = sorted(page, key=comment_date, reverse=True)
+            if cursor is None:
+                self.cursors.set(task_id, page[0])
+                return []
+
+            reached = False
+            for comment in page:
+                if (cursor["id"] is not None and comment.get("id") == cursor["id"]) \
+                        or comment_date(comment) < cursor["date"]:
+                    reached = True
+                    break
+                if all(comment.get("id") != seen.get("id") for seen in new):
+                    new.append(comment)
+            if reached or len(page) < COMMENTS_PAGE_SIZE:
+                break
+            start, start_id = comment_date(page[-1]), page[-1].get("id")
+        return list(reversed(new))
+
+    def poll_next(self) -> None:
+        """
+        Consulta la próxima tarea agendada y entrega sus comentarios nuevos a on_comment.
+        """
+        if self._last_refresh is None or time.monotonic() - self._last_refresh >= self.task_refresh_interval:
+            self.refresh_tasks()
+        if not self._schedule:
+            time.sleep(self.min_interval)
+            return
+
+        due, task_id = heapq.heappop(self._schedule)
+        if task_id not in self.task_ids:
+            return
+        if due > time.monotonic():
+            time.sleep(due - time.monotonic())
+
+        try:
+            for comment in self.new_comments(task_id):
+                if self.on_comment(task_id, comment) == REJECTED:
+                    break
+                self.cursors.set(task_id, comment)
+        finally:
+            # Cada tarea vuelve a consultarse tras un ciclo completo por todas las tareas
+            cycle = max(self.min_interval, len(self.task_ids) * self.request_spacing)
+            heapq.heappush(self._schedule, (time.monotonic() + cycle, task_id))
+
+    def run_forever(self) -> None:
+        """
+        Vigila la lista indefinidamente.
+        """
+        print(f"\nVigilando los comentarios de la lista {self.list_id}...")
+        while True:
+            try:
+                self.poll_next()
+            except Exception as e:
+                print(f"\nError al vigilar la lista: {str(e)}")
+                print(f"Esperando {self.min_interval} segundos antes de reintentar...")
+                time.sleep(self.min_interval)
@@ -0,0 +1,132 @@
+import hashlib
+import hmac
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+from urllib.request import Request, urlopen
+
+def sign_payload(secret: str, body: bytes) -> str:
+    """
+    Calcula la firma que ClickUp envía en el encabezado X-Signature (HMAC-SHA256 en hexadecimal).
+    """
+    return hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+def verify_signature(secret: str, body: bytes, signature: str) -> bool:
+    """
+    Verifica la firma de un evento recibido.
+    """
+    if not secret or not signature:
+        return False
+    return hmac.compare_digest(sign_payload(secret, body), signature)
+
+def parse_comment_event(payload: Dict) -> List[Tuple[str, Dict]]:
+    """
+    Extrae los comentarios de un evento taskCommentPosted como pares (task_id, comentario),
+    con el comentario en el mismo formato que retorna ClickUpIntegration.get_comments.
+    """
+    if payload.get("event") != "taskCommentPosted":
+        return []
+
+    comments = []
+    for item in payload.get("history_items", []):
+        comment = item.get("comment") or {}
+        if not comment.get("id"):
+            continue
+        comments.append((payload.get("task_id"), {
+            "id": comment.get("id"),
+            "comment_text": comment.get("text_content", ""),
+            "date_created": comment.get("date", item.get("date", 0)),
+            "user": item.get("user", {})
+        }))
+    return comments
+
+class ClickUpWebhookServer:
+    """
+    Servidor HTTP que recibe los eventos de ClickUp, verifica su firma y entrega
+    cada comentario nuevo a on_comment(task_id, comentario) en un hilo aparte.
+    """
+    def __init__(self, secret: str, on_comment: Callable[[str, Dict], None],
+                 host: str = "0.0.0.0", port: int = 8080, path: str = "/clickup/webhook"):
+        self.secret = secret
+        self.on_comment = on_comment
+        self.path = path
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not verify_signature(server.secret, body, self.headers.get("X-Signature", "")):
+                    print("Evento de ClickUp rechazado: firma inválida")
+                    self.send_response(401)
+                    self.end_headers()
+                    return
+
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+
+                # Responder de inmediato; el procesamiento de la mención puede tardar
+                self.send_response(200)
+                self.end_headers()
+                for task_id, comment in parse_comment_event(payload):
+                    threading.Thread(target=server.on_comment, args=(task_id, comment), daemon=True).start()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> None:
+        """
+        Inicia el servidor en un hilo en segundo plano.
+        """
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        print(f"Webhook de ClickUp escuchando en el puerto {self.port}{self.path}")
+
+    def stop(self) -> None:
+        """
+        Detiene el servidor.
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def post_recorded_payload(url: str, payload_path: str, secret: str) -> int:
+    """
+    Envía un evento grabado (archivo JSON) al servidor, firmado como lo haría ClickUp.
+    Útil para probar el webhook localmente.
+    """
+    with open(payload_path, "rb") as f:
+        body = f.read()
+    request = Request(url, data=body, method="POST", headers={
+        "Content-Type": "application/json",
+        "X-Signature": sign_payload(secret, body)
+    })
+    with urlopen(request) as response:
+        return response.status
+
+if __name__ == "__main__":
+    # Uso: python src/integrations/clickup_webhook.py <evento.json> <secreto> [url]
+    if len(sys.argv) < 3:
+        print("Uso: python src/integrations/clickup_webhook.py <evento.json> <secreto> [url]")
+        sys.exit(1)
+    target = sys.argv[3] if len(sys.argv) > 3 else "http://localhost:8080/clickup/webhook"
+    print(f"Respuesta del webhook: {post_recorded_payload(target, sys.argv[1], sys.argv[2])}")
@@ -1,26 +1,288 @@
-import requests
-from typing import Dict, List
+import json
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional
+from integrations.circuit_breaker import CircuitBreaker
+from integrations.llm_cache import LLMResponseCache
+from integrations.transport import HTTPTransport, get_default_transport
+from utils.deadline import submit_in_context
+from utils.usage import UsageLog, current_usage
+
+# Latencias recientes que se conservan por modelo para estimar el percentil 95
+LATENCY_SAMPLES = 200
+# Muestras mínimas antes de usar el percentil 95 en lugar de la espera por defecto
+MIN_HEDGE_SAMPLES = 20
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """
+    Percentil por rango más cercano: el menor valor que alcanza o supera la fracción
+    indicada de las muestras.
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(max(math.ceil(fraction * len(ordered)) - 1, 0), len(ordered) - 1)]
 
 class OpenRouterLLM:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, transport: HTTPTransport = None, cache: LLMResponseCache = None,
+                 breaker: CircuitBreaker = None, hedge: bool = False, hedge_model: str = None,
+                 hedge_min_delay: float = 2.0, hedge_default_delay: float = 20.0,
+                 routes: Dict[str, Dict] = None, usage_log: UsageLog = None,
+                 base_url: str = "https://openrouter.ai/api/v1"):
         self.api_key = api_key
-        self.base_url = "https://openrouter.ai/api/v1"
+        # Tabla de ruteo: paso del flujo -> {"model", "max_tokens", "temperature"}
+        self.routes = routes or {"default": {"model": DEFAULT_MODEL}}
+        self.transport = transport or get_default_transport()
+        self.cache = cache
+        # Registro persistente de cada llamada (tokens, costo, latencia, modelo y paso)
+        self.usage_log = usage_log
+        self.breaker = breaker or CircuitBreaker("OpenRouter", slow_call_threshold=90.0)
+        # Peticiones de respaldo: si una completion tarda más que el p95 de su modelo, se envía
+        # una segunda (a hedge_model si se indica) y se usa la primera que responda
+        self.hedge_model = hedge_model
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self._hedge_executor = ThreadPoolExecutor(max_workers=16) if hedge else None
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._latencies: Dict[str, deque] = {}
+        self._usage: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self.base_url = base_url
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
 
-    def generate_text(self, prompt: str, model: str = "gpt-3.5-turbo") -> str:
+    def route(self, step: Optional[str]) -> Dict:
+        """
+        Retorna la configuración de un paso ("agente.tipo", por ejemplo "legal.thought").
+        Se combinan, de menor a mayor prioridad, las entradas "default", del agente
+        ("legal"), del tipo de paso ("thought") y del paso exacto ("legal.thought").
+        """
+        names = ["default"]
+        if step:
+            owner, _, kind = step.partition(".")
+            names += [owner, kind, step] if kind else [owner]
+        route = {}
+        for name in names:
+            route.update(self.routes.get(name, {}))
+        return route
+
+    def generate_text(self, prompt: str, model: Optional[str] = None,
+                      cache_ttl: Optional[float] = None, use_cache: bool = True, step: Optional[str] = None,
+                      max_tokens: Optional[int] = None, temperature: Optional[float] = None) -> str:
         """
         Genera texto utilizando el modelo especificado de OpenRouter.
+        Sin modelo explícito, el modelo, max_tokens y temperature salen de la tabla de
+        ruteo para el paso indicado. Si hay caché configurada, cache_ttl fija la
+        expiración para esta llamada y use_cache=False la omite.
         """
         url = f"{self.base_url}/chat/completions"
+        data = self._request_data(prompt, model, step, max_tokens, temperature)
+        
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = self.cache.make_key(data)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self._log_call(data["model"], step, 0.0, {}, cached=True)
+                return cached
+        
+        if self._hedge_executor is None:
+            content = self._attempt(url, data, step)
+        else:
+            content = self._hedged(url, data, step)
+        
+        if cache_key is not None:
+            self.cache.set(cache_key, content, ttl=cache_ttl)
+        return content
+
+    def _request_data(self, prompt: str, model: Optional[str], step: Optional[str],
+                      max_tokens: Optional[int], temperature: Optional[float]) -> Dict:
+        route = self.route(step)
         data = {
-            "model": model,
+            "model": model or route.get("model") or DEFAULT_MODEL,
             "messages": [{"role": "user", "content": prompt}]
         }
-        response = requests.post(url, headers=self.headers, json=data)
-        return response.json()["choices"][0]["message"]["content"]
+        max_tokens = route.get("max_tokens") if max_tokens is None else max_tokens
+        temperature = route.get("temperature") if temperature is None else temperature
+        if max_tokens is not None:
+            data["max_tokens"] = max_tokens
+        if temperature is not None:
+            data["temperature"] = temperature
+        return data
+
+    def stream_text(self, prompt: str, model: Optional[str] = None, cache_ttl: Optional[float] = None,
+                    use_cache: bool = True, step: Optional[str] = None, max_tokens: Optional[int] = None,
+                    temperature: Optional[float] = None) -> Iterator[str]:
+        """
+        Igual que generate_text, pero retorna los fragmentos de texto a medida que
+        OpenRouter los genera (eventos SSE). Una respuesta en caché se entrega completa.
+        Las fallas al leer la respuesta también cuentan para el circuito.
+        """
+        url = f"{self.base_url}/chat/completions"
+        data = self._request_data(prompt, model, step, max_tokens, temperature)
+        
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = self.cache.make_key(data)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self._log_call(data["model"], step, 0.0, {}, cached=True)
+                yield cached
+                return
+        
+        start = time.monotonic()
+        parts = []
+        usage = {}
+        with self.breaker.guard():
+            response = self._open_stream(url, data)
+            try:
+                for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                    # Las líneas que empiezan con ":" son comentarios SSE (keep-alive de OpenRouter)
+                    if not line or not line.startswith("data:"):
+                        continue
+                    event = line[len("data:"):].strip()
+                    if event == "[DONE]":
+                        break
+                    chunk = json.loads(event)
+                    if chunk.get("error"):
+                        # ValueError: respuesta inválida del proveedor, cuenta como falla para el circuito
+                        raise ValueError(f"Error de OpenRouter durante la respuesta: {chunk['error']}")
+                    usage = chunk.get("usage") or usage
+                    for choice in chunk.get("choices", []):
+                        text = (choice.get("delta") or {}).get("content")
+                        if text:
+                            parts.append(text)
+                            yield text
+            finally:
+                response.close()
+        
+        self._record(data["model"], step, time.monotonic() - start, usage)
+        if cache_key is not None:
+            self.cache.set(cache_key, "".join(parts), ttl=cache_ttl)
+
+    def _open_stream(self, url: str, data: Dict):
+        payload = dict(data, stream=True, usage={"include": True})
+        response = self.transport.post(url, headers=self.headers, json=payload, idempotent=True, stream=True)
+        response.raise_for_status()
+        # Los eventos SSE son siempre UTF-8, aunque Content-Type no indique el charset
+        response.encoding = "utf-8"
+        return response
+
+    def hedge_delay(self, model: str) -> float:
+        """
+        Espera antes de enviar la petición de respaldo: el p95 de las latencias recientes del modelo.
+        """
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, percentile(samples, 0.95))
+
+    def _hedged(self, url: str, data: Dict, step: Optional[str] = None) -> str:
+        """
+        Envía la petición y, si no responde dentro de hedge_delay, una de respaldo.
+        Retorna la primera respuesta exitosa; la otra petición termina en segundo plano.
+        """
+        primary = submit_in_context(self._hedge_executor, self._attempt, url, data, step)
+        done, _ = wait([primary], timeout=self.hedge_delay(data["model"]))
+        if done or not self.breaker.available:
+            return primary.result()
+        
+        hedge_data = dict(data, model=self.hedge_model or data["model"])
+        backup = submit_in_context(self._hedge_executor, self._attempt, url, hedge_data, step)
+        with self._lock:
+            self.hedges += 1
+        
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    content = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is backup:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return content
+        raise error
+
+    def _attempt(self, url: str, data: Dict, step: Optional[str] = None) -> str:
+        start = time.monotonic()
+        body = self.breaker.call(self._complete, url, data)
+        if not body.get("choices"):
+            raise RuntimeError(f"Respuesta de OpenRouter sin contenido: {body.get('error', body)}")
+        self._record(data["model"], step, time.monotonic() - start, body.get("usage") or {})
+        return body["choices"][0]["message"]["content"]
+
+    def _record(self, model: str, step: Optional[str], latency: float, usage: Dict) -> None:
+        self._log_call(model, step, latency, usage)
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=LATENCY_SAMPLES)).append(latency)
+            totals = self._usage.setdefault(model, {"calls": 0, "latency": 0.0, "prompt_tokens": 0,
+                                                    "completion_tokens": 0, "cost": 0.0})
+            totals["calls"] += 1
+            totals["latency"] += latency
+            totals["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            totals["completion_tokens"] += usage.get("completion_tokens", 0)
+            totals["cost"] += usage.get("cost") or 0.0
+
+    def _log_call(self, model: str, step: Optional[str], latency: float, usage: Dict, cached: bool = False) -> None:
+        """
+        Registra la llamada en el medidor de la mención en curso y en el registro diario.
+        """
+        meter = current_usage()
+        if meter is None and self.usage_log is None:
+            return
+        record = {
+            "day": time.strftime("%Y-%m-%d"),
+            "time": round(time.time(), 3),
+            "mention": meter.label if meter is not None else None,
+            "step": step,
+            "model": model,
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "cost": usage.get("cost") or 0.0,
+            "latency": round(latency, 3),
+            "cached": cached
+        }
+        if meter is not None:
+            meter.add(record)
+        if self.usage_log is not None:
+            try:
+                self.usage_log.append(record)
+            except OSError as e:
+                print(f"No se pudo registrar el consumo del LLM: {str(e)}")
+
+    def model_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Retorna, por modelo, llamadas, latencia media y p95 (segundos), tokens y costo (USD)
+        acumulados, para ajustar la tabla de ruteo.
+        """
+        with self._lock:
+            usage = {model: dict(totals) for model, totals in self._usage.items()}
+            latencies = {model: list(samples) for model, samples in self._latencies.items()}
+        for model, totals in usage.items():
+            totals["avg_latency"] = totals.pop("latency") / totals["calls"]
+            totals["p95_latency"] = percentile(latencies.get(model, []), 0.95)
+        return usage
+
+    def _complete(self, url: str, data: Dict) -> Dict:
+        # La generación no tiene efectos secundarios: se puede reintentar ante cualquier falla.
+        # "usage.include" pide a OpenRouter el costo de la llamada junto con los tokens
+        payload = dict(data, usage={"include": True})
+        response = self.transport.post(url, headers=self.headers, json=payload, idempotent=True)
+        response.raise_for_status()
+        return response.json()
 
     def analyze_sentiment(self, text: str) -> Dict:
         """
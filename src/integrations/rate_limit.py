@@ -0,0 +1,129 @@
+import email.utils
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+
+# Estados que indican saturación o fallas transitorias del proveedor
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Estados en los que el proveedor no procesó la petición (seguros de reintentar en un POST)
+UNPROCESSED_STATUSES = {429, 503}
+
+# Segundos que cada hilo ha pasado esperando al limitador o entre reintentos
+_waits = threading.local()
+
+def add_wait(seconds: float) -> None:
+    """
+    Suma al hilo actual una espera que no corresponde al proveedor.
+    """
+    _waits.total = waited_seconds() + seconds
+
+def waited_seconds() -> float:
+    """
+    Total de segundos de espera acumulados por el hilo actual.
+    """
+    return getattr(_waits, "total", 0.0)
+
+class TokenBucket:
+    """
+    Limitador de peticiones por cubeta de fichas, compartido entre hilos.
+    """
+    def __init__(self, rate: float, capacity: float = 1):
+        # rate: fichas (peticiones) que se reponen por segundo
+        # capacity: ráfaga máxima de peticiones seguidas
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Espera hasta obtener una ficha. Retorna los segundos esperados.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float) -> None:
+        """
+        Detiene la entrega de fichas durante los segundos indicados (por ejemplo, tras un 429).
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+def per_minute(limit: float, burst_seconds: float = 6) -> TokenBucket:
+    """
+    Crea un limitador para un límite publicado en peticiones por minuto, que permite
+    ráfagas equivalentes a burst_seconds de ese límite.
+    """
+    rate = limit / 60.0
+    return TokenBucket(rate, capacity=rate * burst_seconds)
+
+def retry_after_seconds(response: Optional[requests.Response]) -> Optional[float]:
+    """
+    Interpreta el encabezado Retry-After (segundos o fecha HTTP) o, en su defecto,
+    X-RateLimit-Reset (marca de tiempo en segundos) de ClickUp.
+    """
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            date = email.utils.parsedate_to_datetime(value)
+            if date is not None:
+                return max(date.timestamp() - time.time(), 0.0)
+    reset = response.headers.get("X-RateLimit-Reset")
+    if reset and response.status_code == 429:
+        try:
+            return max(float(reset) - time.time(), 0.0)
+        except ValueError:
+            return None
+    return None
+
+class RetryPolicy:
+    """
+    Reintentos con espera exponencial y jitter, respetando Retry-After.
+    """
+    def __init__(self, max_retries: int = 4, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, attempt: int, response: Optional[requests.Response], idempotent: bool) -> bool:
+        """
+        Indica si se reintenta tras el intento número attempt (desde 0). Sin response
+        se trata de un error de conexión o timeout.
+        """
+        if attempt >= self.max_retries:
+            return False
+        if response is None:
+            return idempotent
+        if response.status_code in UNPROCESSED_STATUSES:
+            return True
+        return idempotent and response.status_code in RETRY_STATUSES
+
+    def delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """
+        Segundos de espera antes del reintento: Retry-After si el proveedor lo indica,
+        o una espera exponencial con jitter completo. Ninguna espera supera max_delay.
+        """
+        retry_after = retry_after_seconds(response)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
@@ -0,0 +1,186 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from utils.text import normalize
+
+def normalize_query(query: str) -> str:
+    """
+    Normaliza una consulta: minúsculas, sin tildes y con espacios simples.
+    """
+    return normalize(query)
+
+class _InFlight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Optional[Dict] = None
+        self.error: Optional[Exception] = None
+
+class SearchCache:
+    """
+    Caché en memoria de respuestas de Serper con TTL por tipo de resultado.
+    Las búsquedas idénticas concurrentes comparten una única petición HTTP.
+    """
+    def __init__(self, ttls: Dict[str, float] = None, max_entries: int = 2000):
+        # TTL en segundos por tipo de resultado ("search" corresponde a resultados orgánicos)
+        self.ttls = ttls or {"search": 3600, "news": 900, "places": 86400, "images": 86400}
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.credits_saved = 0
+        self.stale_hits = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._in_flight: Dict[str, _InFlight] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(payload: Dict) -> str:
+        """
+        Genera la clave de caché a partir del payload con la consulta normalizada.
+        """
+        normalized = dict(payload)
+        normalized["q"] = normalize_query(payload.get("q", ""))
+        return json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+
+    @staticmethod
+    def credits_for(payload: Dict) -> int:
+        """
+        Estima los créditos de Serper que consume una consulta (2 si pide más de 10 resultados).
+        """
+        return 2 if payload.get("num", 10) > 10 else 1
+
+    def lookup(self, payload: Dict) -> Optional[Dict]:
+        """
+        Retorna la respuesta almacenada para el payload si no ha expirado.
+        """
+        key = self.make_key(payload)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.credits_saved += self.credits_for(payload)
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def stale(self, payload: Dict) -> Optional[Dict]:
+        """
+        Retorna la respuesta almacenada para el payload aunque haya expirado. Se usa
+        cuando Serper no está disponible.
+        """
+        with self._lock:
+            entry = self._entries.get(self.make_key(payload))
+            if entry is None:
+                return None
+            self.stale_hits += 1
+            return entry[0]
+
+    def store(self, payload: Dict, result: Dict) -> None:
+        """
+        Almacena la respuesta de un payload con el TTL de su tipo de resultado.
+        """
+        with self._lock:
+            self._store(self.make_key(payload), payload, result)
+
+    def _store(self, key: str, payload: Dict, result: Dict) -> None:
+        ttl = self.ttls.get(payload.get("type", "search"), self.ttls["search"])
+        self._entries[key] = (result, time.time() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def reserve(self, payload: Dict) -> Tuple[Optional[Dict], Optional[_InFlight], bool]:
+        """
+        Retorna (respuesta, en_curso, propia) para el payload: la respuesta almacenada si
+        no ha expirado o, si no, la petición en curso de la consulta e indica si quien
+        llama la registró y debe completarla con complete.
+        """
+        key = self.make_key(payload)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.credits_saved += self.credits_for(payload)
+                return entry[0], None, False
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                in_flight = _InFlight()
+                self._in_flight[key] = in_flight
+                self.misses += 1
+                return None, in_flight, True
+            self.coalesced += 1
+            self.credits_saved += self.credits_for(payload)
+            return None, in_flight, False
+
+    def complete(self, payload: Dict, in_flight: _InFlight, result: Dict = None, error: Exception = None) -> None:
+        """
+        Completa una petición registrada con reserve: almacena la respuesta (salvo que
+        haya fallado) y despierta a quienes la esperan.
+        """
+        in_flight.result, in_flight.error = result, error
+        key = self.make_key(payload)
+        with self._lock:
+            if error is None:
+                self._store(key, payload, result)
+            if self._in_flight.get(key) is in_flight:
+                del self._in_flight[key]
+        in_flight.event.set()
+
+    @staticmethod
+    def wait(in_flight: _InFlight) -> Dict:
+        """
+        Espera el resultado de una petición en curso registrada por otro hilo.
+        """
+        in_flight.event.wait()
+        if in_flight.error is not None:
+            raise in_flight.error
+        return in_flight.result
+
+    def get_or_fetch(self, payload: Dict, fetch: Callable[[], Dict]) -> Dict:
+        """
+        Retorna la respuesta almacenada para el payload o la obtiene con fetch.
+        Si la misma consulta ya está en curso, espera su resultado en lugar de repetirla.
+        """
+        cached, in_flight, owner = self.reserve(payload)
+        if cached is not None:
+            return cached
+        if not owner:
+            return self.wait(in_flight)
+
+        try:
+            result = fetch()
+        except Exception as e:
+            self.complete(payload, in_flight, error=e)
+            raise
+        self.complete(payload, in_flight, result)
+        return result
+
+    def clear(self) -> None:
+        """
+        Elimina todas las entradas de la caché.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Retorna aciertos, fallos, consultas compartidas, tasa de acierto y créditos ahorrados.
+        """
+        with self._lock:
+            served = self.hits + self.coalesced
+            lookups = served + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_ratio": served / lookups if lookups else 0.0,
+                "credits_saved": self.credits_saved,
+                "stale_hits": self.stale_hits,
+                "entries": len(self._entries)
+            }
@@ -1,23 +1,160 @@
-import requests
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+import contextvars
 import os
+import threading
 from dotenv import load_dotenv
+from integrations.circuit_breaker import CircuitBreaker
+from integrations.search_cache import SearchCache
+from integrations.snippet_index import SnippetIndex
+from integrations.transport import HTTPTransport, get_default_transport
+from utils.deadline import DeadlineExceeded, current_deadline
 
 # Cargar variables de entorno
 load_dotenv()
 
+_degraded: contextvars.ContextVar = contextvars.ContextVar("degraded_searches", default=None)
+
+def degraded_searches() -> Optional[List[str]]:
+    """
+    Retorna las consultas respondidas sin Serper en el bloque de degradation_scope en
+    curso, o None si no hay.
+    """
+    return _degraded.get()
+
+@contextmanager
+def degradation_scope() -> Iterator[List[str]]:
+    """
+    Registra las consultas que se respondan sin Serper en el código del bloque y en los
+    hilos lanzados con submit_in_context.
+    """
+    queries: List[str] = []
+    token = _degraded.set(queries)
+    try:
+        yield queries
+    finally:
+        _degraded.reset(token)
+
+def out_of_time(error: Exception) -> bool:
+    """
+    Indica si el error es el vencimiento del plazo de la mención en curso. Un plazo
+    vencido en otro hilo (una consulta compartida con otra mención) no cuenta.
+    """
+    deadline = current_deadline()
+    return isinstance(error, DeadlineExceeded) and deadline is not None and deadline.expired
+
 class SerperSearch:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, transport: HTTPTransport = None, cache: SearchCache = None,
+                 batch_limit: int = 100, breaker: CircuitBreaker = None, timeout: float = 10.0,
+                 base_url: str = "https://google.serper.dev/search", index: SnippetIndex = None):
         """
         Inicializa el wrapper de Serper.
         """
         self.api_key = api_key
-        self.base_url = "https://google.serper.dev/search"
+        self.transport = transport or get_default_transport()
+        self.cache = cache
+        # Índice local de fragmentos: se consulta antes que Serper y guarda cada resultado
+        self.index = index
+        self.breaker = breaker or CircuitBreaker("Serper", slow_call_threshold=5.0)
+        # Timeout de lectura propio: una búsqueda lenta no debe bloquear la respuesta
+        self.timeout = timeout
+        # Consultas respondidas sin Serper (resultados vencidos de la caché o sin resultados)
+        self.degraded = 0
+        self._lock = threading.Lock()
+        # Máximo de consultas por petición en lote que acepta Serper
+        self.batch_limit = batch_limit
+        self.base_url = base_url
         self.headers = {
             'X-API-KEY': self.api_key,
             'Content-Type': 'application/json'
         }
 
+    @property
+    def available(self) -> bool:
+        return self.breaker.available
+
+    def _request(self, payload):
+        """
+        Envía una consulta (o una lista de consultas en lote) a Serper y retorna la respuesta JSON.
+        """
+        return self.breaker.call(self._send, payload)
+
+    def _fetch(self, payload: Dict) -> Dict:
+        """
+        Responde un payload desde el índice local si lo cubre; si no, lo consulta a
+        Serper y agrega los resultados al índice.
+        """
+        local = self._index_lookup(payload)
+        if local is not None:
+            return local
+        result = self._request(payload)
+        self._index_add(payload, result)
+        return result
+
+    def _index_lookup(self, payload: Dict) -> Optional[Dict]:
+        """
+        Consulta el índice local. Un error del índice no es una falla de Serper: la
+        consulta simplemente se envía a Serper.
+        """
+        if self.index is None:
+            return None
+        try:
+            return self.index.lookup(payload)
+        except Exception as e:
+            print(f"Error al consultar el índice de fragmentos: {str(e)}")
+            return None
+
+    def _index_add(self, payload: Dict, result: Dict) -> None:
+        """
+        Agrega un resultado de Serper al índice local. Si el índice falla, el resultado
+        obtenido se conserva igualmente.
+        """
+        if self.index is None:
+            return
+        try:
+            self.index.add(payload, result)
+        except Exception as e:
+            print(f"Error al guardar en el índice de fragmentos: {str(e)}")
+
+    def _send(self, payload):
+        response = self.transport.post(self.base_url, headers=self.headers, json=payload, idempotent=True,
+                                       timeout=(self.transport.timeout[0], self.timeout))
+        response.raise_for_status()
+        return response.json()
+
+    def _fallback(self, payload: Dict) -> Dict:
+        """
+        Respuesta de reemplazo cuando Serper falla: el último resultado guardado aunque
+        haya expirado, o una respuesta vacía. La consulta queda registrada en el
+        degradation_scope en curso.
+        """
+        with self._lock:
+            self.degraded += 1
+        queries = _degraded.get()
+        if queries is not None:
+            queries.append(payload.get("q"))
+        stale = self.cache.stale(payload) if self.cache is not None else None
+        if stale is not None:
+            print(f"Serper no disponible: usando resultados guardados para '{payload.get('q')}'")
+            return stale
+        return {}
+
+    def _post(self, payload: Dict) -> Dict:
+        """
+        Obtiene la respuesta para un payload, pasando por la caché si está configurada.
+        Si Serper falla, retorna la respuesta de reemplazo; si se agotó el plazo de la
+        mención, propaga DeadlineExceeded.
+        """
+        try:
+            if self.cache is None:
+                return self._fetch(payload)
+            return self.cache.get_or_fetch(payload, lambda: self._fetch(payload))
+        except Exception as e:
+            if out_of_time(e):
+                raise
+            print(f"Error en la consulta a Serper: {str(e)}")
+            return self._fallback(payload)
+
     def search(self, query: str, num_results: int = 10) -> List[Dict]:
         """
         Realiza una búsqueda web utilizando Serper.
@@ -29,9 +166,7 @@ class SerperSearch:
         }
         
         try:
-            response = requests.post(self.base_url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            results = response.json()
+            results = self._post(payload)
             
             organic_results = results.get('organic', [])
             return [
@@ -42,6 +177,8 @@ class SerperSearch:
                 }
                 for r in organic_results[:num_results]
             ]
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"Error en búsqueda: {str(e)}")
             return []
@@ -58,9 +195,7 @@ class SerperSearch:
         }
         
         try:
-            response = requests.post(self.base_url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            results = response.json()
+            results = self._post(payload)
             
             news_results = results.get('news', [])
             return [
@@ -71,6 +206,8 @@ class SerperSearch:
                 }
                 for n in news_results[:num_results]
             ]
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"Error en búsqueda de noticias: {str(e)}")
             return []
@@ -88,9 +225,7 @@ class SerperSearch:
         }
         
         try:
-            response = requests.post(self.base_url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            results = response.json()
+            results = self._post(payload)
             
             local_results = results.get('places', [])
             return [
@@ -101,6 +236,8 @@ class SerperSearch:
                 }
                 for r in local_results[:num_results]
             ]
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"Error en búsqueda local: {str(e)}")
             return []
@@ -123,9 +260,7 @@ class SerperSearch:
         }
         
         try:
-            response = requests.post(self.base_url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            results = response.json()
+            results = self._post(payload)
             
             organic_results = results.get('organic', [])
             return [
@@ -138,6 +273,8 @@ class SerperSearch:
                 }
                 for r in organic_results[:5]
             ]
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"Error en búsqueda inmobiliaria: {str(e)}")
             return []
@@ -154,9 +291,7 @@ class SerperSearch:
         }
         
         try:
-            response = requests.post(self.base_url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            results = response.json()
+            results = self._post(payload)
             
             image_results = results.get('images', [])
             return [
@@ -167,6 +302,132 @@ class SerperSearch:
                 }
                 for img in image_results[:num_results]
             ]
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"Error en búsqueda de imágenes: {str(e)}")
             return []
+
+    def _batch_payload(self, query: str, result_type: str, num_results: int) -> Dict:
+        """
+        Construye el payload de una consulta del lote, igual al de los métodos individuales.
+        """
+        if result_type == "real_estate":
+            return {'q': f"mercado inmobiliario {query} precio actual", 'gl': 'cl', 'num': num_results}
+        payload = {'q': query, 'gl': 'cl', 'num': num_results}
+        if result_type != "search":
+            payload['type'] = result_type
+        return payload
+
+    def _batch_results(self, query: str, result_type: str, num_results: int, results: Dict) -> List[Dict]:
+        """
+        Extrae los resultados de una consulta del lote con el formato de los métodos individuales.
+        """
+        if result_type == "places":
+            return [
+                {
+                    "name": r.get("title", ""),
+                    "address": r.get("address", ""),
+                    "rating": r.get("rating", "N/A")
+                }
+                for r in results.get('places', [])[:num_results]
+            ]
+        
+        key = 'news' if result_type == "news" else 'organic'
+        formatted = []
+        for r in results.get(key, [])[:num_results]:
+            item = {
+                "title": r.get("title", ""),
+                "snippet": r.get("snippet", ""),
+                "link": r.get("link", "")
+            }
+            if result_type == "real_estate":
+                item["location"] = query
+                item["property_type"] = None
+            formatted.append(item)
+        return formatted
+
+    def batch(self, specs: List[Tuple[str, str, int]]) -> List[List[Dict]]:
+        """
+        Ejecuta varias consultas en una sola petición a Serper.
+        Cada spec es (consulta, tipo, número de resultados), con tipo "search", "news",
+        "real_estate" o "places". Retorna los resultados de cada spec en el mismo orden;
+        los lotes que superan batch_limit se dividen en varias peticiones.
+        Con caché, las consultas que ya están en curso en otro hilo no se repiten: se
+        espera su resultado. Las consultas sin respuesta en el lote usan el reemplazo.
+        """
+        payloads = [self._batch_payload(query, result_type, num) for query, result_type, num in specs]
+        responses: List[Dict] = [None] * len(payloads)
+        # Peticiones registradas en la caché por este lote, y las de otros hilos que se esperan
+        owned: Dict[int, object] = {}
+        waiting = []
+        
+        pending = []
+        try:
+            for i, payload in enumerate(payloads):
+                if self.cache is not None:
+                    cached, in_flight, owner = self.cache.reserve(payload)
+                    if cached is not None:
+                        responses[i] = cached
+                        continue
+                    if not owner:
+                        waiting.append((i, in_flight))
+                        continue
+                    owned[i] = in_flight
+                local = self._index_lookup(payload)
+                if local is not None:
+                    responses[i] = local
+                    self._complete(i, payloads, owned, local)
+                else:
+                    pending.append(i)
+            
+            for start in range(0, len(pending), self.batch_limit):
+                chunk = pending[start:start + self.batch_limit]
+                try:
+                    results = self._request([payloads[i] for i in chunk])
+                except Exception as e:
+                    if out_of_time(e):
+                        raise
+                    print(f"Error en búsqueda por lotes: {str(e)}")
+                    for i in chunk:
+                        self._complete(i, payloads, owned, error=e)
+                        responses[i] = self._fallback(payloads[i])
+                    continue
+                if not isinstance(results, list):
+                    results = []
+                for position, i in enumerate(chunk):
+                    result = results[position] if position < len(results) else None
+                    if not isinstance(result, dict):
+                        print(f"Serper no respondió la consulta '{payloads[i].get('q')}' del lote")
+                        self._complete(i, payloads, owned, error=ValueError("Consulta sin respuesta en el lote"))
+                        responses[i] = self._fallback(payloads[i])
+                        continue
+                    responses[i] = result
+                    self._complete(i, payloads, owned, result)
+                    self._index_add(payloads[i], result)
+        finally:
+            # Ninguna petición registrada queda sin completar, aunque el lote falle
+            for i in list(owned):
+                self._complete(i, payloads, owned, error=RuntimeError("Lote interrumpido"))
+        
+        for i, in_flight in waiting:
+            try:
+                responses[i] = self.cache.wait(in_flight)
+            except Exception as e:
+                if out_of_time(e):
+                    raise
+                responses[i] = self._fallback(payloads[i])
+        
+        return [
+            self._batch_results(query, result_type, num, responses[i] or {})
+            for i, (query, result_type, num) in enumerate(specs)
+        ]
+
+    def _complete(self, i: int, payloads: List[Dict], owned: Dict[int, object],
+                  result: Dict = None, error: Exception = None) -> None:
+        """
+        Completa en la caché la petición del lote registrada para el payload i, si la hay.
+        """
+        in_flight = owned.pop(i, None)
+        if in_flight is not None:
+            self.cache.complete(payloads[i], in_flight, result, error)
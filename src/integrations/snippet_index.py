@@ -0,0 +1,267 @@
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from utils.text import stem, tokenize
+
+# Tipos de resultado de Serper que se indexan y la clave de la respuesta donde vienen
+INDEXED_TYPES = {"search": "organic", "news": "news"}
+
+def index_terms(text: str) -> List[str]:
+    """
+    Términos con los que se indexa un texto: palabras sin tildes ni palabras vacías,
+    reducidas a su raíz aproximada.
+    """
+    return [stem(word) for word in tokenize(text)]
+
+class SnippetIndex:
+    """
+    Índice invertido persistente (SQLite) de los fragmentos obtenidos de Serper, con
+    puntaje BM25. Cada resultado orgánico o de noticias se agrega al índice al llegar;
+    antes de consultar a Serper se busca en el índice y, si hay suficientes fragmentos
+    recientes que cubren la consulta, se responde con ellos. Los fragmentos más antiguos
+    que el periodo de retención se eliminan al compactar.
+    """
+    def __init__(self, cache_dir: str = ".cache", min_coverage: float = 0.75,
+                 max_age: Dict[str, float] = None, retention: float = 30 * 24 * 3600,
+                 max_documents: int = 50000, compact_every: int = 500, k1: float = 1.2, b: float = 0.75):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "snippet_index.sqlite3")
+        # Fracción de los términos de la consulta que debe contener un fragmento para contar
+        self.min_coverage = min_coverage
+        # Antigüedad máxima (segundos) de un fragmento para responder sin Serper, por tipo
+        self.max_age = max_age or {"search": 7 * 24 * 3600, "news": 24 * 3600}
+        self.retention = retention
+        self.max_documents = max_documents
+        self.compact_every = compact_every
+        self.k1 = k1
+        self.b = b
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                key TEXT UNIQUE NOT NULL,
+                kind TEXT NOT NULL,
+                title TEXT NOT NULL,
+                snippet TEXT NOT NULL,
+                link TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_fetched ON documents (fetched_at);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc_id INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id);
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def kind_of(payload: Dict) -> Optional[str]:
+        """
+        Tipo de resultado del payload si se indexa ("search" o "news"); None en otro caso.
+        """
+        kind = payload.get("type", "search")
+        return kind if kind in INDEXED_TYPES else None
+
+    @staticmethod
+    def document_key(kind: str, item: Dict) -> str:
+        """
+        Identifica un fragmento por su tipo y su enlace (o su texto, si no tiene enlace).
+        """
+        identity = item.get("link") or item.get("snippet", "")
+        return hashlib.sha1(f"{kind}\n{identity}".encode("utf-8")).hexdigest()
+
+    def add(self, payload: Dict, result: Dict) -> int:
+        """
+        Agrega al índice los resultados de una respuesta de Serper. Un fragmento ya
+        indexado se reemplaza por la versión nueva. Retorna los fragmentos agregados.
+        """
+        kind = self.kind_of(payload)
+        if kind is None or not isinstance(result, dict):
+            return 0
+        now = time.time()
+        added = 0
+        with self._lock:
+            for item in result.get(INDEXED_TYPES[kind], []):
+                snippet = item.get("snippet") or ""
+                terms = Counter(index_terms(f"{item.get('title', '')} {snippet}"))
+                if not snippet or not terms:
+                    continue
+                key = self.document_key(kind, item)
+                self._delete("SELECT id FROM documents WHERE key = ?", (key,))
+                cursor = self._conn.execute(
+                    "INSERT INTO documents (key, kind, title, snippet, link, length, fetched_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, kind, item.get("title") or "", snippet, item.get("link") or "",
+                     sum(terms.values()), now)
+                )
+                self._conn.executemany("INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                                       [(term, cursor.lastrowid, tf) for term, tf in terms.items()])
+                added += 1
+            self._writes += 1
+            if self._writes % self.compact_every == 0:
+                self._expire()
+            self._conn.commit()
+        return added
+
+    def search(self, query: str, kind: str = "search", limit: int = 10,
+               max_age: float = None) -> List[Dict]:
+        """
+        Retorna los fragmentos del tipo indicado ordenados por puntaje BM25 para la
+        consulta, con su puntaje, la fracción de los términos de la consulta que
+        contienen (coverage) y su antigüedad en segundos. Con max_age solo se
+        consideran los fragmentos obtenidos en ese periodo.
+        """
+        terms = sorted(set(index_terms(query)))
+        if not terms:
+            return []
+        now = time.time()
+        cutoff = now - max_age if max_age is not None else 0
+        marks = ",".join("?" * len(terms))
+        with self._lock:
+            total, average = self._conn.execute(
+                "SELECT COUNT(*), AVG(length) FROM documents WHERE kind = ?", (kind,)
+            ).fetchone()
+            if not total:
+                return []
+            frequencies = dict(self._conn.execute(
+                f"SELECT p.term, COUNT(*) FROM postings p JOIN documents d ON d.id = p.doc_id "
+                f"WHERE p.term IN ({marks}) AND d.kind = ? GROUP BY p.term", (*terms, kind)
+            ).fetchall())
+            rows = self._conn.execute(
+                f"SELECT p.doc_id, p.term, p.tf, d.length FROM postings p JOIN documents d ON d.id = p.doc_id "
+                f"WHERE p.term IN ({marks}) AND d.kind = ? AND d.fetched_at >= ?", (*terms, kind, cutoff)
+            ).fetchall()
+
+            scores: Dict[int, float] = {}
+            matched: Counter = Counter()
+            for doc_id, term, tf, length in rows:
+                idf = math.log(1 + (total - frequencies[term] + 0.5) / (frequencies[term] + 0.5))
+                norm = tf + self.k1 * (1 - self.b + self.b * length / average)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+                matched[doc_id] += 1
+            best = sorted(scores, key=scores.get, reverse=True)[:limit]
+            if not best:
+                return []
+            documents = {row[0]: row[1:] for row in self._conn.execute(
+                f"SELECT id, title, snippet, link, fetched_at FROM documents "
+                f"WHERE id IN ({','.join('?' * len(best))})", best
+            ).fetchall()}
+
+        return [
+            {
+                "title": documents[doc_id][0],
+                "snippet": documents[doc_id][1],
+                "link": documents[doc_id][2],
+                "score": round(scores[doc_id], 4),
+                "coverage": matched[doc_id] / len(terms),
+                "age": now - documents[doc_id][3]
+            }
+            for doc_id in best
+        ]
+
+    def lookup(self, payload: Dict) -> Optional[Dict]:
+        """
+        Responde un payload de Serper desde el índice si hay tantos fragmentos recientes
+        como resultados pide y cada uno contiene al menos min_coverage de los términos
+        de la consulta. Retorna una respuesta con el formato de Serper o None.
+        """
+        kind = self.kind_of(payload)
+        if kind is None:
+            return None
+        num = int(payload.get("num", 10))
+        # Se revisan más candidatos que los pedidos: los mejores puntajes pueden no cubrir la consulta
+        candidates = self.search(payload.get("q", ""), kind, num * 3, self.max_age.get(kind))
+        results = [r for r in candidates if r["coverage"] >= self.min_coverage][:num]
+        with self._lock:
+            if len(results) < num:
+                self.misses += 1
+                return None
+            self.hits += 1
+        items = [{"title": r["title"], "snippet": r["snippet"], "link": r["link"]} for r in results]
+        return {"searchParameters": payload, INDEXED_TYPES[kind]: items}
+
+    def compact(self) -> int:
+        """
+        Elimina los fragmentos más antiguos que el periodo de retención y los más viejos
+        por sobre max_documents, y reduce el archivo. Retorna los fragmentos eliminados.
+        """
+        with self._lock:
+            removed = self._expire()
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+            return removed
+
+    def _expire(self) -> int:
+        removed = self._delete("SELECT id FROM documents WHERE fetched_at < ?",
+                               (time.time() - self.retention,))
+        excess = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0] - self.max_documents
+        if excess > 0:
+            removed += self._delete("SELECT id FROM documents ORDER BY fetched_at ASC LIMIT ?", (excess,))
+        return removed
+
+    def _delete(self, select: str, params: tuple) -> int:
+        """
+        Elimina los documentos que retorna la consulta select, con sus entradas del índice.
+        """
+        ids = [(row[0],) for row in self._conn.execute(select, params).fetchall()]
+        self._conn.executemany("DELETE FROM postings WHERE doc_id = ?", ids)
+        self._conn.executemany("DELETE FROM documents WHERE id = ?", ids)
+        return len(ids)
+
+    def clear(self) -> None:
+        """
+        Elimina todos los fragmentos del índice.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM documents")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Retorna las consultas respondidas desde el índice, las enviadas a Serper y el
+        tamaño del índice.
+        """
+        with self._lock:
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            terms = self._conn.execute("SELECT COUNT(DISTINCT term) FROM postings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "documents": documents,
+                "terms": terms
+            }
+
+if __name__ == "__main__":
+    import sys
+
+    # Uso: PYTHONPATH=src python -m integrations.snippet_index <CACHE_DIR> [compactar | consulta]
+    if len(sys.argv) < 2:
+        print("Uso: PYTHONPATH=src python -m integrations.snippet_index <CACHE_DIR> [compactar | consulta]")
+        sys.exit(1)
+    index = SnippetIndex(sys.argv[1])
+    argument = " ".join(sys.argv[2:])
+    if argument == "compactar":
+        print(f"{index.compact()} fragmentos eliminados")
+    elif argument:
+        for result in index.search(argument):
+            print(f"{result['score']:.2f} ({result['coverage']:.0%} de la consulta, "
+                  f"{result['age'] / 3600:.0f}h) {result['title']}\n    {result['snippet']}")
+    stats = index.stats()
+    print(f"{stats['documents']} fragmentos, {stats['terms']} términos")
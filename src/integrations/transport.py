@@ -0,0 +1,182 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config.settings import Settings
+from integrations.cassette import Cassette
+from integrations.rate_limit import RETRY_STATUSES, RetryPolicy, TokenBucket, add_wait, per_minute
+from utils.deadline import DeadlineExceeded, current_deadline
+
+# Métodos que se pueden reintentar ante cualquier falla transitoria
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+class HTTPTransport:
+    """
+    Transporte HTTP compartido por las integraciones.
+    Mantiene un pool de conexiones keep-alive por host, aplica timeouts por defecto,
+    limita las peticiones por host y reintenta las fallas transitorias.
+    """
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 10,
+                 connect_timeout: float = 5.0, read_timeout: float = 120.0,
+                 limits: Dict[str, TokenBucket] = None, retry: RetryPolicy = None,
+                 cassette: Cassette = None):
+        # pool_connections: número de hosts con pool propio
+        # pool_maxsize: conexiones abiertas que se conservan por host
+        # limits: limitador de peticiones por host
+        # retry: política de reintentos (sin reintentos si no se indica)
+        # cassette: graba las respuestas o las reproduce sin enviar las peticiones
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.limits = limits or {}
+        self.retry = retry or RetryPolicy(max_retries=0)
+        self.cassette = cassette
+        self._counters: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def request(self, method: str, url: str, idempotent: bool = None, **kwargs) -> requests.Response:
+        """
+        Envía una petición HTTP reutilizando las conexiones abiertas del host. Espera su
+        turno en el limitador del host y reintenta los 429, 5xx y errores de conexión.
+        Un POST solo se reintenta ante 429/503 salvo que se indique idempotent=True.
+        Si hay un plazo en curso, los timeouts y reintentos no lo sobrepasan.
+        Con un cassette, la respuesta final se graba, o se reproduce sin enviar la petición.
+        """
+        if self.cassette is not None and self.cassette.replaying:
+            return self.cassette.replay(method, url, kwargs)
+        start = time.monotonic()
+        response = self._request(method, url, idempotent, **kwargs)
+        if self.cassette is not None:
+            self.cassette.record(method, url, kwargs, response, time.monotonic() - start)
+        return response
+
+    def _request(self, method: str, url: str, idempotent: bool = None, **kwargs) -> requests.Response:
+        timeout = kwargs.pop("timeout", self.timeout)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        host = urlsplit(url).hostname
+        bucket = self.limits.get(host)
+        deadline = current_deadline()
+
+        attempt = 0
+        while True:
+            if bucket is not None:
+                throttled = bucket.acquire()
+                add_wait(throttled)
+                self._count(host, "throttled_seconds", throttled)
+            if deadline is not None:
+                deadline.check(host)
+            error = None
+            try:
+                response = self.session.request(method, url, timeout=self._bounded(timeout, deadline), **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if deadline is not None and deadline.expired:
+                    raise DeadlineExceeded(f"Plazo agotado esperando a {host}") from e
+                response, error = None, e
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                return response
+
+            delay = self.retry.delay(attempt, response)
+            out_of_time = deadline is not None and delay >= deadline.remaining()
+            if out_of_time or not self.retry.should_retry(attempt, response, idempotent):
+                if error is not None:
+                    raise error
+                return response
+
+            if response is not None and response.status_code == 429 and bucket is not None:
+                # Frenar a todos los hilos que usan el host, no solo a esta petición
+                bucket.pause(delay)
+            reason = f"HTTP {response.status_code}" if response is not None else type(error).__name__
+            print(f"{host}: {reason}, reintento {attempt + 1} en {delay:.1f}s")
+            self._count(host, "retries", 1)
+            time.sleep(delay)
+            add_wait(delay)
+            attempt += 1
+
+    @staticmethod
+    def _bounded(timeout, deadline):
+        """
+        Acorta el timeout (segundos o tupla conexión/lectura) al tiempo que le queda al plazo.
+        """
+        if deadline is None or timeout is None:
+            return timeout
+        remaining = max(deadline.remaining(), 0.001)
+        if isinstance(timeout, tuple):
+            return tuple(min(part, remaining) if part is not None else remaining for part in timeout)
+        return min(timeout, remaining)
+
+    def _count(self, host: str, name: str, value: float) -> None:
+        with self._lock:
+            counters = self._counters.setdefault(host, {"retries": 0, "throttled_seconds": 0.0})
+            counters[name] += value
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Retorna, por host, el número de peticiones, conexiones nuevas y conexiones reutilizadas,
+        los reintentos y los segundos de espera impuestos por el limitador.
+        """
+        pools = self.adapter.poolmanager.pools
+        stats = {}
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = stats.setdefault(pool.host, {"requests": 0, "new_connections": 0, "reused_connections": 0})
+            host["requests"] += pool.num_requests
+            host["new_connections"] += pool.num_connections
+            host["reused_connections"] = max(host["requests"] - host["new_connections"], 0)
+        with self._lock:
+            for name, counters in self._counters.items():
+                stats.setdefault(name, {"requests": 0, "new_connections": 0, "reused_connections": 0}).update(counters)
+        for host in stats.values():
+            host.setdefault("retries", 0)
+            host.setdefault("throttled_seconds", 0.0)
+        return stats
+
+    def close(self) -> None:
+        """
+        Cierra todas las conexiones abiertas.
+        """
+        self.session.close()
+
+_default_transport: Optional[HTTPTransport] = None
+_default_lock = threading.Lock()
+
+def get_default_transport() -> HTTPTransport:
+    """
+    Retorna el transporte compartido, configurado desde Settings.
+    """
+    global _default_transport
+    with _default_lock:
+        if _default_transport is None:
+            _default_transport = HTTPTransport(
+                pool_connections=Settings.HTTP_POOL_CONNECTIONS,
+                pool_maxsize=Settings.HTTP_POOL_MAXSIZE,
+                connect_timeout=Settings.HTTP_CONNECT_TIMEOUT,
+                read_timeout=Settings.HTTP_READ_TIMEOUT,
+                limits={
+                    "api.clickup.com": per_minute(Settings.CLICKUP_RATE_LIMIT),
+                    "google.serper.dev": per_minute(Settings.SERPER_RATE_LIMIT),
+                    "openrouter.ai": per_minute(Settings.OPENROUTER_RATE_LIMIT)
+                },
+                retry=RetryPolicy(Settings.HTTP_MAX_RETRIES, Settings.HTTP_RETRY_BASE_DELAY,
+                                  Settings.HTTP_RETRY_MAX_DELAY),
+                cassette=Cassette(Settings.CASSETTE_PATH, Settings.CASSETTE_MODE, Settings.CASSETTE_REPLAY_TIMING)
+                if Settings.CASSETTE_MODE != "off" else None
+            )
+        return _default_transport
@@ -1,13 +1,31 @@
+import json
 import os
+import shutil
 from dotenv import load_dotenv
 from config.settings import Settings
 from agents.legal import LegalAgent
 from agents.market import MarketAgent
+from agents.answer_cache import AnswerCache
+from agents.intent_router import IntentRouter
 from agents.task_manager import TaskManager
+from agents.thoughts import ThoughtWriter
+from integrations.circuit_breaker import CircuitBreaker
 from integrations.clickup import ClickUpIntegration
+from integrations.clickup_reply import ProgressiveReply
+from integrations.clickup_watcher import REJECTED, ClickUpListWatcher
+from integrations.clickup_webhook import ClickUpWebhookServer
+from integrations.llm_cache import LLMResponseCache
 from integrations.openrouter import OpenRouterLLM
+from integrations.search_cache import SearchCache
 from integrations.serper import SerperSearch
-from utils.helpers import setup_logging, get_conversation_file
+from integrations.snippet_index import SnippetIndex
+from integrations.transport import get_default_transport
+from utils.context_packer import ContextPacker
+from utils.deadline import Deadline
+from utils.helpers import conversation_scope, setup_logging
+from utils.job_queue import JobQueue
+from utils.ledger import MentionLedger
+from utils.usage import UsageLog, UsageMeter
 import time
 import re
 
@@ -17,29 +35,266 @@ load_dotenv()
 # Configurar logging
 setup_logging()
 
+def make_breaker(settings, name, slow_call_threshold):
+    return CircuitBreaker(name, failure_threshold=settings.BREAKER_FAILURE_THRESHOLD,
+                          reset_timeout=settings.BREAKER_RESET_TIMEOUT, slow_call_threshold=slow_call_threshold)
+
+def model_routes(settings):
+    """
+    Construye la tabla de ruteo de modelos por paso: modelos rápidos para el ruteo, la
+    planificación de búsquedas y los pensamientos, y el modelo fuerte para la síntesis.
+    context_tokens es el presupuesto del contexto armado para las respuestas de los
+    expertos y para la síntesis. MODEL_ROUTES puede ajustar cualquier entrada.
+    """
+    routes = {
+        "default": {"model": settings.DEFAULT_MODEL},
+        "legal": {"model": settings.LEGAL_AGENT_MODEL},
+        "market": {"model": settings.MARKET_AGENT_MODEL},
+        "routing": {"model": settings.FAST_MODEL},
+        "planning": {"model": settings.FAST_MODEL},
+        "thought": {"model": settings.FAST_MODEL},
+        "answer": {"context_tokens": settings.CONTEXT_TOKEN_BUDGET},
+        "synthesis": {"model": settings.STRONG_MODEL, "context_tokens": settings.SYNTHESIS_TOKEN_BUDGET}
+    }
+    for step, overrides in json.loads(settings.MODEL_ROUTES).items():
+        routes.setdefault(step, {}).update(overrides)
+    return routes
+
 def initialize_agents(settings):
-    llm = OpenRouterLLM(settings.OPENROUTER_API_KEY)
-    search = SerperSearch(settings.SERPER_API_KEY)
-    legal_agent = LegalAgent(llm, search)
-    market_agent = MarketAgent(llm, search)
-    task_manager = TaskManager(llm, search, legal_agent, market_agent)
+    llm_cache = None
+    if settings.LLM_CACHE_ENABLED:
+        llm_cache = LLMResponseCache(settings.CACHE_DIR, settings.LLM_CACHE_MAX_ENTRIES, settings.LLM_CACHE_TTL)
+    llm = OpenRouterLLM(settings.OPENROUTER_API_KEY, cache=llm_cache,
+                        breaker=make_breaker(settings, "OpenRouter", settings.OPENROUTER_SLOW_CALL),
+                        hedge=settings.HEDGE_ENABLED, hedge_model=settings.HEDGE_FALLBACK_MODEL or None,
+                        hedge_min_delay=settings.HEDGE_MIN_DELAY, hedge_default_delay=settings.HEDGE_DEFAULT_DELAY,
+                        routes=model_routes(settings), base_url=settings.OPENROUTER_BASE_URL,
+                        usage_log=UsageLog(os.path.join(settings.CACHE_DIR, "llm_usage.jsonl")) if settings.LLM_USAGE_LOG else None)
+    search_cache = None
+    if settings.SEARCH_CACHE_ENABLED:
+        search_cache = SearchCache({
+            "search": settings.SEARCH_CACHE_TTL_SEARCH,
+            "news": settings.SEARCH_CACHE_TTL_NEWS,
+            "places": settings.SEARCH_CACHE_TTL_PLACES,
+            "images": settings.SEARCH_CACHE_TTL_PLACES
+        }, settings.SEARCH_CACHE_MAX_ENTRIES)
+    snippet_index = None
+    if settings.SNIPPET_INDEX_ENABLED:
+        snippet_index = SnippetIndex(settings.CACHE_DIR, settings.SNIPPET_INDEX_MIN_COVERAGE, {
+            "search": settings.SNIPPET_INDEX_MAX_AGE_SEARCH,
+            "news": settings.SNIPPET_INDEX_MAX_AGE_NEWS
+        }, settings.SNIPPET_INDEX_RETENTION_DAYS * 24 * 3600, settings.SNIPPET_INDEX_MAX_DOCUMENTS)
+        snippet_index.compact()
+    search = SerperSearch(settings.SERPER_API_KEY, cache=search_cache, batch_limit=settings.SERPER_BATCH_LIMIT,
+                          breaker=make_breaker(settings, "Serper", settings.SERPER_SLOW_CALL),
+                          timeout=settings.SERPER_TIMEOUT, base_url=settings.SERPER_BASE_URL, index=snippet_index)
+    thoughts = ThoughtWriter(llm, workers=settings.THOUGHT_WORKERS if settings.BACKGROUND_THOUGHTS else 0,
+                             reserve=settings.DEADLINE_RESERVE)
+    packer = ContextPacker(settings.CONTEXT_TOKEN_BUDGET, settings.CONTEXT_SIMILARITY)
+    router = None
+    if settings.INTENT_ROUTER_ENABLED:
+        router = IntentRouter(settings.INTENT_MODEL_PATH or os.path.join(settings.CACHE_DIR, "intent_model.json"),
+                              settings.INTENT_MIN_CONFIDENCE,
+                              os.path.join(settings.CACHE_DIR, "intent_decisions.jsonl") if settings.INTENT_LOG else None)
+    answers = None
+    if settings.ANSWER_CACHE_ENABLED:
+        answers = AnswerCache(settings.CACHE_DIR, settings.ANSWER_CACHE_SIMILARITY, settings.ANSWER_CACHE_TTL,
+                              settings.ANSWER_CACHE_REFRESH_AFTER, settings.ANSWER_CACHE_MAX_ENTRIES)
+    legal_agent = LegalAgent(llm, search, search_concurrency=settings.SEARCH_CONCURRENCY,
+                             batch_search=settings.SEARCH_BATCH_ENABLED, thoughts=thoughts, packer=packer)
+    market_agent = MarketAgent(llm, search, search_concurrency=settings.SEARCH_CONCURRENCY,
+                               batch_search=settings.SEARCH_BATCH_ENABLED, thoughts=thoughts, packer=packer)
+    task_manager = TaskManager(llm, search, legal_agent, market_agent, parallel=settings.PARALLEL_AGENTS,
+                               pipeline_mode=settings.PIPELINE_MODE,
+                               step_limits={"llm": settings.DAG_LLM_CONCURRENCY, "search": settings.DAG_SEARCH_CONCURRENCY},
+                               thoughts=thoughts, packer=packer, answers=answers, router=router)
     return task_manager
 
-def process_mention(comment, task_manager):
+def process_mention(comment, task_manager, deadline=None, on_progress=None, usage=None):
     """
     Procesa una mención en un comentario y genera una respuesta apropiada
     utilizando el TaskManager para coordinar los agentes.
     """
     content = comment['comment_text']
     print(f"\nProcesando consulta: {content}")
-    return task_manager.handle_query(content)
+    skipped_before = task_manager.thoughts.skipped
+    response = task_manager.handle_query(content, deadline=deadline, on_progress=on_progress, usage=usage)
+    
+    skipped = task_manager.thoughts.skipped - skipped_before
+    if deadline is not None:
+        print(f"Plazo: {deadline.seconds - deadline.remaining():.1f}s usados de {deadline.seconds:.0f}s")
+    if skipped:
+        print(f"{skipped} pensamientos omitidos por falta de tiempo o de presupuesto")
+    if usage is not None:
+        print(f"Consumo de la mención: {usage.tokens} tokens, ${usage.cost:.4f}")
+        for step, stats in usage.by_step().items():
+            print(f"  {step}: {stats['calls']} llamadas ({stats['cached']} en caché), "
+                  f"{stats['prompt_tokens']}+{stats['completion_tokens']} tokens, ${stats['cost']:.4f}, "
+                  f"{stats['latency']:.1f}s")
+    if task_manager.llm.usage_log is not None:
+        stats = task_manager.llm.usage_log.day_totals()
+        print(f"Consumo del día: {stats['calls']} llamadas, "
+              f"{stats['prompt_tokens'] + stats['completion_tokens']} tokens, ${stats['cost']:.4f}")
+    for model, stats in task_manager.llm.model_stats().items():
+        print(f"Modelo {model}: {stats['calls']} llamadas, {stats['avg_latency']:.1f}s promedio "
+              f"(p95 {stats['p95_latency']:.1f}s), {stats['prompt_tokens']}+{stats['completion_tokens']} tokens, "
+              f"${stats['cost']:.4f}")
+    if task_manager.llm.hedges:
+        print(f"Peticiones de respaldo al LLM: {task_manager.llm.hedges} "
+              f"({task_manager.llm.hedge_wins} respondieron primero)")
+    
+    modo = "paralelo" if task_manager.parallel else "secuencial"
+    for agente, segundos in task_manager.last_timings.items():
+        print(f"Tiempo {agente} ({modo}): {segundos:.2f}s")
+    if task_manager.pipeline_mode == "dag":
+        print(task_manager.last_report)
+    
+    if task_manager.llm.cache is not None:
+        stats = task_manager.llm.cache.stats()
+        print(f"Caché LLM: {stats['hits']} aciertos, {stats['misses']} fallos "
+              f"({stats['hit_ratio']:.0%}), {stats['entries']} entradas")
+    
+    if task_manager.search.cache is not None:
+        stats = task_manager.search.cache.stats()
+        print(f"Caché de búsquedas: {stats['hit_ratio']:.0%} aciertos "
+              f"({stats['coalesced']} compartidas), {stats['credits_saved']} créditos ahorrados")
+    
+    if task_manager.router is not None:
+        stats = task_manager.router.stats()
+        print(f"Ruteo de consultas: {stats['local']} decididas localmente, {stats['fallbacks']} con el LLM")
+    
+    if task_manager.answers is not None:
+        stats = task_manager.answers.stats()
+        print(f"Caché de respuestas: {stats['hits']} aciertos, {stats['misses']} fallos "
+              f"({stats['hit_ratio']:.0%}), {stats['refreshes']} recalculadas, {stats['entries']} entradas")
+    
+    if task_manager.search.index is not None:
+        stats = task_manager.search.index.stats()
+        print(f"Índice de fragmentos: {stats['hits']} búsquedas respondidas localmente, "
+              f"{stats['misses']} enviadas a Serper, {stats['documents']} fragmentos")
+    
+    for breaker in (task_manager.llm.breaker, task_manager.search.breaker):
+        stats = breaker.stats()
+        if stats['state'] != "closed":
+            print(f"Circuito de {breaker.name}: {stats['state']} ({stats['failures']} fallas, "
+                  f"{stats['rejected']} llamadas rechazadas)")
+    return response
+
+def answer_mention(clickup, task_manager, settings, task_id, comment, ledger=None, comment_id=None):
+    """
+    Responde una mención: genera la respuesta, la publica en la tarea y sube la conversación.
+    Con STREAM_REPLIES, la respuesta se publica como marcador al comenzar y se va
+    completando mientras se genera la síntesis final.
+    Con ledger, la mención queda registrada como respondida en cuanto se publica la respuesta.
+    Los pensamientos de la mención se registran en una conversación propia, que se elimina
+    tras subirla, para que las menciones atendidas en paralelo no mezclen sus conversaciones.
+    """
+    name = re.sub(r"[^\w.-]", "_", str(comment_id or comment.get('id') or task_id))
+    directory = os.path.join(settings.CACHE_DIR, "conversations", name)
+    try:
+        with conversation_scope(os.path.join(directory, "conversation.md")) as conversation:
+            _answer_mention(clickup, task_manager, settings, task_id, comment, ledger, comment_id, conversation)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def _answer_mention(clickup, task_manager, settings, task_id, comment, ledger, comment_id, conversation):
+    reply = ProgressiveReply(clickup, task_id, settings.STREAM_UPDATE_INTERVAL) if settings.STREAM_REPLIES else None
+    if reply is not None and reply.start() and ledger is not None:
+        ledger.record_reply(comment_id, reply.comment_id)
+    
+    try:
+        usage = UsageMeter(settings.MENTION_TOKEN_BUDGET, settings.MENTION_COST_BUDGET,
+                           label=str(comment_id or comment.get('id') or task_id))
+        response = process_mention(comment, task_manager, Deadline(settings.MENTION_DEADLINE),
+                                   on_progress=reply.update if reply is not None else None, usage=usage)
+    except Exception:
+        if reply is not None:
+            reply.fail()
+        raise
+    print(f"\nGenerando respuesta: {response[:100]}...")
+    
+    # Responder al comentario
+    if reply is not None:
+        reply_id = reply.finish(response)
+        print(f"Respuesta completada ({reply.updates} actualizaciones parciales)")
+    else:
+        posted = clickup.create_comment(task_id, response)
+        reply_id = posted.get('id') if isinstance(posted, dict) else None
+        print("Respuesta enviada exitosamente")
+    if ledger is not None:
+        ledger.mark_answered(comment_id, str(reply_id) if reply_id else None)
+    
+    # Esperar a que se completen los pensamientos generados en segundo plano
+    if task_manager.thoughts.background:
+        if not task_manager.thoughts.drain(timeout=settings.THOUGHTS_WAIT_TIMEOUT):
+            print("La conversación se subirá incompleta: se agotó el tiempo de espera de los pensamientos")
+    
+    # Subir el archivo markdown a ClickUp
+    try:
+        clickup.upload_attachment(task_id, conversation)
+        print("Archivo de conversación subido exitosamente a ClickUp")
+    except Exception as e:
+        print(f"Error al subir el archivo a ClickUp: {str(e)}")
+    
+    for host, stats in get_default_transport().stats().items():
+        print(f"Conexiones {host}: {stats['reused_connections']} reutilizadas, "
+              f"{stats['new_connections']} nuevas ({stats['requests']} peticiones, "
+              f"{stats['retries']} reintentos, {stats['throttled_seconds']:.1f}s de espera por límite)")
+
+def make_comment_handler(clickup, task_manager, settings):
+    """
+    Retorna la función que recibe comentarios (del sondeo o del webhook) y encola una
+    sola vez cada mención de @AI, según el registro persistente de menciones. Las
+    menciones se responden en una cola atendida por MENTION_WORKERS hilos.
+    Retorna True si la mención fue aceptada, REJECTED si la cola estaba llena (sin contar
+    como intento, para volver a entregarla más tarde) y False en otro caso.
+    """
+    ledger = MentionLedger(os.path.join(settings.CACHE_DIR, "mentions.json"),
+                           max_attempts=settings.MENTION_MAX_ATTEMPTS,
+                           retention=settings.MENTION_RETENTION_DAYS * 24 * 3600)
+    
+    def run_job(task_id, comment, comment_id):
+        print(f"\n¡Encontrada mención de @AI en la tarea {task_id}!")
+        print(f"Contenido completo del comentario: {comment.get('comment_text', '')}")
+        try:
+            answer_mention(clickup, task_manager, settings, task_id, comment, ledger, comment_id)
+        except Exception as e:
+            ledger.mark_failed(comment_id, str(e))
+            raise
+    
+    def acknowledge(job, position):
+        task_id = job.args[0]
+        clickup.create_comment(task_id, f"Consulta recibida. Hay otras consultas en curso; "
+                                        f"esta se responderá en cuanto sea posible (posición {position} en la cola).")
+    
+    jobs = JobQueue(run_job, workers=settings.MENTION_WORKERS, max_depth=settings.MENTION_QUEUE_DEPTH,
+                    policy=settings.MENTION_QUEUE_POLICY, on_deferred=acknowledge, name="menciones")
+    jobs.start()
+    
+    def handle_comment(task_id, comment):
+        comment_text = comment.get('comment_text', '')
+        if '@AI' not in comment_text:
+            return False
+        
+        comment_id = str(comment.get('id') or f"{task_id}:{comment.get('date_created')}")
+        if not ledger.claim(comment_id, task_id):
+            return False
+        if jobs.submit(task_id, comment, comment_id) is None:
+            # Se libera sin contar como intento para reintentarla cuando vuelva a verse
+            ledger.release(comment_id)
+            return REJECTED
+        return True
+    
+    return handle_comment
 
 def main():
     print("Iniciando el Sistema de Agentes Inmobiliarios...")
     settings = Settings()
     
     # Inicializar ClickUp y probar la conexión
-    clickup = ClickUpIntegration(settings.CLICKUP_WORKSPACE_ID)
+    clickup = ClickUpIntegration(settings.CLICKUP_WORKSPACE_ID,
+                                 breaker=make_breaker(settings, "ClickUp", settings.CLICKUP_SLOW_CALL),
+                                 base_url=settings.CLICKUP_BASE_URL)
     print("\nProbando conexión con ClickUp...")
     clickup.test_connection()
     
@@ -48,6 +303,27 @@ def main():
 
     # ID de la tarea específica a monitorear
     TASK_ID = "868bbn5gw"
+    handle_comment = make_comment_handler(clickup, task_manager, settings)
+    
+    # Con webhook, la vigilancia de la lista queda como reconciliación de baja frecuencia:
+    # sus marcas de agua por tarea recuperan los eventos perdidos de cualquier tarea y
+    # comentario, y el registro de menciones evita responder dos veces
+    poll_interval = settings.POLL_INTERVAL
+    if settings.WEBHOOK_ENABLED:
+        webhook = ClickUpWebhookServer(settings.CLICKUP_WEBHOOK_SECRET, handle_comment,
+                                       settings.WEBHOOK_HOST, settings.WEBHOOK_PORT, settings.WEBHOOK_PATH)
+        webhook.start()
+        poll_interval = settings.RECONCILE_INTERVAL
+    
+    if settings.WATCH_LIST or settings.WEBHOOK_ENABLED:
+        watcher = ClickUpListWatcher(clickup, settings.CLICKUP_LIST_ID, handle_comment,
+                                     os.path.join(settings.CACHE_DIR, "comment_cursors.json"),
+                                     requests_per_minute=settings.CLICKUP_RATE_LIMIT,
+                                     rate_share=settings.WATCHER_RATE_SHARE,
+                                     min_interval=poll_interval,
+                                     task_refresh_interval=settings.TASK_REFRESH_INTERVAL)
+        watcher.run_forever()
+        return
     print(f"\nSistema iniciado. Monitoreando la tarea {TASK_ID}...")
 
     while True:
@@ -57,7 +333,7 @@ def main():
             
             if not comments:
                 print("No se encontraron comentarios.")
-                time.sleep(10)
+                time.sleep(poll_interval)
                 continue
             
             # Ordenar comentarios por fecha (más reciente primero)
@@ -71,35 +347,22 @@ def main():
             
             # Verificar si el último comentario tiene @AI
             comment_text = latest_comment.get('comment_text', '')
-            if '@AI' in comment_text:
-                print(f"\n¡Encontrada mención de @AI!")
-                print(f"Contenido completo del comentario: {comment_text}")
-                
-                response = process_mention(latest_comment, task_manager)
-                print(f"\nGenerando respuesta: {response[:100]}...")
-                
-                # Responder al comentario
-                clickup.create_comment(TASK_ID, response)
-                print("Respuesta enviada exitosamente")
-                
-                # Subir el archivo markdown a ClickUp
-                try:
-                    clickup.upload_attachment(TASK_ID, 'conversation.md')
-                    print("Archivo de conversación subido exitosamente a ClickUp")
-                except Exception as e:
-                    print(f"Error al subir el archivo a ClickUp: {str(e)}")
-            else:
-                print(f"El último comentario no contiene '@AI'")
+            handled = handle_comment(TASK_ID, latest_comment)
+            if handled == REJECTED:
+                print("La cola de menciones está llena; el comentario se reintentará en la próxima verificación")
+            elif not handled:
+                print(f"El último comentario no contiene '@AI' o ya fue respondido")
                 print(f"Contenido del comentario: {comment_text}")
             
             # Esperar antes de la próxima verificación
-            print("\nEsperando 10 segundos antes de la próxima verificación...")
-            time.sleep(10)
+            print(f"\nEsperando {poll_interval} segundos antes de la próxima verificación...")
+            time.sleep(poll_interval)
         
         except Exception as e:
+            # Los reintentos ante fallas transitorias ya ocurren en el transporte
             print(f"\nError en el bucle principal: {str(e)}")
-            print("Esperando 60 segundos antes de reintentar...")
-            time.sleep(60)
+            print(f"Esperando {poll_interval} segundos antes de reintentar...")
+            time.sleep(poll_interval)
 
 if __name__ == "__main__":
     main()
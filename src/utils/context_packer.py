@@ -0,0 +1,122 @@
+import hashlib
+import math
+import threading
+from collections import Counter
+from typing import Dict, List
+
+from utils.text import estimate_tokens, jaccard, normalize, shingles, tokenize
+
+class PackedContext:
+    """
+    Resultado de armar un contexto: el texto y cuánto se redujo.
+    """
+    def __init__(self, text: str, kept: int, duplicates: int, dropped: int, tokens_in: int, tokens_out: int):
+        self.text = text
+        self.kept = kept
+        self.duplicates = duplicates
+        self.dropped = dropped
+        self.tokens_in = tokens_in
+        self.tokens_out = tokens_out
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_in - self.tokens_out
+
+class ContextPacker:
+    """
+    Arma el contexto de un prompt a partir de fragmentos (resultados de búsqueda o
+    párrafos): elimina los duplicados exactos y los casi duplicados (similitud de
+    Jaccard entre secuencias de 3 palabras), ordena el resto por relevancia para la
+    consulta y los agrega hasta el presupuesto de tokens estimados.
+    """
+    def __init__(self, token_budget: int = 3000, similarity: float = 0.6):
+        self.token_budget = token_budget
+        self.similarity = similarity
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+
+    def pack(self, query: str, fragments: List[str], budget: int = None, keep_order: bool = False,
+             separator: str = "\n", label: str = "contexto") -> PackedContext:
+        """
+        Retorna el contexto armado con los fragmentos. Con keep_order los fragmentos
+        conservan su orden original (por ejemplo, párrafos de una respuesta); si no, van
+        de más a menos relevante. budget reemplaza el presupuesto por defecto (0 = sin límite).
+        """
+        budget = self.token_budget if budget is None else budget
+        tokens_in = sum(estimate_tokens(fragment) for fragment in fragments)
+        unique = self.deduplicate(fragments)
+        duplicates = len([f for f in fragments if f.strip()]) - len(unique)
+
+        order = list(range(len(unique)))
+        scores = self.relevance(query, unique)
+        ranked = sorted(order, key=lambda i: scores[i], reverse=True)
+
+        selected, used = set(), 0
+        for i in ranked:
+            cost = estimate_tokens(unique[i])
+            if budget and used + cost > budget:
+                continue
+            selected.add(i)
+            used += cost
+        chosen = [unique[i] for i in (order if keep_order else ranked) if i in selected]
+
+        packed = PackedContext(separator.join(chosen), len(chosen), duplicates, len(unique) - len(chosen),
+                               tokens_in, used)
+        with self._lock:
+            self.tokens_saved += packed.tokens_saved
+        if packed.tokens_saved:
+            print(f"Contexto {label}: {len(fragments)} fragmentos -> {packed.kept} ({duplicates} duplicados, "
+                  f"{packed.dropped} fuera del presupuesto), {tokens_in} -> {used} tokens estimados "
+                  f"({packed.tokens_saved} ahorrados)")
+        return packed
+
+    def deduplicate(self, fragments: List[str]) -> List[str]:
+        """
+        Elimina los fragmentos vacíos, repetidos o casi iguales a uno anterior. De dos casi
+        duplicados se conserva el más largo, en la posición del primero.
+        """
+        unique: List[str] = []
+        seen_hashes = set()
+        signatures = []
+        for fragment in fragments:
+            if not fragment or not fragment.strip():
+                continue
+            digest = hashlib.sha1(normalize(fragment).encode("utf-8")).hexdigest()
+            if digest in seen_hashes:
+                continue
+            seen_hashes.add(digest)
+            signature = shingles(fragment)
+            for index, previous in enumerate(signatures):
+                if jaccard(signature, previous) >= self.similarity:
+                    if len(fragment) > len(unique[index]):
+                        unique[index], signatures[index] = fragment, signature
+                    break
+            else:
+                unique.append(fragment)
+                signatures.append(signature)
+        return unique
+
+    @staticmethod
+    def relevance(query: str, fragments: List[str]) -> List[float]:
+        """
+        Puntaje de cada fragmento: suma del idf de los términos de la consulta que contiene,
+        con saturación por frecuencia, normalizado por el largo del fragmento.
+        """
+        terms = set(tokenize(query))
+        counts = [Counter(tokenize(fragment)) for fragment in fragments]
+        total = len(fragments)
+        document_frequency = Counter(term for count in counts for term in terms if term in count)
+        scores = []
+        for count in counts:
+            length = sum(count.values()) or 1
+            score = 0.0
+            for term in terms:
+                if term in count:
+                    idf = math.log(1 + total / document_frequency[term])
+                    score += idf * count[term] / (count[term] + 1)
+            scores.append(score / math.sqrt(1 + length / 50))
+        return scores
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"tokens_saved": self.tokens_saved}
@@ -0,0 +1,75 @@
+import contextvars
+import time
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+class DeadlineExceeded(Exception):
+    """
+    Se agotó el tiempo disponible para responder la mención.
+    """
+
+class Deadline:
+    """
+    Plazo absoluto para responder una mención.
+    """
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def allows(self, reserve: float) -> bool:
+        """
+        Indica si queda más tiempo que la reserva indicada.
+        """
+        return self.remaining() > reserve
+
+    def check(self, stage: str = "") -> None:
+        """
+        Lanza DeadlineExceeded si el plazo ya venció.
+        """
+        if self.expired:
+            raise DeadlineExceeded(f"Plazo de {self.seconds:.0f}s agotado{f' en {stage}' if stage else ''}")
+
+_current: contextvars.ContextVar = contextvars.ContextVar("deadline", default=None)
+
+def current_deadline() -> Optional[Deadline]:
+    """
+    Retorna el plazo de la mención en curso, o None si no hay plazo.
+    """
+    return _current.get()
+
+def remaining_time() -> Optional[float]:
+    deadline = _current.get()
+    return None if deadline is None else deadline.remaining()
+
+def budget_allows(reserve: float) -> bool:
+    """
+    Indica si hay tiempo para una etapa opcional, dejando la reserva para las obligatorias.
+    Sin plazo siempre hay tiempo.
+    """
+    deadline = _current.get()
+    return deadline is None or deadline.allows(reserve)
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """
+    Establece el plazo para el código del bloque y los hilos lanzados con submit_in_context.
+    """
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+def submit_in_context(executor: Executor, func: Callable[..., Any], *args) -> Future:
+    """
+    Como executor.submit, pero func se ejecuta con el plazo (y demás contexto) del hilo actual.
+    """
+    return executor.submit(contextvars.copy_context().run, func, *args)
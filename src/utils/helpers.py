@@ -1,5 +1,72 @@
+import contextvars
 import logging
-from typing import Any, Dict
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+# Con True no se registran pensamientos en la conversación (por ejemplo, al recalcular
+# una respuesta en segundo plano, fuera de cualquier mención)
+_conversation_muted: contextvars.ContextVar = contextvars.ContextVar("conversation_muted", default=False)
+
+# Archivo de conversación de la mención en curso (None fuera de conversation_scope)
+_conversation_path: contextvars.ContextVar = contextvars.ContextVar("conversation_path", default=None)
+
+def write_conversation_header(path: str) -> None:
+    """
+    Crea (o vacía) un archivo de conversación con su encabezado.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("# 🏢 Análisis Inmobiliario - Conversación del Equipo\n\n")
+        f.write("## Participantes:\n")
+        f.write("- 👥 Coordinador: Líder del equipo\n")
+        f.write("- ⚖️ Experto Legal: Especialista en normativas inmobiliarias\n")
+        f.write("- 📊 Analista de Mercado: Experto en tendencias y valoraciones\n\n")
+        f.write("## Conversación:\n\n")
+
+class ConversationHandler(logging.Handler):
+    """
+    Escribe cada mensaje en la conversación de la mención en curso (conversation_scope),
+    para que las menciones atendidas en paralelo no mezclen sus conversaciones. Fuera
+    de una mención escribe en default_path.
+    """
+    def __init__(self, default_path: str):
+        super().__init__()
+        self.default_path = default_path
+
+    def emit(self, record: logging.LogRecord) -> None:
+        path = _conversation_path.get()
+        # Pensamiento tardío de una mención cuya conversación ya se subió y eliminó
+        if path is not None and not os.path.exists(path):
+            return
+        try:
+            message = self.format(record)
+            with open(path or self.default_path, 'a', encoding='utf-8') as f:
+                f.write(message + "\n")
+        except Exception:
+            self.handleError(record)
+
+@contextmanager
+def conversation_scope(path: str) -> Iterator[str]:
+    """
+    Registra los pensamientos del código del bloque, y de los hilos lanzados con
+    submit_in_context, en un archivo de conversación propio.
+    """
+    write_conversation_header(path)
+    token = _conversation_path.set(path)
+    try:
+        yield path
+    finally:
+        _conversation_path.reset(token)
+
+def current_conversation_file() -> str:
+    """
+    Retorna el archivo de conversación de la mención en curso, o conversation.md.
+    """
+    return _conversation_path.get() or 'conversation.md'
 
 def setup_logging(log_level: str = "INFO") -> None:
     """
@@ -16,25 +83,11 @@ def setup_logging(log_level: str = "INFO") -> None:
     # Limpiar handlers existentes
     logger.handlers = []
 
-    # Formato simple para los logs
-    formatter = logging.Formatter('%(message)s')
-
-    # Handler para archivo markdown
-    file_handler = logging.FileHandler('conversation.md', encoding='utf-8', mode='w')
+    # Handler para la conversación en markdown: la de la mención en curso o conversation.md
+    file_handler = ConversationHandler('conversation.md')
     file_handler.setLevel(numeric_level)
-    
-    # Escribir encabezado del archivo markdown
-    with open('conversation.md', 'w', encoding='utf-8') as f:
-        f.write("# 🏢 Análisis Inmobiliario - Conversación del Equipo\n\n")
-        f.write("## Participantes:\n")
-        f.write("- 👥 Coordinador: Líder del equipo\n")
-        f.write("- ⚖️ Experto Legal: Especialista en normativas inmobiliarias\n")
-        f.write("- 📊 Analista de Mercado: Experto en tendencias y valoraciones\n\n")
-        f.write("## Conversación:\n\n")
-    
-    # Formato especial para markdown
-    md_formatter = logging.Formatter('%(message)s')
-    file_handler.setFormatter(md_formatter)
+    write_conversation_header('conversation.md')
+    file_handler.setFormatter(logging.Formatter('%(message)s'))
     logger.addHandler(file_handler)
 
     # Handler para consola con formato más simple
@@ -49,7 +102,7 @@ def log_agent_thought(logger: logging.Logger, agent: str, thought: str) -> None:
     Registra el pensamiento de un agente en formato markdown.
     """
     # Asegurar que el pensamiento no esté vacío
-    if not thought or thought.isspace():
+    if not thought or thought.isspace() or _conversation_muted.get():
         return
     
     # Formatear mensaje en markdown
@@ -65,12 +118,40 @@ def log_agent_thought(logger: logging.Logger, agent: str, thought: str) -> None:
 """
     logger.info(message)
 
+def conversation_muted() -> bool:
+    return _conversation_muted.get()
+
+@contextmanager
+def muted_conversation() -> Iterator[None]:
+    """
+    Omite los pensamientos del código del bloque y de los hilos lanzados con submit_in_context.
+    """
+    token = _conversation_muted.set(True)
+    try:
+        yield
+    finally:
+        _conversation_muted.reset(token)
+
+def run_concurrently(func: Callable[[Any], Any], items: Iterable[Any], max_workers: int = 1) -> List[Any]:
+    """
+    Aplica func a cada elemento usando hasta max_workers hilos, que heredan el contexto
+    (por ejemplo, el plazo de la mención) del hilo que llama.
+    Los resultados se retornan en el mismo orden que los elementos de entrada.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    
+    contexts = [contextvars.copy_context() for _ in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(lambda context, item: context.run(func, item), contexts, items))
+
 def get_conversation_file() -> str:
     """
-    Retorna el contenido del archivo de conversación.
+    Retorna el contenido del archivo de conversación de la mención en curso.
     """
     try:
-        with open('conversation.md', 'r', encoding='utf-8') as f:
+        with open(current_conversation_file(), 'r', encoding='utf-8') as f:
             return f.read()
     except FileNotFoundError:
         return ""
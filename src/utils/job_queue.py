@@ -0,0 +1,128 @@
+import itertools
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+REJECT = "reject"
+DEFER = "defer"
+
+class Job:
+    """
+    Trabajo encolado con sus tiempos de espera y de ejecución.
+    """
+    def __init__(self, job_id: int, args: tuple):
+        self.id = job_id
+        self.args = args
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.error: Optional[str] = None
+
+    @property
+    def wait_time(self) -> float:
+        return (self.started or time.monotonic()) - self.submitted
+
+    @property
+    def run_time(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+class JobQueue:
+    """
+    Cola acotada de trabajos atendida por un número fijo de hilos. Cuando la cola
+    está llena, la política "reject" rechaza los trabajos nuevos y la política "defer"
+    los acepta igualmente y avisa con on_deferred(job, posición) que quedaron en espera.
+    """
+    def __init__(self, handler: Callable[..., Any], workers: int = 1, max_depth: int = 10,
+                 policy: str = REJECT, on_deferred: Callable[[Job, int], None] = None, name: str = "cola"):
+        if policy not in (REJECT, DEFER):
+            raise ValueError(f"Política de cola desconocida: {policy}")
+        self.handler = handler
+        self.workers = max(workers, 1)
+        self.max_depth = max_depth
+        self.policy = policy
+        self.on_deferred = on_deferred
+        self.name = name
+        self._queue: "queue.Queue[Job]" = queue.Queue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stats = {"submitted": 0, "rejected": 0, "deferred": 0, "completed": 0, "failed": 0,
+                       "wait_total": 0.0, "run_total": 0.0, "max_wait": 0.0, "max_depth": 0}
+
+    def start(self) -> None:
+        """
+        Inicia los hilos que atienden la cola.
+        """
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{index + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, *args) -> Optional[Job]:
+        """
+        Encola un trabajo. Retorna None si fue rechazado por falta de espacio.
+        """
+        with self._lock:
+            depth = self._queue.qsize()
+            if depth >= self.max_depth and self.policy == REJECT:
+                self._stats["rejected"] += 1
+                print(f"[{self.name}] Cola llena ({depth} en espera), trabajo rechazado")
+                return None
+            job = Job(next(self._ids), args)
+            self._queue.put(job)
+            self._stats["submitted"] += 1
+            self._stats["max_depth"] = max(self._stats["max_depth"], depth + 1)
+            deferred = depth >= self.max_depth
+            if deferred:
+                self._stats["deferred"] += 1
+
+        if deferred and self.on_deferred is not None:
+            try:
+                self.on_deferred(job, depth + 1)
+            except Exception as e:
+                print(f"[{self.name}] Error al avisar que el trabajo {job.id} quedó en espera: {str(e)}")
+        return job
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            job.started = time.monotonic()
+            try:
+                self.handler(*job.args)
+            except Exception as e:
+                job.error = str(e)
+                print(f"\n[{self.name}] Error en el trabajo {job.id}: {str(e)}")
+            finally:
+                job.finished = time.monotonic()
+                self._record(job)
+                self._queue.task_done()
+
+    def _record(self, job: Job) -> None:
+        with self._lock:
+            self._stats["failed" if job.error else "completed"] += 1
+            self._stats["wait_total"] += job.wait_time
+            self._stats["run_total"] += job.run_time
+            self._stats["max_wait"] = max(self._stats["max_wait"], job.wait_time)
+        print(f"[{self.name}] Trabajo {job.id}: {job.wait_time:.2f}s en cola, {job.run_time:.2f}s de ejecución")
+
+    def join(self) -> None:
+        """
+        Espera a que se procesen todos los trabajos encolados.
+        """
+        self._queue.join()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        done = stats["completed"] + stats["failed"]
+        stats["depth"] = self.depth
+        stats["avg_wait"] = stats["wait_total"] / done if done else 0.0
+        stats["avg_run"] = stats["run_total"] / done if done else 0.0
+        return stats
@@ -0,0 +1,148 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+IN_PROGRESS = "in-progress"
+ANSWERED = "answered"
+FAILED = "failed"
+# Comentarios publicados por el propio sistema (nunca se procesan como menciones)
+OWN_REPLY = "own-reply"
+
+class MentionLedger:
+    """
+    Registro persistente de las menciones procesadas y su estado, guardado en JSON
+    con escrituras atómicas. Permite omitir las menciones ya respondidas, reintentar
+    las fallidas y retomar las que quedaron en curso al reiniciar.
+    """
+    def __init__(self, path: str, max_attempts: int = 3, retention: float = 30 * 24 * 3600,
+                 compact_every: int = 100):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+        # Menciones en curso en este proceso; las demás "en curso" quedaron de un reinicio
+        self._active = set()
+        # Estado previo de las menciones en curso, para deshacer un reclamo con release()
+        self._previous: Dict[str, Optional[Dict]] = {}
+        self._writes = 0
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+            self.compact()
+
+    def get(self, comment_id: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(comment_id)
+            return dict(entry) if entry else None
+
+    def claim(self, comment_id: str, task_id: str) -> bool:
+        """
+        Marca la mención como en curso si debe procesarse. Retorna False si ya fue
+        respondida, se está procesando o agotó sus reintentos.
+        """
+        with self._lock:
+            entry = self._entries.get(comment_id)
+            if entry is not None:
+                if entry["status"] in (ANSWERED, OWN_REPLY) or comment_id in self._active:
+                    return False
+                # También limita las menciones que interrumpen el proceso una y otra vez
+                if entry["attempts"] >= self.max_attempts:
+                    return False
+                if entry["status"] == IN_PROGRESS:
+                    print(f"Retomando la mención {comment_id}, que quedó en curso")
+            attempts = entry["attempts"] + 1 if entry else 1
+            self._previous[comment_id] = entry
+            self._entries[comment_id] = {"task_id": task_id, "status": IN_PROGRESS,
+                                         "attempts": attempts, "updated": time.time()}
+            self._active.add(comment_id)
+            self._save()
+            return True
+
+    def release(self, comment_id: str) -> None:
+        """
+        Deshace el reclamo de una mención que no llegó a procesarse (por ejemplo, porque
+        la cola estaba llena): no cuenta como intento y puede reclamarse de nuevo.
+        """
+        with self._lock:
+            if comment_id not in self._active:
+                return
+            self._active.discard(comment_id)
+            previous = self._previous.pop(comment_id, None)
+            if previous is None:
+                del self._entries[comment_id]
+            else:
+                self._entries[comment_id] = previous
+            self._save()
+
+    def mark_answered(self, comment_id: str, reply_id: str = None) -> None:
+        """
+        Registra la mención como respondida y, si se conoce, el id de la respuesta
+        publicada para no tratarla nunca como una mención nueva.
+        """
+        with self._lock:
+            entry = self._entries.setdefault(comment_id, {"task_id": None, "attempts": 1})
+            entry.update(status=ANSWERED, updated=time.time())
+            if reply_id:
+                self._record_reply(comment_id, reply_id)
+            self._active.discard(comment_id)
+            self._previous.pop(comment_id, None)
+            self._save()
+
+    def record_reply(self, comment_id: str, reply_id: str) -> None:
+        """
+        Registra un comentario publicado para la mención (por ejemplo, una respuesta que
+        se irá completando) para no tratarlo nunca como una mención nueva.
+        """
+        with self._lock:
+            self._record_reply(comment_id, reply_id)
+            self._save()
+
+    def _record_reply(self, comment_id: str, reply_id: str) -> None:
+        entry = self._entries.setdefault(comment_id, {"task_id": None, "status": IN_PROGRESS, "attempts": 1,
+                                                      "updated": time.time()})
+        entry["reply_id"] = reply_id
+        self._entries[reply_id] = {"task_id": entry["task_id"], "status": OWN_REPLY,
+                                   "attempts": 0, "updated": time.time()}
+
+    def mark_failed(self, comment_id: str, error: str) -> None:
+        with self._lock:
+            entry = self._entries.setdefault(comment_id, {"task_id": None, "attempts": 1})
+            entry.update(status=FAILED, error=error, updated=time.time())
+            self._active.discard(comment_id)
+            self._previous.pop(comment_id, None)
+            self._save()
+
+    def compact(self) -> int:
+        """
+        Elimina las entradas terminadas más antiguas que el periodo de retención.
+        Retorna la cantidad de entradas eliminadas.
+        """
+        with self._lock:
+            removed = self._compact()
+            if removed:
+                self._save()
+            return removed
+
+    def _compact(self) -> int:
+        cutoff = time.time() - self.retention
+        expired = [comment_id for comment_id, entry in self._entries.items()
+                   if entry["status"] != IN_PROGRESS and entry["updated"] < cutoff]
+        for comment_id in expired:
+            del self._entries[comment_id]
+        return len(expired)
+
+    def _save(self) -> None:
+        self._writes += 1
+        if self._writes % self.compact_every == 0:
+            self._compact()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
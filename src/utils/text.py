@@ -0,0 +1,69 @@
+import re
+import unicodedata
+from typing import List, Set
+
+# Palabras vacías del español que no aportan a la relevancia ni a la similitud
+STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes como con contra cual cuales cuando de del desde
+donde durante e el ella ellas ellos en entre era es esa esas ese eso esos esta estas este esto estos fue
+ha hay la las le les lo los mas me mi mis muy no nos o os otra otras otro otros para pero por porque que
+quien se sea ser si sin sobre su sus tambien te tiene tu tus un una unas uno unos y ya
+""".split())
+
+_WORD = re.compile(r"\w+")
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+def normalize(text: str) -> str:
+    """
+    Normaliza un texto: minúsculas, sin tildes y con espacios simples.
+    """
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    without_accents = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(without_accents.split())
+
+def tokenize(text: str, stopwords: bool = False) -> List[str]:
+    """
+    Palabras del texto normalizado (sin tildes), sin las palabras vacías salvo que
+    stopwords sea True.
+    """
+    words = _WORD.findall(normalize(text))
+    return words if stopwords else [word for word in words if word not in STOPWORDS]
+
+def stem(word: str) -> str:
+    """
+    Raíz aproximada de una palabra normalizada: sin el plural ni la vocal final, para que
+    "propiedad" y "propiedades" o "precio" y "precios" coincidan. Las palabras cortas no cambian.
+    """
+    if len(word) > 4:
+        if word.endswith("es") and word[-3] not in "aeiou":
+            word = word[:-2]
+        elif word.endswith("s"):
+            word = word[:-1]
+    if len(word) > 4 and word[-1] in "aeo":
+        word = word[:-1]
+    return word
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimación rápida de los tokens de un texto para los tokenizadores BPE habituales:
+    un token por signo de puntuación y por palabra de hasta 6 caracteres; las palabras
+    más largas cuentan un token por cada 4 caracteres, redondeando hacia arriba.
+    """
+    tokens = 0
+    for piece in _TOKEN.findall(text):
+        tokens += 1 if len(piece) <= 6 else (len(piece) + 3) // 4
+    return tokens
+
+def shingles(text: str, size: int = 3) -> Set[str]:
+    """
+    Conjunto de secuencias de size palabras consecutivas del texto normalizado.
+    """
+    words = tokenize(text, stopwords=True)
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def jaccard(first: Set[str], second: Set[str]) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
@@ -0,0 +1,171 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+def _empty_totals() -> Dict[str, float]:
+    return {"calls": 0, "cached": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "latency": 0.0}
+
+def _add(totals: Dict[str, float], record: Dict) -> None:
+    totals["calls"] += 1
+    totals["cached"] += 1 if record.get("cached") else 0
+    totals["prompt_tokens"] += record.get("prompt_tokens", 0)
+    totals["completion_tokens"] += record.get("completion_tokens", 0)
+    totals["cost"] += record.get("cost", 0.0)
+    totals["latency"] += record.get("latency", 0.0)
+
+def aggregate(records: List[Dict], key: str = "step") -> Dict[str, Dict[str, float]]:
+    """
+    Agrupa registros de llamadas al LLM por el campo indicado ("step", "model", "mention"...),
+    ordenados de mayor a menor costo.
+    """
+    groups: Dict[str, Dict[str, float]] = {}
+    for record in records:
+        _add(groups.setdefault(record.get(key) or "-", _empty_totals()), record)
+    return dict(sorted(groups.items(), key=lambda item: (item[1]["cost"], item[1]["latency"]), reverse=True))
+
+class UsageMeter:
+    """
+    Consumo de LLM de una mención: tokens, costo (USD) y latencia por paso del flujo.
+    Con token_budget o cost_budget, los pasos opcionales (pensamientos) se omiten
+    una vez alcanzado el presupuesto; los obligatorios siempre se ejecutan.
+    """
+    def __init__(self, token_budget: int = 0, cost_budget: float = 0.0, label: str = None):
+        # Presupuestos de la mención; 0 significa sin límite
+        self.token_budget = token_budget
+        self.cost_budget = cost_budget
+        self.label = label
+        self.records: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, record: Dict) -> None:
+        with self._lock:
+            self.records.append(record)
+
+    @property
+    def tokens(self) -> int:
+        with self._lock:
+            return sum(r.get("prompt_tokens", 0) + r.get("completion_tokens", 0) for r in self.records)
+
+    @property
+    def cost(self) -> float:
+        with self._lock:
+            return sum(r.get("cost", 0.0) for r in self.records)
+
+    @property
+    def exhausted(self) -> bool:
+        """
+        Indica si la mención ya alcanzó su presupuesto de tokens o de costo.
+        """
+        if self.token_budget and self.tokens >= self.token_budget:
+            return True
+        return bool(self.cost_budget) and self.cost >= self.cost_budget
+
+    def by_step(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return aggregate(list(self.records))
+
+class UsageLog:
+    """
+    Registro persistente de las llamadas al LLM en JSON Lines (una línea por llamada),
+    para agregar el consumo por día, por mención y por paso. Los totales por día se
+    mantienen en memoria al registrar cada llamada, sin volver a leer el archivo.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Totales por día; se cargan del archivo la primera vez que se consultan
+        self._days: Optional[Dict[str, Dict[str, float]]] = None
+        self._lock = threading.Lock()
+
+    def append(self, record: Dict) -> None:
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            if self._days is not None:
+                _add(self._days.setdefault(record.get("day") or "-", _empty_totals()), record)
+
+    def records(self, day: str = None) -> List[Dict]:
+        """
+        Retorna las llamadas registradas, solo las del día indicado (AAAA-MM-DD) si se indica.
+        """
+        with self._lock:
+            records = self._read()
+        return [record for record in records if day is None or record.get("day") == day]
+
+    def _read(self) -> List[Dict]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # Línea incompleta de un proceso interrumpido
+                continue
+        return records
+
+    def day_totals(self, day: str = None) -> Dict[str, float]:
+        """
+        Consumo total del día (hoy por defecto). Solo la primera consulta lee el archivo.
+        """
+        day = day or time.strftime("%Y-%m-%d")
+        with self._lock:
+            if self._days is None:
+                self._days = {}
+                for record in self._read():
+                    _add(self._days.setdefault(record.get("day") or "-", _empty_totals()), record)
+            return dict(self._days.get(day) or _empty_totals())
+
+    def daily_summary(self, day: str = None, key: str = "step") -> Dict[str, Dict[str, float]]:
+        """
+        Consumo del día (hoy por defecto) agrupado por paso, modelo o mención.
+        """
+        return aggregate(self.records(day or time.strftime("%Y-%m-%d")), key)
+
+_current: contextvars.ContextVar = contextvars.ContextVar("usage", default=None)
+
+def current_usage() -> Optional[UsageMeter]:
+    """
+    Retorna el medidor de consumo de la mención en curso, o None si no hay.
+    """
+    return _current.get()
+
+def usage_allows() -> bool:
+    """
+    Indica si queda presupuesto para un paso opcional. Sin medidor siempre hay presupuesto.
+    """
+    meter = _current.get()
+    return meter is None or not meter.exhausted
+
+@contextmanager
+def usage_scope(meter: Optional[UsageMeter]) -> Iterator[Optional[UsageMeter]]:
+    """
+    Establece el medidor para el código del bloque y los hilos lanzados con submit_in_context.
+    """
+    token = _current.set(meter)
+    try:
+        yield meter
+    finally:
+        _current.reset(token)
+
+if __name__ == "__main__":
+    import sys
+
+    # Uso: python src/utils/usage.py <llm_usage.jsonl> [AAAA-MM-DD] [step|model|mention]
+    if len(sys.argv) < 2:
+        print("Uso: python src/utils/usage.py <llm_usage.jsonl> [AAAA-MM-DD] [step|model|mention]")
+        sys.exit(1)
+    day = sys.argv[2] if len(sys.argv) > 2 else None
+    key = sys.argv[3] if len(sys.argv) > 3 else "step"
+    for name, totals in UsageLog(sys.argv[1]).daily_summary(day, key).items():
+        print(f"{name}: {totals['calls']} llamadas ({totals['cached']} en caché), "
+              f"{totals['prompt_tokens']}+{totals['completion_tokens']} tokens, "
+              f"${totals['cost']:.4f}, {totals['latency']:.1f}s")
@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+# Los módulos del proyecto se importan desde src, igual que al ejecutar src/main.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+# Configuración mínima requerida por Settings.validate; no se hacen peticiones reales
+for key in ("COMPOSIO_API_KEY", "SERPER_API_KEY", "OPENROUTER_API_KEY", "CLICKUP_API_KEY", "CLICKUP_WORKSPACE_ID"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("CASSETTE_MODE", "off")
+
+# main.py escribe conversation.md en el directorio actual al importarse
+os.chdir(tempfile.mkdtemp(prefix="tests-"))
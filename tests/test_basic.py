@@ -1,16 +1,19 @@
 import pytest
 from unittest.mock import MagicMock, patch
-from src.config.settings import Settings
-from src.integrations.clickup import ClickUpIntegration
-from src.integrations.openrouter import OpenRouterLLM
-from src.integrations.serper import SerperSearch
-from src.agents.legal import LegalAgent
-from src.agents.market import MarketAgent
-from src.main import initialize_agents, process_mention
+from config.settings import Settings
+from integrations.clickup import ClickUpIntegration
+from integrations.openrouter import OpenRouterLLM
+from integrations.serper import SerperSearch
+from agents.legal import LegalAgent
+from agents.market import MarketAgent
+from agents.task_manager import DEGRADED_NOTICE, TaskManager
+from main import initialize_agents, process_mention
 
 @pytest.fixture
-def mock_settings():
-    return Settings()
+def mock_settings(tmp_path):
+    settings = Settings()
+    settings.CACHE_DIR = str(tmp_path)
+    return settings
 
 @pytest.fixture
 def mock_llm():
@@ -20,6 +23,13 @@ def mock_llm():
 def mock_search():
     return MagicMock(spec=SerperSearch)
 
+def serper_reply(payload):
+    """Respuesta de Serper con un resultado orgánico por consulta (o por consulta del lote)."""
+    if isinstance(payload, list):
+        return [serper_reply(item) for item in payload]
+    return {"organic": [{"title": payload["q"], "snippet": f"Resultado sobre {payload['q']}",
+                         "link": f"https://example.com/{len(payload['q'])}"}]}
+
 def test_settings_load(mock_settings):
     """Prueba que las configuraciones se carguen correctamente."""
     assert mock_settings.COMPOSIO_API_KEY is not None
@@ -48,18 +58,10 @@ def test_legal_agent(mock_llm, mock_search):
     assert legal_agent.llm == mock_llm
     assert legal_agent.search == mock_search
 
-    # Prueba de analyze_document
-    mock_llm.generate_text.return_value = "Análisis del documento"
-    result = legal_agent.analyze_document("Documento de prueba")
-    assert "summary" in result
-    assert "recommendations" in result
-
-    # Prueba de verify_compliance
-    mock_llm.generate_text.return_value = "La propiedad cumple con la zonificación y tiene los permisos en orden. No se detectan problemas legales."
-    result = legal_agent.verify_compliance({"address": "123 Test St"})
-    assert result["zoning_compliant"] == True
-    assert result["permits_in_order"] == True
-    assert result["legal_issues"] == True
+    mock_llm.generate_text.return_value = "- requisitos de arriendo\n- ley de arriendo"
+    searches = legal_agent.suggest_legal_searches("¿Qué ley regula el arriendo?")
+    assert searches
+    assert all(isinstance(search, str) and search for search in searches)
 
 def test_market_agent(mock_llm, mock_search):
     """Prueba básica del agente de mercado."""
@@ -67,50 +69,36 @@ def test_market_agent(mock_llm, mock_search):
     assert market_agent.llm == mock_llm
     assert market_agent.search == mock_search
 
-    # Prueba de analyze_market_trends
-    mock_search.search.return_value = [{"snippet": "Tendencia del mercado"}]
-    mock_llm.generate_text.return_value = "Análisis de tendencias"
-    result = market_agent.analyze_market_trends("Ciudad de prueba")
-    assert "location" in result
-    assert "trend_summary" in result
-    assert "detailed_analysis" in result
-
-    # Prueba de evaluate_property_value
-    mock_search.search.return_value = [{"snippet": "Datos del mercado"}]
-    mock_llm.generate_text.return_value = "El valor estimado es $500,000"
-    result = market_agent.evaluate_property_value({"location": "123 Test St"})
-    assert result["estimated_value"] == 500000.0
-    assert "confidence" in result
-    assert "evaluation_summary" in result
+    mock_llm.generate_text.return_value = "- precio arriendo Providencia\n- valor m2 Providencia"
+    queries = market_agent.suggest_search_queries("¿Cuánto cuesta arrendar en Providencia?")
+    assert queries
+    assert all(isinstance(query, str) and query for query in queries)
 
 def test_initialize_agents(mock_settings):
     """Prueba la inicialización de agentes."""
-    with patch('src.main.OpenRouterLLM') as mock_llm, \
-         patch('src.main.SerperSearch') as mock_search:
-        legal_agent, market_agent = initialize_agents(mock_settings)
-        assert isinstance(legal_agent, LegalAgent)
-        assert isinstance(market_agent, MarketAgent)
-
-def test_process_mention(mock_llm, mock_search):
-    """Prueba el procesamiento de menciones."""
-    legal_agent = LegalAgent(mock_llm, mock_search)
-    market_agent = MarketAgent(mock_llm, mock_search)
-
-    # Prueba mención legal
-    mock_llm.generate_text.return_value = "Respuesta legal"
-    result = process_mention({"content": "Consulta legal"}, legal_agent, market_agent)
-    assert "Respuesta legal" in result
-
-    # Prueba mención de mercado
-    mock_llm.generate_text.return_value = "Respuesta de mercado"
-    result = process_mention({"content": "Consulta de mercado"}, legal_agent, market_agent)
-    assert "Respuesta de mercado" in result
-
-    # Prueba mención general
-    mock_llm.generate_text.side_effect = ["Respuesta legal", "Respuesta de mercado"]
-    result = process_mention({"content": "Consulta general"}, legal_agent, market_agent)
-    assert "Respuesta Legal:" in result
-    assert "Respuesta de Mercado:" in result
+    task_manager = initialize_agents(mock_settings)
+    assert isinstance(task_manager, TaskManager)
+    assert isinstance(task_manager.legal_agent, LegalAgent)
+    assert isinstance(task_manager.market_agent, MarketAgent)
+
+def test_process_mention(mock_settings):
+    """Prueba el procesamiento de menciones sin acceso a la red."""
+    task_manager = initialize_agents(mock_settings)
+    with patch.object(task_manager.llm, "generate_text", return_value="Respuesta sobre ley y precio de mercado"), \
+         patch.object(task_manager.search, "_request", side_effect=serper_reply):
+        result = process_mention({"comment_text": "@AI ¿Qué ley regula el arriendo y cuál es su precio?"},
+                                 task_manager)
+    assert result
+    assert DEGRADED_NOTICE not in result
+
+def test_process_mention_degraded(mock_settings):
+    """Si Serper falla, la respuesta se marca como degradada."""
+    task_manager = initialize_agents(mock_settings)
+    with patch.object(task_manager.llm, "generate_text", return_value="Respuesta sobre ley y precio de mercado"), \
+         patch.object(task_manager.search, "_request", side_effect=ConnectionError("sin red")):
+        result = process_mention({"comment_text": "@AI ¿Qué ley regula el arriendo y cuál es su precio?"},
+                                 task_manager)
+    assert result.endswith(DEGRADED_NOTICE)
 
 if __name__ == "__main__":
     pytest.main()
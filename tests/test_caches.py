@@ -0,0 +1,294 @@
+import threading
+import time
+
+from agents.answer_cache import AnswerCache, query_terms
+from integrations.llm_cache import LLMResponseCache
+from integrations.search_cache import SearchCache
+from integrations.serper import SerperSearch, degradation_scope
+from integrations.snippet_index import SnippetIndex
+from utils.context_packer import ContextPacker
+from utils.text import estimate_tokens
+
+def organic(*snippets: str) -> dict:
+    return {"organic": [{"title": f"Resultado {i}", "snippet": snippet, "link": f"https://example.com/{i}"}
+                        for i, snippet in enumerate(snippets)]}
+
+# Caché del LLM
+
+def test_llm_cache_key_ignores_field_order():
+    first = LLMResponseCache.make_key({"model": "m", "messages": [{"role": "user", "content": "hola"}]})
+    second = LLMResponseCache.make_key({"messages": [{"role": "user", "content": "hola"}], "model": "m"})
+    assert first == second
+    assert first != LLMResponseCache.make_key({"model": "otro", "messages": [{"role": "user", "content": "hola"}]})
+
+def test_llm_cache_expires_entries(tmp_path):
+    cache = LLMResponseCache(str(tmp_path), default_ttl=0.05)
+    cache.set("corta", "respuesta")
+    cache.set("larga", "respuesta", ttl=60)
+    assert cache.get("corta") == "respuesta"
+    time.sleep(0.1)
+    assert cache.get("corta") is None
+    assert cache.get("larga") == "respuesta"
+    assert cache.stats()["entries"] == 1
+
+def test_llm_cache_evicts_least_recently_used(tmp_path):
+    cache = LLMResponseCache(str(tmp_path), max_entries=2)
+    cache.set("a", "1")
+    time.sleep(0.01)
+    cache.set("b", "2")
+    time.sleep(0.01)
+    # Leer "a" la deja como la más reciente: se desaloja "b"
+    assert cache.get("a") == "1"
+    time.sleep(0.01)
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.stats()["evictions"] == 1
+    # Las respuestas persisten entre procesos
+    assert LLMResponseCache(str(tmp_path)).get("c") == "3"
+
+# Caché de búsquedas
+
+def test_search_cache_ttl_per_result_type():
+    cache = SearchCache(ttls={"search": 0.05, "news": 60})
+    calls = []
+
+    def fetch(payload):
+        return lambda: calls.append(payload) or organic(payload["q"])
+
+    organic_payload = {"q": "Arriendo  Providencia", "num": 10}
+    news_payload = {"q": "arriendo", "type": "news", "num": 10}
+    cache.get_or_fetch(organic_payload, fetch(organic_payload))
+    cache.get_or_fetch(news_payload, fetch(news_payload))
+    # La consulta normalizada comparte la entrada
+    cache.get_or_fetch({"q": "arriendo providencia", "num": 10}, fetch(organic_payload))
+    assert len(calls) == 2
+
+    time.sleep(0.1)
+    cache.get_or_fetch(organic_payload, fetch(organic_payload))
+    cache.get_or_fetch(news_payload, fetch(news_payload))
+    assert len(calls) == 3
+    # La entrada vencida sigue disponible como respaldo
+    assert cache.stale(organic_payload) is not None
+    assert cache.stats()["hits"] == 2
+
+def test_search_cache_coalesces_concurrent_fetches():
+    cache = SearchCache()
+    payload = {"q": "ley de arriendo", "num": 10}
+    calls = []
+    started = threading.Event()
+
+    def fetch():
+        calls.append(payload)
+        started.set()
+        time.sleep(0.1)
+        return organic("Ley 18.101")
+
+    results = []
+    owner = threading.Thread(target=lambda: results.append(cache.get_or_fetch(payload, fetch)))
+    owner.start()
+    started.wait()
+    waiters = [threading.Thread(target=lambda: results.append(cache.get_or_fetch(payload, fetch)))
+               for _ in range(3)]
+    for thread in waiters:
+        thread.start()
+    for thread in [owner] + waiters:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 4 and all(result == results[0] for result in results)
+    assert cache.stats()["coalesced"] == 3
+
+def test_search_cache_shares_errors_without_storing():
+    cache = SearchCache()
+    payload = {"q": "plusvalía", "num": 10}
+    started = threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise ConnectionError("sin red")
+
+    def call():
+        try:
+            cache.get_or_fetch(payload, failing)
+        except ConnectionError as e:
+            errors.append(e)
+
+    owner = threading.Thread(target=call)
+    owner.start()
+    started.wait()
+    call()
+    owner.join()
+    assert len(errors) == 2
+    # El error no queda en la caché: la siguiente consulta vuelve a pedirse
+    assert cache.get_or_fetch(payload, lambda: organic("Plusvalía")) == organic("Plusvalía")
+
+# Armado del contexto
+
+def test_packer_removes_duplicates_and_near_duplicates():
+    packer = ContextPacker(token_budget=0)
+    fragments = [
+        "El arriendo promedio en Providencia subió un 5% durante el último año.",
+        "El arriendo promedio en  Providencia subió un 5% durante el último año.",
+        "El arriendo promedio en Providencia subió un 5% durante el último año, según el informe.",
+        "La ley de arriendo exige un contrato escrito.",
+        "   "
+    ]
+    unique = packer.deduplicate(fragments)
+    assert len(unique) == 2
+    # De dos casi duplicados queda el más largo, en la posición del primero
+    assert unique[0].endswith("según el informe.")
+
+def test_packer_ranks_by_relevance_within_budget():
+    packer = ContextPacker(token_budget=0)
+    fragments = ["El clima de Santiago es templado.",
+                 "El precio del arriendo en Providencia es alto.",
+                 "Providencia tiene parques."]
+    packed = packer.pack("precio arriendo Providencia", fragments)
+    assert packed.text.split("\n")[0] == fragments[1]
+
+    budget = estimate_tokens(fragments[1])
+    limited = packer.pack("precio arriendo Providencia", fragments, budget=budget)
+    assert limited.text == fragments[1]
+    assert limited.dropped == 2
+    assert limited.tokens_out <= budget
+    assert packer.stats()["tokens_saved"] == limited.tokens_saved
+
+def test_packer_keep_order():
+    packer = ContextPacker(token_budget=0)
+    paragraphs = ["Primero: el contexto legal.", "Segundo: el precio de mercado."]
+    packed = packer.pack("precio de mercado", paragraphs, keep_order=True)
+    assert packed.text == "\n".join(paragraphs)
+
+# Índice de fragmentos
+
+def test_snippet_index_answers_covered_queries(tmp_path):
+    index = SnippetIndex(str(tmp_path), min_coverage=0.75)
+    payload = {"q": "precio arriendo Providencia", "gl": "cl", "num": 2}
+    assert index.lookup(payload) is None
+    assert index.add(payload, organic("Precio del arriendo en Providencia sube",
+                                      "Arriendos en Providencia: precio por m2",
+                                      "Clima en Valparaíso")) == 3
+
+    local = index.lookup(payload)
+    assert local is not None
+    assert len(local["organic"]) == 2
+    assert all("Providencia" in item["snippet"] for item in local["organic"])
+    # Más resultados de los que cubren la consulta: se consulta a Serper
+    assert index.lookup(dict(payload, num=3)) is None
+    assert index.stats()["hits"] == 1
+
+def test_snippet_index_respects_max_age_and_types(tmp_path):
+    index = SnippetIndex(str(tmp_path), max_age={"search": 0.05, "news": 0.05})
+    payload = {"q": "ley de arriendo", "num": 1}
+    index.add(payload, organic("La ley de arriendo exige contrato"))
+    assert index.lookup(payload) is not None
+    time.sleep(0.1)
+    assert index.lookup(payload) is None
+    # Solo se indexan resultados orgánicos y noticias
+    assert index.add({"q": "casas", "type": "places"}, {"places": [{"title": "Casa"}]}) == 0
+
+def test_snippet_index_replaces_same_link(tmp_path):
+    index = SnippetIndex(str(tmp_path))
+    payload = {"q": "plusvalía Ñuñoa", "num": 1}
+    index.add(payload, organic("Plusvalía en Ñuñoa de 3%"))
+    index.add(payload, organic("Plusvalía en Ñuñoa de 4%"))
+    assert index.stats()["documents"] == 1
+    assert index.search("plusvalía Ñuñoa")[0]["snippet"].endswith("4%")
+
+# Caché de respuestas
+
+def test_answer_cache_matches_paraphrases(tmp_path):
+    cache = AnswerCache(str(tmp_path), similarity=0.85)
+    cache.store("¿Cuál es el precio del m2 en Providencia?", "Unas 90 UF por m2.")
+    cache.store("¿Qué requisitos legales tiene arrendar un departamento?", "Contrato escrito.")
+
+    hit = cache.lookup("cuanto cuesta el metro cuadrado en providencia hoy")
+    assert hit is not None
+    assert hit.answer == "Unas 90 UF por m2."
+    assert cache.lookup("¿Cuál es el precio del m2 en Vitacura?") is None
+    assert cache.stats()["hits"] == 1
+
+def test_answer_cache_requires_same_numbers(tmp_path):
+    cache = AnswerCache(str(tmp_path), similarity=0.5)
+    cache.store("arriendo departamento 2 dormitorios Providencia", "Unos 600 mil pesos.")
+    assert cache.lookup("alquiler depto 2 dormitorios Providencia") is not None
+    assert cache.lookup("arriendo departamento 3 dormitorios Providencia") is None
+
+def test_answer_cache_expiry_and_invalidation(tmp_path):
+    cache = AnswerCache(str(tmp_path), ttl=0.05)
+    cache.store("precio m2 Providencia", "90 UF")
+    time.sleep(0.1)
+    assert cache.lookup("precio m2 Providencia") is None
+    assert cache.stats()["entries"] == 0
+
+    cache = AnswerCache(str(tmp_path))
+    cache.store("precio m2 Providencia", "90 UF")
+    cache.store("ley de arriendo", "Contrato escrito")
+    assert cache.invalidate("valor m2 providencia") == 1
+    assert cache.lookup("ley de arriendo") is not None
+    # Las respuestas persisten entre procesos
+    assert AnswerCache(str(tmp_path)).lookup("ley de arriendo").answer == "Contrato escrito"
+
+def test_query_terms_unify_synonyms():
+    assert query_terms("valor del depto") == query_terms("precio del departamento")
+
+# Búsquedas en lote
+
+def test_batch_coalesces_with_in_flight_queries():
+    """Una consulta del lote que ya está en curso en otro hilo no se repite."""
+    cache = SearchCache()
+    search = SerperSearch("test", cache=cache)
+    requests_sent = []
+    started = threading.Event()
+
+    def request(payload):
+        requests_sent.append(payload)
+        if not isinstance(payload, list):
+            started.set()
+            time.sleep(0.2)
+            return organic(f"Resultado de {payload['q']}")
+        return [organic(f"Resultado de {item['q']}") for item in payload]
+
+    search._request = request
+    single = threading.Thread(target=search.search, args=("arriendo",))
+    single.start()
+    started.wait()
+    results = search.batch([("arriendo", "search", 10), ("ley", "search", 10), ("ley", "search", 10)])
+    single.join()
+
+    assert [r[0]["snippet"] for r in results] == ["Resultado de arriendo", "Resultado de ley", "Resultado de ley"]
+    assert len(requests_sent) == 2
+    assert [item["q"] for item in requests_sent[1]] == ["ley"]
+    assert cache.stats()["coalesced"] == 2
+
+def test_batch_short_reply_uses_fallback():
+    search = SerperSearch("test", cache=SearchCache())
+    search._request = lambda payloads: [organic("Solo la primera")]
+    with degradation_scope() as degraded:
+        results = search.batch([("uno", "search", 10), ("dos", "search", 10)])
+    assert results[0][0]["snippet"] == "Solo la primera"
+    assert results[1] == []
+    assert degraded == ["dos"]
+    # La consulta sin respuesta no queda en la caché
+    assert search.cache.lookup({"q": "dos", "gl": "cl", "num": 10}) is None
+
+def test_index_errors_keep_serper_results():
+    class BrokenIndex:
+        def lookup(self, payload):
+            raise RuntimeError("base de datos bloqueada")
+
+        def add(self, payload, result):
+            raise RuntimeError("disco lleno")
+
+    search = SerperSearch("test", index=BrokenIndex())
+    search._request = lambda payload: ([organic("En lote") for _ in payload] if isinstance(payload, list)
+                                       else organic("Individual"))
+    with degradation_scope() as degraded:
+        assert search.search("arriendo")[0]["snippet"] == "Individual"
+        assert search.batch([("ley", "search", 5)])[0][0]["snippet"] == "En lote"
+    assert degraded == []
+    assert search.degraded == 0
@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from integrations.clickup_reply import WRITING_MARK, ProgressiveReply
+from integrations.clickup_webhook import (ClickUpWebhookServer, parse_comment_event, post_recorded_payload,
+                                          sign_payload, verify_signature)
+
+EVENT = {
+    "event": "taskCommentPosted",
+    "task_id": "abc123",
+    "history_items": [
+        {"date": "1700000000000", "user": {"id": 7, "username": "ana"},
+         "comment": {"id": "90", "text_content": "@AI ¿Qué ley regula el arriendo?"}},
+        {"date": "1700000000001", "comment": {"text_content": "sin id"}},
+    ]
+}
+
+# Webhook
+
+def test_verify_signature():
+    body = json.dumps(EVENT).encode("utf-8")
+    signature = sign_payload("secreto", body)
+    assert verify_signature("secreto", body, signature)
+    assert not verify_signature("otro", body, signature)
+    assert not verify_signature("secreto", body + b" ", signature)
+    assert not verify_signature("secreto", body, "")
+    assert not verify_signature("", body, signature)
+
+def test_parse_comment_event():
+    comments = parse_comment_event(EVENT)
+    assert comments == [("abc123", {
+        "id": "90",
+        "comment_text": "@AI ¿Qué ley regula el arriendo?",
+        "date_created": "1700000000000",
+        "user": {"id": 7, "username": "ana"}
+    })]
+    assert parse_comment_event(dict(EVENT, event="taskUpdated")) == []
+    assert parse_comment_event({"event": "taskCommentPosted"}) == []
+
+@pytest.fixture
+def webhook_server():
+    received = []
+    delivered = threading.Event()
+
+    def on_comment(task_id, comment):
+        received.append((task_id, comment))
+        delivered.set()
+
+    server = ClickUpWebhookServer("secreto", on_comment, host="127.0.0.1", port=0)
+    server.start()
+    yield server, received, delivered
+    server.stop()
+
+def test_webhook_server_delivers_signed_events(webhook_server, tmp_path):
+    server, received, delivered = webhook_server
+    event_path = tmp_path / "evento.json"
+    event_path.write_text(json.dumps(EVENT), encoding="utf-8")
+    url = f"http://127.0.0.1:{server.port}/clickup/webhook"
+
+    assert post_recorded_payload(url, str(event_path), "secreto") == 200
+    assert delivered.wait(5)
+    assert received[0][0] == "abc123"
+    assert received[0][1]["id"] == "90"
+
+def test_webhook_server_rejects_invalid_requests(webhook_server):
+    server, received, _ = webhook_server
+    body = json.dumps(EVENT).encode("utf-8")
+    base = f"http://127.0.0.1:{server.port}"
+    for path, signature, status in (("/clickup/webhook", "firma", 401), ("/otra", sign_payload("secreto", body), 404)):
+        request = Request(base + path, data=body, method="POST", headers={"X-Signature": signature})
+        with pytest.raises(HTTPError) as error:
+            urlopen(request)
+        assert error.value.code == status
+    assert received == []
+
+# Respuesta progresiva
+
+class FakeComments:
+    def __init__(self, fail_creates=0, fail_updates=False):
+        self.created = []
+        self.updated = []
+        self.fail_creates = fail_creates
+        self.fail_updates = fail_updates
+
+    def create_comment(self, task_id, text):
+        if self.fail_creates:
+            self.fail_creates -= 1
+            raise ConnectionError("sin red")
+        self.created.append((task_id, text))
+        return {"id": 500 + len(self.created)}
+
+    def update_comment(self, comment_id, text):
+        if self.fail_updates:
+            raise ConnectionError("sin red")
+        self.updated.append((comment_id, text))
+
+def test_progressive_reply_throttles_updates():
+    clickup = FakeComments()
+    reply = ProgressiveReply(clickup, "abc123", interval=0.05)
+    assert reply.start() == "501"
+    assert clickup.created == [("abc123", reply.placeholder)]
+    reply.update("Hola")
+    assert clickup.updated == []
+    time.sleep(0.06)
+    reply.update("Hola mundo")
+    reply.update("Hola mundo, ¿cómo")
+    assert clickup.updated == [("501", "Hola mundo" + WRITING_MARK)]
+    assert reply.finish("Hola mundo, ¿cómo estás?") == "501"
+    assert clickup.updated[-1] == ("501", "Hola mundo, ¿cómo estás?")
+    assert reply.updates == 1
+
+def test_progressive_reply_without_placeholder_posts_at_the_end():
+    clickup = FakeComments(fail_creates=1)
+    reply = ProgressiveReply(clickup, "abc123", interval=0)
+    assert reply.start() is None
+    reply.update("parcial")
+    assert clickup.updated == []
+    assert reply.finish("Respuesta completa") == "501"
+    assert clickup.created == [("abc123", "Respuesta completa")]
+
+def test_progressive_reply_ignores_update_errors():
+    clickup = FakeComments(fail_updates=True)
+    reply = ProgressiveReply(clickup, "abc123", interval=0)
+    reply.start()
+    reply.update("parcial")
+    reply.fail()
+    assert reply.updates == 0
+    with pytest.raises(ConnectionError):
+        reply.finish("Respuesta completa")
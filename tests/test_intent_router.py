@@ -0,0 +1,78 @@
+import json
+
+from agents.intent_router import (DEFAULT_MODEL, WEAK_EVIDENCE_CONFIDENCE, IntentRouter, features, read_decisions,
+                                  train)
+
+def test_features_count_lexicon_terms():
+    counts = features("¿Qué ley regula el contrato de arriendo?")
+    assert counts["lex:legal"] == 2
+    assert counts["lex:market"] == 1
+    assert "lex:market" not in features("herencia de una casa")
+
+def test_route_with_lexicon_evidence():
+    router = IntentRouter(min_confidence=0.6)
+    decision = router.route("¿Cuál es la ley de herencia y el valor de mercado de la casa?")
+    assert decision is not None
+    assert decision.needs == {"legal": True, "market": True, "general": True}
+    assert decision.confidence >= 0.6
+
+def test_single_domain_query_is_routed_locally():
+    """Sin términos de un experto pero con términos de otro, no se llama al primero."""
+    router = IntentRouter(min_confidence=0.6)
+    decision = router.route("precio m2 Providencia")
+    assert decision is not None
+    assert decision.evidence == {"legal": False, "market": True}
+    assert decision.needs == {"legal": False, "market": True, "general": True}
+    assert decision.confidence == WEAK_EVIDENCE_CONFIDENCE
+
+    decision = router.route("herencia de una casa")
+    assert decision.needs == {"legal": True, "market": False, "general": True}
+    # La falta de términos es evidencia débil: con más exigencia decide el LLM
+    assert IntentRouter(min_confidence=0.8).route("precio m2 Providencia") is None
+
+def test_query_without_evidence_falls_back_to_llm():
+    """Sin términos de ningún experto su probabilidad es solo el sesgo: decide el LLM."""
+    router = IntentRouter(min_confidence=0.6)
+    decision = router.classify("hola, ¿cómo están?")
+    assert decision.evidence == {"legal": False, "market": False}
+    assert decision.confidence == 0.0
+    assert router.route("hola, ¿cómo están?") is None
+    assert router.route("qué documentos necesito para comprar una casa") is not None
+    assert router.stats() == {"local": 1, "fallbacks": 1, "local_ratio": 0.5}
+
+def test_trained_weights_count_as_evidence():
+    model = {label: {"bias": params["bias"], "weights": dict(params["weights"])}
+             for label, params in DEFAULT_MODEL.items()}
+    model["legal"]["weights"]["w:document"] = 3.0
+    router = IntentRouter(min_confidence=0.5)
+    router.model = model
+    decision = router.classify("qué documentos necesito para comprar una casa")
+    assert decision.evidence["legal"]
+    assert decision.needs["legal"] and decision.needs["market"]
+
+def test_record_and_retrain(tmp_path):
+    log_path = str(tmp_path / "decisiones.jsonl")
+    router = IntentRouter(log_path=log_path)
+    examples = [
+        ("qué documentos necesito para comprar una casa", {"legal": True, "market": True}),
+        ("documentos para vender un departamento", {"legal": True, "market": True}),
+        ("cuánto rinde invertir en estacionamientos", {"legal": False, "market": True}),
+    ]
+    for query, needs in examples * 3:
+        router.record(query, needs, "llm")
+    router.record("hola", {"legal": False, "market": False}, "local")
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write('{"query": "incompleta"')
+
+    decisions = read_decisions(log_path)
+    assert len(decisions) == 3
+    model = train(decisions, epochs=60)
+    model_path = str(tmp_path / "modelo.json")
+    IntentRouter.save(model, model_path)
+    with open(model_path, "r", encoding="utf-8") as f:
+        assert set(json.load(f)["labels"]) == {"legal", "market"}
+
+    trained = IntentRouter(model_path)
+    for query, needs in examples:
+        decision = trained.classify(query)
+        assert {label: decision.needs[label] for label in needs} == needs
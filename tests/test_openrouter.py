@@ -0,0 +1,176 @@
+import json
+import time
+
+import pytest
+import requests
+
+from config.settings import Settings
+from integrations.circuit_breaker import OPEN, CircuitBreaker, CircuitOpenError
+from integrations.llm_cache import LLMResponseCache
+from integrations.openrouter import DEFAULT_MODEL, OpenRouterLLM, percentile
+from main import model_routes
+
+def test_percentile_nearest_rank():
+    samples = [float(value) for value in range(1, 21)]
+    assert percentile(samples, 0.50) == 10.0
+    assert percentile(samples, 0.95) == 19.0
+    assert percentile(samples, 0.99) == 20.0
+    # Con pocas muestras la cola no se confunde con la mediana
+    assert percentile([3.0, 1.0, 2.0], 0.50) == 2.0
+    assert percentile([3.0, 1.0, 2.0], 0.95) == 3.0
+    assert percentile([5.0], 0.0) == 5.0
+    assert percentile([], 0.95) == 0.0
+
+# Peticiones de respaldo
+
+def hedged_llm(latencies, failures=(), **kwargs):
+    """
+    Cliente con peticiones de respaldo cuyo _complete tarda latencies[modelo] segundos.
+    """
+    llm = OpenRouterLLM("test", hedge=True, hedge_default_delay=0.05, **kwargs)
+    models = []
+
+    def complete(url, data):
+        models.append(data["model"])
+        time.sleep(latencies[data["model"]])
+        if data["model"] in failures:
+            raise requests.exceptions.ConnectionError(f"falló {data['model']}")
+        return {"choices": [{"message": {"content": f"respuesta de {data['model']}"}}]}
+
+    llm._complete = complete
+    return llm, models
+
+def test_hedge_not_sent_for_fast_responses():
+    llm, models = hedged_llm({"principal": 0.01})
+    assert llm.generate_text("hola", model="principal") == "respuesta de principal"
+    assert models == ["principal"] and llm.hedges == 0
+
+def test_hedge_wins_when_primary_is_slow():
+    llm, models = hedged_llm({"principal": 0.5, "respaldo": 0.01}, hedge_model="respaldo")
+    start = time.monotonic()
+    assert llm.generate_text("hola", model="principal") == "respuesta de respaldo"
+    assert time.monotonic() - start < 0.4
+    assert models == ["principal", "respaldo"]
+    assert (llm.hedges, llm.hedge_wins) == (1, 1)
+
+def test_hedge_failure_waits_for_primary():
+    llm, _ = hedged_llm({"principal": 0.2, "respaldo": 0.01}, failures={"respaldo"}, hedge_model="respaldo")
+    assert llm.generate_text("hola", model="principal") == "respuesta de principal"
+    assert (llm.hedges, llm.hedge_wins) == (1, 0)
+
+    llm, _ = hedged_llm({"principal": 0.1, "respaldo": 0.01}, failures={"principal", "respaldo"},
+                        hedge_model="respaldo")
+    with pytest.raises(requests.exceptions.ConnectionError):
+        llm.generate_text("hola", model="principal")
+
+def test_hedge_delay_uses_recent_p95():
+    llm = OpenRouterLLM("test", hedge=True, hedge_min_delay=0.5, hedge_default_delay=20)
+    assert llm.hedge_delay("modelo") == 20
+    for latency in range(1, 21):
+        llm._record("modelo", None, float(latency), {})
+    assert llm.hedge_delay("modelo") == 19.0
+    llm._latencies["rapido"] = [0.1] * 30
+    assert llm.hedge_delay("rapido") == 0.5
+
+# Tabla de ruteo de modelos
+
+ROUTES = {
+    "default": {"model": "base", "temperature": 0.7},
+    "legal": {"model": "legal-model"},
+    "thought": {"model": "rapido", "max_tokens": 200},
+    "legal.thought": {"temperature": 0.2},
+    "synthesis": {"model": "fuerte"}
+}
+
+def test_route_merges_from_general_to_specific():
+    llm = OpenRouterLLM("test", routes=ROUTES)
+    assert llm.route(None) == {"model": "base", "temperature": 0.7}
+    assert llm.route("legal") == {"model": "legal-model", "temperature": 0.7}
+    assert llm.route("legal.answer") == {"model": "legal-model", "temperature": 0.7}
+    # El tipo de paso tiene prioridad sobre el agente y el paso exacto sobre ambos
+    assert llm.route("legal.thought") == {"model": "rapido", "temperature": 0.2, "max_tokens": 200}
+    assert llm.route("market.thought") == {"model": "rapido", "temperature": 0.7, "max_tokens": 200}
+    assert llm.route("coordinator.synthesis")["model"] == "fuerte"
+    assert OpenRouterLLM("test").route("legal.thought") == {"model": DEFAULT_MODEL}
+
+def test_request_data_uses_route_unless_overridden():
+    llm = OpenRouterLLM("test", routes=ROUTES)
+    data = llm._request_data("hola", None, "legal.thought", None, None)
+    assert (data["model"], data["max_tokens"], data["temperature"]) == ("rapido", 200, 0.2)
+    data = llm._request_data("hola", "otro", "legal.thought", 50, 0.0)
+    assert (data["model"], data["max_tokens"], data["temperature"]) == ("otro", 50, 0.0)
+    assert "max_tokens" not in llm._request_data("hola", None, "market.answer", None, None)
+
+def test_model_routes_apply_overrides():
+    settings = Settings()
+    settings.FAST_MODEL = "rapido"
+    settings.STRONG_MODEL = "fuerte"
+    settings.MODEL_ROUTES = '{"thought": {"max_tokens": 150}, "legal.synthesis": {"model": "legal-fuerte"}}'
+    routes = model_routes(settings)
+    assert routes["thought"] == {"model": "rapido", "max_tokens": 150}
+    assert routes["legal.synthesis"] == {"model": "legal-fuerte"}
+    llm = OpenRouterLLM("test", routes=routes)
+    assert llm.route("legal.synthesis")["model"] == "legal-fuerte"
+    assert llm.route("market.synthesis")["model"] == "fuerte"
+
+# Respuestas en streaming
+
+class FakeStream:
+    def __init__(self, lines, error=None):
+        self.lines = lines
+        self.error = error
+        self.closed = False
+
+    def iter_lines(self, chunk_size=None, decode_unicode=False):
+        yield from self.lines
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+def sse(*texts, usage=None):
+    lines = [": OPENROUTER PROCESSING", ""]
+    for text in texts:
+        lines.append("data: " + json.dumps({"choices": [{"delta": {"content": text}}]}))
+    if usage is not None:
+        lines.append("data: " + json.dumps({"choices": [], "usage": usage}))
+    return lines + ["data: [DONE]", "data: " + json.dumps({"choices": [{"delta": {"content": "ignorado"}}]})]
+
+def test_stream_text_parses_sse_events(tmp_path):
+    llm = OpenRouterLLM("test", cache=LLMResponseCache(str(tmp_path)))
+    stream = FakeStream(sse("Hola", "", " mundo", "ñ", usage={"prompt_tokens": 5, "completion_tokens": 3}))
+    llm._open_stream = lambda url, data: stream
+    assert list(llm.stream_text("saludo")) == ["Hola", " mundo", "ñ"]
+    assert stream.closed
+    assert llm.model_stats()[DEFAULT_MODEL]["completion_tokens"] == 3
+    # La respuesta completa queda en caché y se entrega de una vez
+    llm._open_stream = None
+    assert list(llm.stream_text("saludo")) == ["Hola mundoñ"]
+
+def test_stream_failures_count_for_breaker():
+    breaker = CircuitBreaker("OpenRouter", failure_threshold=2, reset_timeout=60)
+    llm = OpenRouterLLM("test", breaker=breaker)
+    failures = [FakeStream(sse("Hola")[:3], error=requests.exceptions.ChunkedEncodingError("conexión cortada")),
+                FakeStream(['data: {"error": {"code": 502, "message": "proveedor caído"}}'])]
+    llm._open_stream = lambda url, data: failures.pop(0)
+    for _ in range(2):
+        with pytest.raises((requests.exceptions.RequestException, ValueError)):
+            list(llm.stream_text("hola"))
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        list(llm.stream_text("hola"))
+
+def test_stream_counts_as_success_only_when_complete():
+    breaker = CircuitBreaker("OpenRouter", failure_threshold=2, reset_timeout=60)
+    breaker._consecutive = 1
+    llm = OpenRouterLLM("test", breaker=breaker)
+    llm._open_stream = lambda url, data: FakeStream(sse("Hola", " mundo"))
+    stream = llm.stream_text("hola")
+    assert next(stream) == "Hola"
+    assert breaker._consecutive == 1
+    # Cerrar el generador antes de terminar no dice nada del proveedor
+    stream.close()
+    assert breaker._consecutive == 1 and not breaker._probing
+    assert "".join(llm.stream_text("hola")) == "Hola mundo"
+    assert breaker._consecutive == 0
@@ -0,0 +1,244 @@
+import json
+import logging
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+from agents.legal import LegalAgent
+from agents.market import MarketAgent
+from agents.pipeline import Step, StepScheduler
+from agents.task_manager import TaskManager
+from agents.thoughts import ThoughtWriter
+from integrations.openrouter import OpenRouterLLM
+from integrations.serper import SerperSearch
+from utils.deadline import Deadline, DeadlineExceeded, deadline_scope
+from utils.helpers import muted_conversation
+
+@pytest.fixture
+def task_manager():
+    llm = MagicMock(spec=OpenRouterLLM)
+    llm.route.return_value = {}
+    search = MagicMock(spec=SerperSearch)
+    return TaskManager(llm, search, LegalAgent(llm, search), MarketAgent(llm, search), pipeline_mode="lean")
+
+# Plan estructurado del modo "lean"
+
+def test_parse_plan_reads_json_inside_text(task_manager):
+    plan = {
+        "legal": True,
+        "market": False,
+        "legal_searches": [" ley de arriendo ", "", 3, "requisitos contrato arriendo"],
+        "thoughts": {"coordinador": ["Es una consulta legal", None], "legal": "no es lista"}
+    }
+    raw = f"Aquí está el plan:\n```json\n{json.dumps(plan)}\n```"
+    parsed = task_manager.parse_plan(raw, "¿Qué dice la ley de arriendo?")
+    assert parsed["legal"] and not parsed["market"]
+    assert parsed["legal_searches"] == ["ley de arriendo", "requisitos contrato arriendo"]
+    # Sin búsquedas del experto se usa la consulta original
+    assert parsed["market_searches"] == ["¿Qué dice la ley de arriendo?"]
+    assert parsed["thoughts"] == {"coordinador": ["Es una consulta legal"], "legal": [], "mercado": []}
+
+def test_parse_plan_limits_searches(task_manager):
+    raw = json.dumps({"legal": False, "market": True, "market_searches": [f"búsqueda {i}" for i in range(8)]})
+    assert len(task_manager.parse_plan(raw, "precio")["market_searches"]) == 5
+
+def test_parse_plan_invalid_json_uses_keywords(task_manager):
+    query = "¿Cuál es la ley y el precio de un departamento?"
+    for raw in ("No puedo responder en JSON", "{legal: sí}"):
+        parsed = task_manager.parse_plan(raw, query)
+        assert parsed["legal"] and parsed["market"]
+        assert parsed["legal_searches"] == parsed["market_searches"] == [query]
+        assert parsed["thoughts"] == {"coordinador": [], "legal": [], "mercado": []}
+    assert not task_manager.parse_plan("", "hola")["legal"]
+
+# Síntesis en streaming
+
+def failing_stream(*chunks, error):
+    def stream(prompt, **kwargs):
+        yield from chunks
+        raise error
+    return stream
+
+def test_synthesis_stream_falls_back_on_provider_failure(task_manager):
+    llm = task_manager.llm
+    llm.hedge_model = "respaldo"
+    llm.stream_text.side_effect = failing_stream("Respuesta ", "parcial",
+                                                 error=requests.exceptions.ChunkedEncodingError("conexión cortada"))
+    llm.generate_text.return_value = "Respuesta completa"
+    progress = []
+    assert task_manager.synthesize("consulta", ["legal", "mercado"], progress.append) == "Respuesta completa"
+    # El texto completo reemplaza al parcial
+    assert progress == ["Respuesta ", "Respuesta parcial", "Respuesta completa"]
+    assert llm.generate_text.call_args.kwargs["model"] == "respaldo"
+
+def test_synthesis_stream_propagates_other_errors(task_manager):
+    llm = task_manager.llm
+    llm.hedge_model = None
+    llm.stream_text.side_effect = failing_stream("Respuesta", error=DeadlineExceeded("Plazo agotado"))
+    with pytest.raises(DeadlineExceeded):
+        task_manager.synthesize("consulta", ["legal"], lambda text: None)
+    llm.generate_text.assert_not_called()
+
+# Planificador de pasos
+
+def test_scheduler_runs_steps_when_inputs_are_ready():
+    order = []
+
+    def step(name):
+        def run(*args):
+            order.append(name)
+            time.sleep(0.05)
+            return (name, args)
+        return run
+
+    steps = [
+        Step("sintesis", step("sintesis"), inputs=["legal", "mercado"]),
+        Step("legal", step("legal"), inputs=["consulta"], provider="llm"),
+        Step("mercado", step("mercado"), inputs=["consulta"], provider="llm"),
+    ]
+    scheduler = StepScheduler()
+    results = scheduler.run(steps, {"consulta": "arriendo"})
+    assert order[-1] == "sintesis"
+    assert set(order[:2]) == {"legal", "mercado"}
+    assert results["legal"] == ("legal", ("arriendo",))
+    assert results["sintesis"] == ("sintesis", (results["legal"], results["mercado"]))
+    # Los expertos se ejecutan en paralelo
+    assert scheduler.timings["mercado"][0] < scheduler.timings["legal"][1]
+
+def test_scheduler_respects_provider_limits():
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def search():
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+
+    steps = [Step(f"busqueda{i}", search, provider="search") for i in range(4)]
+    StepScheduler({"search": 2}).run(steps, {})
+    assert peak[0] == 2
+
+def test_scheduler_skips_steps_and_their_dependents():
+    steps = [
+        Step("legal", lambda q: "ley", inputs=["consulta"], when=lambda r: "ley" in r["consulta"]),
+        Step("resumen_legal", lambda legal: legal.upper(), inputs=["legal"]),
+        Step("sintesis", lambda legal: legal or "sin legal", inputs=["legal"], accepts_skipped=True),
+    ]
+    scheduler = StepScheduler()
+    results = scheduler.run(steps, {"consulta": "precio de casas"})
+    assert scheduler.skipped == {"legal", "resumen_legal"}
+    assert results["legal"] is None and results["resumen_legal"] is None
+    assert results["sintesis"] == "sin legal"
+
+def test_scheduler_rejects_invalid_graphs():
+    with pytest.raises(ValueError):
+        StepScheduler().run([Step("a", lambda x: x, inputs=["desconocido"])], {})
+    with pytest.raises(ValueError):
+        StepScheduler().run([Step("consulta", lambda: None)], {"consulta": "hola"})
+
+def test_critical_path_follows_slowest_chain():
+    def sleep(seconds):
+        return lambda *args: time.sleep(seconds)
+
+    steps = [
+        Step("plan", sleep(0.01)),
+        Step("rapido", sleep(0.01), after=["plan"]),
+        Step("lento", sleep(0.1), after=["plan"]),
+        Step("sintesis", sleep(0.01), after=["rapido", "lento"]),
+    ]
+    scheduler = StepScheduler()
+    scheduler.run(steps, {})
+    assert scheduler.critical_path() == ["plan", "lento", "sintesis"]
+    assert scheduler.report().startswith("Camino crítico")
+    assert StepScheduler().critical_path() == []
+
+# Pensamientos en segundo plano
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+@pytest.fixture
+def thought_logger():
+    logger = logging.getLogger("tests.thoughts")
+    logger.setLevel(logging.INFO)
+    handler = ListHandler()
+    logger.addHandler(handler)
+    yield logger, handler.messages
+    logger.removeHandler(handler)
+
+def slow_llm(delay: float = 0.1):
+    llm = MagicMock(spec=OpenRouterLLM)
+    llm.generate_text.side_effect = lambda prompt, **kwargs: time.sleep(delay) or f"Pienso en {prompt}"
+    return llm
+
+def test_thoughts_inline_without_workers(thought_logger):
+    logger, messages = thought_logger
+    llm = slow_llm(0)
+    writer = ThoughtWriter(llm)
+    writer.think(logger, "Experto Legal", "la ley")
+    assert not writer.background
+    assert len(messages) == 1 and "Pienso en la ley" in messages[0]
+    assert llm.generate_text.call_args.kwargs["step"] == "legal.thought"
+
+def test_thoughts_are_deferred_until_drain(thought_logger):
+    logger, messages = thought_logger
+    writer = ThoughtWriter(slow_llm(), workers=2)
+    start = time.perf_counter()
+    writer.think(logger, "Coordinador", "la consulta")
+    writer.think(logger, "Analista de Mercado", "el precio")
+    # think no espera al LLM
+    assert time.perf_counter() - start < 0.05
+    assert messages == []
+    # Los pasos encolados mientras se espera también se drenan
+    writer.defer(writer.think, logger, "Coordinador", "la síntesis")
+    assert writer.drain()
+    assert len(messages) == 3
+    assert writer.drain(timeout=0)
+
+def test_drain_timeout(thought_logger):
+    logger, _ = thought_logger
+    writer = ThoughtWriter(slow_llm(0.3), workers=1)
+    writer.think(logger, "Coordinador", "la consulta")
+    assert not writer.drain(timeout=0.05)
+    assert writer.drain()
+
+def test_thoughts_skipped_when_muted_or_out_of_time(thought_logger):
+    logger, messages = thought_logger
+    llm = slow_llm(0)
+    writer = ThoughtWriter(llm, workers=1, reserve=5)
+    optional = MagicMock()
+    with muted_conversation():
+        writer.think(logger, "Coordinador", "la consulta")
+        writer.defer_optional(optional)
+    with deadline_scope(Deadline(1)):
+        writer.think(logger, "Coordinador", "la consulta")
+        writer.defer_optional(optional)
+    assert writer.drain()
+    assert llm.generate_text.call_count == 0 and optional.call_count == 0
+    assert writer.skipped == 2
+    assert messages == []
+
+    with deadline_scope(Deadline(60)):
+        writer.defer_optional(optional, "reflexión")
+    assert writer.drain()
+    optional.assert_called_once_with("reflexión")
+
+def test_background_errors_do_not_propagate(thought_logger):
+    logger, messages = thought_logger
+    llm = MagicMock(spec=OpenRouterLLM)
+    llm.generate_text.side_effect = RuntimeError("sin modelo")
+    writer = ThoughtWriter(llm, workers=1)
+    writer.think(logger, "Coordinador", "la consulta")
+    assert writer.drain()
+    assert messages == []
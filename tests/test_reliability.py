@@ -0,0 +1,463 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+from config.settings import Settings
+from integrations.cassette import RECORD, REPLAY, Cassette, CassetteMissError
+from integrations.circuit_breaker import CLOSED, OPEN, CircuitBreaker, CircuitOpenError
+from integrations.clickup_watcher import REJECTED, ClickUpListWatcher
+from integrations.rate_limit import RetryPolicy, TokenBucket, add_wait, waited_seconds
+from integrations.search_cache import SearchCache
+from integrations.serper import SerperSearch, degradation_scope
+from integrations.transport import HTTPTransport
+import main
+from main import answer_mention, make_comment_handler
+from utils.deadline import Deadline, DeadlineExceeded, budget_allows, deadline_scope, remaining_time, submit_in_context
+from utils.helpers import conversation_scope, log_agent_thought
+from utils.ledger import MentionLedger
+
+def make_response(status: int, body: str = "{}", headers: dict = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.reason = "OK" if status < 400 else "Error"
+    response.headers = CaseInsensitiveDict(headers or {"Content-Type": "application/json"})
+    response._content = body.encode("utf-8")
+    return response
+
+def http_error(status: int) -> requests.exceptions.HTTPError:
+    return requests.exceptions.HTTPError(f"HTTP {status}", response=make_response(status))
+
+class FakeClickUp:
+    """ClickUp en memoria: una lista de tareas con sus comentarios."""
+    def __init__(self, comments: dict):
+        self.comments = comments
+        self.created = []
+
+    def get_tasks(self, list_id, page=0):
+        return [{"id": task_id} for task_id in self.comments] if page == 0 else []
+
+    def get_comments(self, task_id, start=None, start_id=None):
+        return [] if start else list(self.comments[task_id])
+
+    def create_comment(self, task_id, text):
+        self.created.append((task_id, text))
+        return {"id": f"respuesta-{len(self.created)}"}
+
+# Registro de menciones y cola llena
+
+def test_ledger_release_restores_claim(tmp_path):
+    """Liberar una mención no cuenta como intento y permite reclamarla otra vez."""
+    ledger = MentionLedger(str(tmp_path / "mentions.json"), max_attempts=1)
+    assert ledger.claim("c1", "t1")
+    ledger.release("c1")
+    assert ledger.get("c1") is None
+    assert ledger.claim("c1", "t1")
+    assert ledger.get("c1")["attempts"] == 1
+
+def test_ledger_release_keeps_previous_failure(tmp_path):
+    """Al liberar el reintento de una mención fallida vuelve su estado anterior."""
+    ledger = MentionLedger(str(tmp_path / "mentions.json"), max_attempts=3)
+    assert ledger.claim("c1", "t1")
+    ledger.mark_failed("c1", "error")
+    assert ledger.claim("c1", "t1")
+    ledger.release("c1")
+    entry = ledger.get("c1")
+    assert entry["status"] == "failed"
+    assert entry["attempts"] == 1
+    # El estado liberado también queda en disco
+    assert MentionLedger(str(tmp_path / "mentions.json")).get("c1")["attempts"] == 1
+
+def test_full_queue_rejects_without_spending_attempts(tmp_path):
+    """Con la cola llena la mención se rechaza, sin marcarla como fallida."""
+    settings = Settings()
+    settings.CACHE_DIR = str(tmp_path)
+    settings.MENTION_QUEUE_DEPTH = 0
+    settings.MENTION_QUEUE_POLICY = "reject"
+    settings.MENTION_MAX_ATTEMPTS = 1
+    handle_comment = make_comment_handler(FakeClickUp({}), None, settings)
+    comment = {"id": "c1", "comment_text": "@AI consulta", "date": 1}
+
+    for _ in range(3):
+        assert handle_comment("t1", comment) == REJECTED
+    ledger = MentionLedger(str(tmp_path / "mentions.json"))
+    assert ledger.get("c1") is None
+    assert handle_comment("t1", {"id": "c2", "comment_text": "sin mención"}) is False
+
+def test_watcher_keeps_cursor_on_rejection(tmp_path):
+    """Si on_comment rechaza un comentario, la marca de agua no avanza hasta él."""
+    comments = {"t1": [{"id": "c1", "date": 1, "comment_text": "inicio"}]}
+    clickup = FakeClickUp(comments)
+    delivered = []
+    results = {"c2": True, "c3": REJECTED}
+
+    def on_comment(task_id, comment):
+        delivered.append(comment["id"])
+        return results[comment["id"]]
+
+    watcher = ClickUpListWatcher(clickup, "lista", on_comment, str(tmp_path / "cursors.json"),
+                                 requests_per_minute=1e6, min_interval=0)
+    watcher.poll_next()
+    assert watcher.cursors.get("t1")["id"] == "c1"
+
+    comments["t1"] = [{"id": "c3", "date": 3}, {"id": "c2", "date": 2}] + comments["t1"]
+    watcher._schedule = [(0, "t1")]
+    watcher.poll_next()
+    assert delivered == ["c2", "c3"]
+    assert watcher.cursors.get("t1")["id"] == "c2"
+
+    results["c3"] = True
+    watcher._schedule = [(0, "t1")]
+    watcher.poll_next()
+    assert delivered == ["c2", "c3", "c3"]
+    assert watcher.cursors.get("t1")["id"] == "c3"
+
+def test_watcher_delivers_first_comment_of_empty_task(tmp_path):
+    """La primera mención de una tarea sin comentarios se entrega en la consulta siguiente."""
+    comments = {"t1": []}
+    delivered = []
+    watcher = ClickUpListWatcher(FakeClickUp(comments), "lista",
+                                 lambda task_id, comment: delivered.append(comment["id"]) or True,
+                                 str(tmp_path / "cursors.json"), requests_per_minute=1e6, min_interval=0)
+    watcher.poll_next()
+    assert watcher.cursors.get("t1")["id"] is None
+
+    comments["t1"] = [{"id": "c1", "date": int(time.time() * 1000) + 1000, "comment_text": "@AI consulta"}]
+    watcher._schedule = [(0, "t1")]
+    watcher.poll_next()
+    assert delivered == ["c1"]
+    assert watcher.cursors.get("t1")["id"] == "c1"
+
+def test_watcher_keeps_tasks_when_refresh_is_empty(tmp_path):
+    comments = {"t1": [], "t2": []}
+    watcher = ClickUpListWatcher(FakeClickUp(comments), "lista", lambda *args: True,
+                                 str(tmp_path / "cursors.json"), requests_per_minute=1e6)
+    watcher.refresh_tasks()
+    comments.clear()
+    watcher.refresh_tasks()
+    assert watcher.task_ids == ["t1", "t2"]
+
+# Conversaciones por mención
+
+def test_parallel_mentions_keep_separate_conversations(tmp_path):
+    logger = logging.getLogger("prueba")
+    barrier = threading.Barrier(2)
+
+    def mention(name):
+        with conversation_scope(str(tmp_path / name / "conversation.md")):
+            for step in range(3):
+                barrier.wait()
+                log_agent_thought(logger, "Coordinador", f"Pensamiento {step} de {name}")
+
+    threads = [threading.Thread(target=mention, args=(name,)) for name in ("cliente-a", "cliente-b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for name, other in (("cliente-a", "cliente-b"), ("cliente-b", "cliente-a")):
+        text = (tmp_path / name / "conversation.md").read_text(encoding="utf-8")
+        assert text.count(f"de {name}") == 3
+        assert other not in text
+
+def test_answer_mention_uploads_its_own_conversation(tmp_path, monkeypatch):
+    settings = Settings()
+    settings.CACHE_DIR = str(tmp_path)
+    settings.STREAM_REPLIES = False
+    uploads = []
+
+    class Uploads(FakeClickUp):
+        def upload_attachment(self, task_id, path):
+            uploads.append((os.path.basename(path), open(path, encoding="utf-8").read()))
+
+    class Manager:
+        thoughts = type("Thoughts", (), {"background": False})()
+
+    def process(comment, task_manager, deadline, on_progress=None, usage=None):
+        log_agent_thought(logging.getLogger("prueba"), "Coordinador", f"Analizando {comment['comment_text']}")
+        return "Respuesta"
+
+    monkeypatch.setattr(main, "process_mention", process)
+    answer_mention(Uploads({}), Manager(), settings, "t1", {"id": "c1", "comment_text": "consulta de t1"})
+    assert uploads[0][0] == "conversation.md"
+    assert "Analizando consulta de t1" in uploads[0][1]
+    assert not os.path.exists(tmp_path / "conversations" / "c1")
+
+# Interruptor de circuito
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("prueba", failure_threshold=2, reset_timeout=60)
+
+    def fail():
+        raise requests.exceptions.ConnectionError("caído")
+
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            breaker.call(fail)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "no se llama")
+    assert breaker.stats()["rejected"] == 1
+
+def test_breaker_probe_closes_circuit():
+    breaker = CircuitBreaker("prueba", failure_threshold=1, reset_timeout=0)
+    with pytest.raises(requests.exceptions.HTTPError):
+        breaker.call(lambda: (_ for _ in ()).throw(http_error(503)))
+    assert breaker.state == OPEN
+    assert breaker.available
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
+
+def test_breaker_ignores_client_errors():
+    """Un 4xx distinto de 429 es un error de la petición, no del proveedor."""
+    breaker = CircuitBreaker("prueba", failure_threshold=1)
+    with pytest.raises(requests.exceptions.HTTPError):
+        breaker.call(lambda: (_ for _ in ()).throw(http_error(404)))
+    assert breaker.state == CLOSED
+    with pytest.raises(requests.exceptions.HTTPError):
+        breaker.call(lambda: (_ for _ in ()).throw(http_error(429)))
+    assert breaker.state == OPEN
+
+def test_breaker_slow_call_excludes_waits():
+    """Las esperas del limitador y entre reintentos no cuentan como lentitud del proveedor."""
+    breaker = CircuitBreaker("prueba", failure_threshold=1, slow_call_threshold=0.05)
+
+    def throttled():
+        time.sleep(0.1)
+        add_wait(0.1)
+        return "ok"
+
+    assert breaker.call(throttled) == "ok"
+    assert breaker.state == CLOSED
+    breaker.call(lambda: time.sleep(0.1))
+    assert breaker.state == OPEN
+
+# Política de reintentos
+
+def test_retry_policy_clamps_retry_after():
+    policy = RetryPolicy(max_retries=3, base_delay=1.0, max_delay=5.0)
+    assert policy.delay(0, make_response(429, headers={"Retry-After": "2"})) == 2.0
+    assert policy.delay(0, make_response(429, headers={"Retry-After": "3600"})) == 5.0
+
+def test_retry_policy_backoff_is_bounded():
+    policy = RetryPolicy(max_retries=10, base_delay=1.0, max_delay=4.0)
+    for attempt in range(10):
+        delay = policy.delay(attempt, make_response(503))
+        assert 0 <= delay <= min(4.0, 2 ** attempt)
+
+def test_retry_policy_should_retry():
+    policy = RetryPolicy(max_retries=2)
+    # Un POST no idempotente solo se reintenta si el proveedor no procesó la petición
+    assert policy.should_retry(0, make_response(429), idempotent=False)
+    assert policy.should_retry(0, make_response(503), idempotent=False)
+    assert not policy.should_retry(0, make_response(500), idempotent=False)
+    assert policy.should_retry(0, make_response(500), idempotent=True)
+    assert not policy.should_retry(0, None, idempotent=False)
+    assert policy.should_retry(1, None, idempotent=True)
+    assert not policy.should_retry(2, make_response(503), idempotent=True)
+
+# Transporte HTTP y limitador
+
+def scripted_transport(outcomes, limits=None, max_retries=2):
+    """
+    Transporte cuya sesión responde con outcomes en orden (respuestas o excepciones).
+    """
+    transport = HTTPTransport(limits=limits, retry=RetryPolicy(max_retries, base_delay=0.01, max_delay=0.01))
+    calls = []
+
+    def request(method, url, **kwargs):
+        calls.append((method, url, kwargs))
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    transport.session.request = request
+    return transport, calls
+
+def test_transport_retries_transient_failures():
+    transport, calls = scripted_transport([make_response(503), requests.exceptions.ConnectionError("reset"),
+                                           make_response(200)])
+    waited = waited_seconds()
+    assert transport.get("https://api.clickup.com/api/v2/task/1").status_code == 200
+    assert len(calls) == 3
+    assert calls[0][2]["timeout"] == transport.timeout
+    assert transport.stats()["api.clickup.com"]["retries"] == 2
+    # Las esperas entre reintentos no se atribuyen al proveedor
+    assert waited_seconds() > waited
+
+def test_transport_post_retries_only_unprocessed():
+    transport, calls = scripted_transport([make_response(500)])
+    assert transport.post("https://openrouter.ai/api/v1/chat/completions").status_code == 500
+    assert len(calls) == 1
+
+    transport, calls = scripted_transport([make_response(429), make_response(200)])
+    assert transport.post("https://openrouter.ai/api/v1/chat/completions").status_code == 200
+    assert len(calls) == 2
+
+    transport, calls = scripted_transport([requests.exceptions.ConnectionError("reset")])
+    with pytest.raises(requests.exceptions.ConnectionError):
+        transport.post("https://google.serper.dev/search")
+    transport, calls = scripted_transport([requests.exceptions.Timeout("lento"), make_response(200)])
+    assert transport.post("https://google.serper.dev/search", idempotent=True).status_code == 200
+
+def test_transport_gives_up_after_max_retries():
+    transport, calls = scripted_transport([make_response(502)] * 3, max_retries=2)
+    assert transport.get("https://api.clickup.com/api/v2/task/1").status_code == 502
+    assert len(calls) == 3
+
+def test_transport_429_pauses_host_bucket():
+    bucket = TokenBucket(rate=1000, capacity=10)
+    transport, calls = scripted_transport([make_response(429, headers={"Retry-After": "0.2"}), make_response(200)],
+                                          limits={"api.clickup.com": bucket}, max_retries=1)
+    transport.retry.max_delay = 0.2
+    request = threading.Thread(target=transport.get, args=("https://api.clickup.com/api/v2/task/1",))
+    request.start()
+    time.sleep(0.05)
+    # El 429 frena también a los demás hilos que usan el host
+    assert bucket.acquire() >= 0.1
+    request.join()
+    assert len(calls) == 2
+
+def test_token_bucket_allows_burst_then_waits():
+    bucket = TokenBucket(rate=20, capacity=3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    waited = bucket.acquire()
+    assert 0.02 <= waited <= 0.2
+
+def test_token_bucket_is_shared_between_threads():
+    bucket = TokenBucket(rate=50, capacity=1)
+    start = time.monotonic()
+    threads = [threading.Thread(target=bucket.acquire) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Una ficha inicial y cinco repuestas a 50 por segundo
+    assert time.monotonic() - start >= 0.08
+
+def test_token_bucket_pause():
+    bucket = TokenBucket(rate=1000, capacity=5)
+    bucket.pause(0.1)
+    assert bucket.acquire() >= 0.09
+
+# Plazo de la mención
+
+def test_deadline_scope_reaches_worker_threads():
+    assert budget_allows(3600) and remaining_time() is None
+    executor = ThreadPoolExecutor(max_workers=1)
+    with deadline_scope(Deadline(10)):
+        assert budget_allows(5) and not budget_allows(20)
+        remaining = submit_in_context(executor, remaining_time).result()
+        assert 0 < remaining <= 10
+        # executor.submit no copia el contexto
+        assert executor.submit(remaining_time).result() is None
+    executor.shutdown()
+
+def test_transport_bounds_timeouts_to_deadline():
+    deadline = Deadline(2)
+    connect, read = HTTPTransport._bounded((5.0, 120.0), deadline)
+    assert connect <= 2 and read <= 2
+    assert HTTPTransport._bounded((0.5, None), deadline)[0] == 0.5
+    assert HTTPTransport._bounded((0.5, None), deadline)[1] <= 2
+    assert HTTPTransport._bounded(30.0, deadline) <= 2
+    assert HTTPTransport._bounded(30.0, None) == 30.0
+    assert HTTPTransport._bounded(30.0, Deadline(-1)) == 0.001
+
+    transport, calls = scripted_transport([make_response(200)])
+    with deadline_scope(Deadline(1)):
+        transport.get("https://api.clickup.com/api/v2/task/1")
+    assert calls[0][2]["timeout"][1] <= 1
+
+def test_transport_stops_at_deadline():
+    transport, calls = scripted_transport([make_response(200)])
+    with deadline_scope(Deadline(0)):
+        with pytest.raises(DeadlineExceeded):
+            transport.get("https://api.clickup.com/api/v2/task/1")
+    assert calls == []
+
+    # Un reintento que no alcanza a terminar dentro del plazo no se intenta
+    transport, calls = scripted_transport([make_response(503, headers={"Retry-After": "5"}), make_response(200)])
+    transport.retry.max_delay = 5
+    with deadline_scope(Deadline(1)):
+        assert transport.get("https://api.clickup.com/api/v2/task/1").status_code == 503
+    assert len(calls) == 1
+
+    # Un timeout causado por el plazo se informa como plazo agotado, sin reintentar
+    transport, calls = scripted_transport([])
+
+    def slow_request(method, url, **kwargs):
+        calls.append(kwargs["timeout"])
+        time.sleep(kwargs["timeout"][1])
+        raise requests.exceptions.ReadTimeout("lento")
+
+    transport.session.request = slow_request
+    with deadline_scope(Deadline(0.05)):
+        with pytest.raises(DeadlineExceeded):
+            transport.get("https://api.clickup.com/api/v2/task/1")
+    assert len(calls) == 1
+
+def expired_request(payload):
+    raise DeadlineExceeded("Plazo agotado esperando a google.serper.dev")
+
+def test_serper_propagates_expired_deadline():
+    search = SerperSearch("test", cache=SearchCache())
+    search._request = expired_request
+    with deadline_scope(Deadline(0)), degradation_scope() as degraded:
+        with pytest.raises(DeadlineExceeded):
+            search.search("arriendo")
+        with pytest.raises(DeadlineExceeded):
+            search.batch([("ley", "search", 10), ("precio", "news", 5)])
+    # No se responde con el reemplazo ni queda nada en curso en la caché
+    assert degraded == [] and search.degraded == 0
+    assert search.cache._in_flight == {}
+
+def test_serper_falls_back_on_deadline_of_another_mention():
+    """Una consulta compartida que venció por el plazo de otra mención usa el reemplazo."""
+    search = SerperSearch("test", cache=SearchCache())
+    search._request = expired_request
+    with deadline_scope(Deadline(60)), degradation_scope() as degraded:
+        assert search.search("arriendo") == []
+    assert degraded == ["arriendo"]
+
+# Cassette
+
+def test_cassette_record_and_replay(tmp_path):
+    path = str(tmp_path / "cassette.jsonl.gz")
+    recorder = Cassette(path, RECORD)
+    kwargs = {"json": {"q": "arriendo"}, "headers": {"X-API-KEY": "secreta"}}
+    recorder.record("POST", "https://google.serper.dev/search", kwargs,
+                    make_response(200, '{"organic": [1]}'), 0.5)
+    recorder.record("POST", "https://google.serper.dev/search", kwargs,
+                    make_response(200, '{"organic": [2]}'), 0.5)
+    recorder.record("GET", "https://api.clickup.com/api/v2/task/1", {},
+                    make_response(429, "{}", {"Retry-After": "7", "X-Otro": "no se guarda"}), 0.1)
+    recorder.close()
+
+    player = Cassette(path, REPLAY)
+    # Los encabezados de la petición (claves de API) no forman parte de la clave
+    replay_kwargs = {"json": {"q": "arriendo"}, "headers": {"X-API-KEY": "otra"}}
+    assert player.replay("POST", "https://google.serper.dev/search", replay_kwargs).json() == {"organic": [1]}
+    assert player.replay("POST", "https://google.serper.dev/search", replay_kwargs).json() == {"organic": [2]}
+    # Agotadas las grabaciones se repite la última
+    assert player.replay("POST", "https://google.serper.dev/search", replay_kwargs).json() == {"organic": [2]}
+
+    limited = player.replay("GET", "https://api.clickup.com/api/v2/task/1", {})
+    assert limited.status_code == 429
+    assert limited.headers["Retry-After"] == "7"
+    assert "X-Otro" not in limited.headers
+
+    with pytest.raises(CassetteMissError):
+        player.replay("POST", "https://google.serper.dev/search", {"json": {"q": "otra"}})
+    assert player.misses == 1
+
+def test_cassette_reads_interrupted_recording(tmp_path):
+    path = str(tmp_path / "cassette.jsonl.gz")
+    recorder = Cassette(path, RECORD)
+    recorder.record("GET", "https://example.com/a", {}, make_response(200, "a"), 0.1)
+    # Sin close: la respuesta ya quedó escrita
+    assert len(Cassette.load(path)) == 1
+    recorder.close()
@@ -0,0 +1,106 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from integrations.openrouter import OpenRouterLLM
+from utils.deadline import submit_in_context
+from utils.usage import UsageLog, UsageMeter, aggregate, current_usage, usage_allows, usage_scope
+
+def call(step: str, prompt_tokens: int = 0, completion_tokens: int = 0, cost: float = 0.0,
+         day: str = "2026-10-17", **extra) -> dict:
+    return dict({"day": day, "step": step, "model": "m", "prompt_tokens": prompt_tokens,
+                 "completion_tokens": completion_tokens, "cost": cost, "latency": 1.0}, **extra)
+
+# Presupuesto por mención
+
+def test_meter_token_budget():
+    meter = UsageMeter(token_budget=100)
+    meter.add(call("legal.answer", 40, 20))
+    assert meter.tokens == 60 and not meter.exhausted
+    meter.add(call("legal.thought", 30, 10))
+    assert meter.exhausted
+
+def test_meter_cost_budget_and_no_limit():
+    meter = UsageMeter(cost_budget=0.01)
+    meter.add(call("synthesis", 1000, 1000, cost=0.004))
+    assert not meter.exhausted
+    meter.add(call("synthesis", cost=0.006))
+    assert meter.exhausted
+
+    unlimited = UsageMeter()
+    unlimited.add(call("synthesis", 10 ** 6, 10 ** 6, cost=100.0))
+    assert not unlimited.exhausted
+
+def test_usage_allows_follows_scope_and_threads():
+    assert usage_allows() and current_usage() is None
+    meter = UsageMeter(token_budget=10)
+    executor = ThreadPoolExecutor(max_workers=1)
+    with usage_scope(meter):
+        assert submit_in_context(executor, usage_allows).result()
+        meter.add(call("planning", 10))
+        assert not usage_allows()
+        assert not submit_in_context(executor, usage_allows).result()
+    assert usage_allows()
+    executor.shutdown()
+
+def test_meter_by_step_sorted_by_cost():
+    meter = UsageMeter()
+    meter.add(call("legal.thought", 10, 5, cost=0.001))
+    meter.add(call("synthesis", 100, 50, cost=0.01))
+    meter.add(call("legal.thought", 10, 5, cost=0.001, cached=True))
+    steps = meter.by_step()
+    assert list(steps) == ["synthesis", "legal.thought"]
+    assert steps["legal.thought"]["calls"] == 2 and steps["legal.thought"]["cached"] == 1
+    assert aggregate([call(None)])["-"]["calls"] == 1
+
+def test_llm_calls_are_metered(tmp_path):
+    log = UsageLog(str(tmp_path / "llm_usage.jsonl"))
+    llm = OpenRouterLLM("test", usage_log=log)
+    meter = UsageMeter(label="mencion-1")
+    with usage_scope(meter):
+        llm._log_call("m", "legal.answer", 1.5, {"prompt_tokens": 10, "completion_tokens": 5, "cost": 0.002})
+        llm._log_call("m", "legal.answer", 0.0, {}, cached=True)
+    llm._log_call("m", "coordinator.thought", 0.5, {"prompt_tokens": 3})
+    assert meter.tokens == 15 and len(meter.records) == 2
+    assert meter.records[0]["mention"] == "mencion-1"
+    assert [record["mention"] for record in log.records()] == ["mencion-1", "mencion-1", None]
+
+# Registro diario
+
+def test_usage_log_creates_directory(tmp_path):
+    log = UsageLog(str(tmp_path / "cache" / "uso" / "llm_usage.jsonl"))
+    log.append(call("synthesis", 10, 5))
+    assert len(log.records()) == 1
+
+def test_usage_log_day_totals_are_kept_on_append(tmp_path):
+    path = tmp_path / "llm_usage.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(call("synthesis", 10, 5, cost=0.01)) + "\n")
+        f.write(json.dumps(call("synthesis", 1, 1, day="2026-10-16")) + "\n")
+        f.write('{"day": "2026-10-17", "step": "incompleta"\n')
+    log = UsageLog(str(path))
+    reads = []
+    read = log._read
+    log._read = lambda: reads.append(1) or read()
+
+    assert log.day_totals("2026-10-17")["cost"] == 0.01
+    log.append(call("legal.answer", 20, 10, cost=0.02))
+    log.append(call("legal.answer", 1, 1, day="2026-10-18"))
+    totals = log.day_totals("2026-10-17")
+    assert (totals["calls"], totals["prompt_tokens"], totals["completion_tokens"]) == (2, 30, 15)
+    assert round(totals["cost"], 6) == 0.03
+    assert log.day_totals("2026-10-18")["calls"] == 1
+    assert log.day_totals("2026-01-01")["calls"] == 0
+    # Solo la primera consulta lee el archivo
+    assert len(reads) == 1
+    # Los totales coinciden con el resumen calculado desde el archivo
+    summary = log.daily_summary("2026-10-17", key="day")["2026-10-17"]
+    assert summary["calls"] == totals["calls"] and summary["cost"] == totals["cost"]
+
+def test_usage_log_daily_summary_by_key(tmp_path):
+    log = UsageLog(str(tmp_path / "llm_usage.jsonl"))
+    log.append(call("legal.answer", 10, 5, cost=0.001, mention="a"))
+    log.append(call("synthesis", 10, 5, cost=0.01, mention="a"))
+    log.append(call("synthesis", 10, 5, cost=0.01, mention="b"))
+    assert list(log.daily_summary("2026-10-17")) == ["synthesis", "legal.answer"]
+    assert log.daily_summary("2026-10-17", key="mention")["a"]["calls"] == 2
+    assert log.daily_summary("2026-10-16") == {}